@@ -0,0 +1,284 @@
+""" Keeps the availability of each resource by day in memory, for the
+overview calendar.
+
+The overview asks for the availability of many resources over a whole month
+on every navigation. Instead of going through all allocations every time,
+the availability of each resource and day is stored in this module and only
+recalculated when the allocations or reservations of that day change.
+
+The cached values are the sums needed by
+:meth:`libres.db.queries.Queries.availability_by_allocations`, which is why
+any number of resources and days can be combined without going back to the
+database. The exposure is checked when reading from the cache, as it depends
+on the current user. To get the same result as checking each allocation,
+the sums of a day are kept separately for each start date of the
+allocations, which is what the exposure looks at.
+
+Since the cache lives in the memory of a single process, changes made by
+other Zope instances are only seen once the cached values reach max_age.
+
+"""
+
+import threading
+import time
+import transaction
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+from uuid import UUID
+
+import sedate
+
+from libres.db.models import Allocation
+from libres.modules import events
+from sqlalchemy.orm import joinedload
+
+from seantis.reservation import utils
+
+
+# the number of seconds after which a cached day is calculated anew
+max_age = 60
+
+# (context name, resource uuid) -> {day: (timestamp, {date: DayAvailability})}
+_cache = {}
+_cache_lock = threading.Lock()
+
+DayAvailability = namedtuple('DayAvailability', ['total', 'count', 'expected'])
+
+# stand-in for the allocation passed to the exposure function, which only
+# looks at the resource and the start date of the allocation
+ExposedDay = namedtuple('ExposedDay', ['mirror_of', 'start'])
+
+empty_day = DayAvailability(0, 0, 0)
+
+
+def exposed_day(resource, date):
+    return ExposedDay(resource, datetime.combine(date, datetime.min.time()))
+
+
+def cache_key(context_name, resource):
+    return context_name, UUID(utils.string_uuid(resource))
+
+
+def days_in_range(start, end):
+    day, last = start.date(), end.date()
+
+    while day <= last:
+        yield day
+        day += timedelta(days=1)
+
+
+def availability_by_day(context, start, end, resources, is_exposed):
+    """ Returns the same result as
+    :meth:`libres.db.queries.Queries.availability_by_day` (a dictionary with
+    a tuple of availability and resources for each day), using the cache
+    wherever possible.
+
+    :context: The libres context of the resources.
+    :is_exposed: The exposure function (see exposure.for_allocations).
+
+    """
+
+    start = sedate.to_timezone(start, 'UTC')
+    end = sedate.to_timezone(end, 'UTC')
+
+    days = tuple(days_in_range(start, end))
+    keys = dict((cache_key(context.name, r), r) for r in resources)
+
+    now = time.time()
+    cached = {}
+    missing = []
+
+    with _cache_lock:
+        for key in keys:
+            entries = _cache.get(key, {})
+
+            if all(now - entries.get(d, (0, ))[0] < max_age for d in days):
+                cached[key] = dict((d, entries[d][1]) for d in days)
+            else:
+                missing.append(key)
+
+    if missing:
+        cached.update(load_days(context, days, [k[1] for k in missing]))
+
+    result = {}
+
+    for day in days:
+        total, count, expected = 0, 0, 0
+        members = set()
+
+        for key in keys:
+            for date, value in cached[key][day].items():
+
+                if not is_exposed(exposed_day(key[1], date)):
+                    continue
+
+                total += value.total
+                count += value.count
+                expected += value.expected
+                members.add(key[1])
+
+        if not members:
+            continue
+
+        if expected:
+            total += (expected - count) * 100
+            result[day] = (total / expected, members)
+        else:
+            result[day] = (0, members)
+
+    return result
+
+
+def load_days(context, days, resources):
+    """ Calculates the availability of the given resources for the given
+    days and stores the result in the cache. All days of all resources
+    are loaded in one query.
+
+    """
+    session = context.get_service('session_provider').session()
+
+    start = sedate.replace_timezone(
+        datetime.combine(days[0], datetime.min.time()), 'UTC'
+    )
+    end = sedate.replace_timezone(
+        datetime.combine(days[-1], datetime.max.time()), 'UTC'
+    )
+
+    query = session.query(Allocation)
+    query = query.filter(Allocation.mirror_of.in_(resources))
+    query = query.filter(start <= Allocation._start)
+    query = query.filter(Allocation._start <= end)
+    query = query.options(joinedload(Allocation.reserved_slots))
+
+    # (resource, day) -> {start date: DayAvailability}, the day being the
+    # one the overview shows the allocation on and the start date being the
+    # one the exposure is checked with
+    sums = {}
+
+    for allocation in query:
+        key = (allocation.mirror_of, allocation._start.date())
+        dates = sums.setdefault(key, {})
+        date = allocation.start.date()
+
+        total, count, expected = dates.get(date, empty_day)
+
+        total += allocation.availability
+        count += 1
+
+        if allocation.is_master:
+            expected += allocation.quota
+
+        dates[date] = DayAvailability(total, count, expected)
+
+    now = time.time()
+    loaded = {}
+
+    with _cache_lock:
+        for resource in resources:
+            key = (context.name, resource)
+            values = dict(
+                (d, sums.get((resource, d), {})) for d in days
+            )
+
+            entries = dict(
+                (d, v) for d, v in _cache.get(key, {}).items()
+                if now - v[0] < max_age
+            )
+            entries.update((d, (now, v)) for d, v in values.items())
+
+            _cache[key] = entries
+            loaded[key] = values
+
+    return loaded
+
+
+def invalidate(context_name, resource, dates=None):
+    """ Removes the given dates of the given resource from the cache. If no
+    dates are given, all days of the resource are removed.
+
+    The days are removed again after the current transaction has been
+    committed, as other threads might have cached the old state in the
+    meantime.
+
+    """
+    key = cache_key(context_name, resource)
+    days = dates and set(
+        sedate.to_timezone(d, 'UTC').date() for d in dates if d
+    )
+
+    def remove(*args):
+        with _cache_lock:
+            if not days:
+                _cache.pop(key, None)
+            else:
+                entries = _cache.get(key, {})
+
+                for day in days:
+                    entries.pop(day, None)
+
+    remove()
+    transaction.get().addAfterCommitHook(remove)
+
+
+def clear_cache():
+    """ Clears the whole cache, for testing. """
+    with _cache_lock:
+        _cache.clear()
+
+
+def reservation_dates(reservation):
+    """ Returns the days touched by the given reservation or None if all
+    days of the resource are affected.
+
+    """
+    if reservation.target_type != u'allocation':
+        return None
+
+    # the allocation holding the reservation may start a day earlier
+    return (
+        reservation.start - timedelta(days=1),
+        reservation.start,
+        reservation.end
+    )
+
+
+def on_allocations_added(context, allocations):
+    for allocation in allocations:
+        invalidate(context.name, allocation.mirror_of, (allocation._start, ))
+
+
+def on_reservations_changed(context, reservations, *args):
+    for reservation in reservations:
+        invalidate(
+            context.name, reservation.resource, reservation_dates(reservation)
+        )
+
+
+def on_reservation_time_changed(context, reservation, old_time, new_time):
+    invalidate(context.name, reservation.resource, (
+        old_time[0] - timedelta(days=1), old_time[0], old_time[1],
+        new_time[0] - timedelta(days=1), new_time[0], new_time[1]
+    ))
+
+
+def setup_invalidation():
+    """ Hooks the cache invalidation into the libres events. Changes to
+    allocations which are not covered by libres events are handled by the
+    CustomScheduler.
+
+    """
+
+    handlers = (
+        (events.on_allocations_added, on_allocations_added),
+        (events.on_reservations_made, on_reservations_changed),
+        (events.on_reservations_confirmed, on_reservations_changed),
+        (events.on_reservations_approved, on_reservations_changed),
+        (events.on_reservations_denied, on_reservations_changed),
+        (events.on_reservations_removed, on_reservations_changed),
+        (events.on_reservation_time_changed, on_reservation_time_changed),
+    )
+
+    for event, handler in handlers:
+        if handler not in event:
+            event.append(handler)
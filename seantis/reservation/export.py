@@ -1,9 +1,13 @@
 import codecs
+import csv
 import isodate
+import json
+import six
 
 from copy import copy
 from collections import namedtuple
 from datetime import datetime, date, time
+from StringIO import StringIO
 
 from five import grok
 from zope import schema
@@ -26,7 +30,9 @@ from seantis.reservation import exports
 from seantis.reservation.form import extract_action_data
 from seantis.reservation.base import BaseView, BaseForm
 
-Source = namedtuple('Source', ['id', 'title', 'description', 'method'])
+Source = namedtuple(
+    'Source', ['id', 'title', 'description', 'method', 'stream']
+)
 
 sources = [
     Source(
@@ -38,6 +44,10 @@ sources = [
         lambda resources, language, year, month, transform_record:
         exports.reservations.dataset(
             resources, language, year, month, transform_record, compact=False
+        ),
+        lambda resources, language, year, month, transform_record:
+        exports.reservations.stream(
+            resources, language, year, month, transform_record, compact=False
         )
     ),
 
@@ -51,6 +61,10 @@ sources = [
         lambda resources, language, year, month, transform_record:
         exports.reservations.dataset(
             resources, language, year, month, transform_record, compact=True
+        ),
+        lambda resources, language, year, month, transform_record:
+        exports.reservations.stream(
+            resources, language, year, month, transform_record, compact=True
         )
     )
 ]
@@ -239,6 +253,63 @@ def convert_boolean_to_yes_no(record):
             record[ix] = _(u'Yes') if value is True else _(u'No')
 
 
+def csv_chunks(headers, records, rows_per_chunk=100):
+    """ Yields the csv file of the given headers and records in chunks
+    of rows_per_chunk rows, encoded in utf-8.
+
+    """
+
+    def encode(value):
+        if value is None:
+            return ''
+
+        return six.text_type(value).encode('utf-8')
+
+    output = StringIO()
+    writer = csv.writer(output)
+
+    writer.writerow(map(encode, headers))
+
+    for ix, record in enumerate(records):
+        writer.writerow(map(encode, record))
+
+        if (ix + 1) % rows_per_chunk == 0:
+            yield output.getvalue()
+
+            output.seek(0)
+            output.truncate()
+
+    yield output.getvalue()
+
+
+def json_chunks(headers, records, rows_per_chunk=100):
+    """ Yields the json list of the given headers and records in chunks
+    of rows_per_chunk rows, each record being an object keyed by header.
+
+    """
+
+    chunk = ['[']
+
+    for ix, record in enumerate(records):
+        if ix > 0:
+            chunk.append(', ')
+
+        chunk.append(json.dumps(utils.OrderedDict(zip(headers, record))))
+
+        if (ix + 1) % rows_per_chunk == 0:
+            yield ''.join(chunk)
+            del chunk[:]
+
+    chunk.append(']')
+    yield ''.join(chunk)
+
+
+streaming_formats = {
+    'csv': csv_chunks,
+    'json': json_chunks
+}
+
+
 def prepare_record(record, target_format):
 
     if target_format in ('xls', 'xlsx'):
@@ -300,6 +371,28 @@ class ExportView(BaseView, form.ResourceParameterView):
             transform_record
         )
 
+    @property
+    def is_streamed(self):
+        return self.file_extension in streaming_formats
+
+    def stream(self):
+        """ Yields the export in chunks, without ever holding all
+        reservations in memory. Only available for the streaming_formats.
+
+        """
+        source = self.get_source_by_id(self.request.get('source'))
+        transform_record = lambda r: prepare_record(r, self.file_extension)
+
+        headers, records = source.stream(
+            self.resources,
+            self.language,
+            self.year,
+            self.month,
+            transform_record
+        )
+
+        return streaming_formats[self.file_extension](headers, records)
+
     @property
     def filename(self):
         parts = []
@@ -323,9 +416,7 @@ class ExportView(BaseView, form.ResourceParameterView):
 
         return '.'.join(parts)
 
-    def render(self, **kwargs):
-        output = getattr(self.source(), self.file_extension)
-
+    def set_headers(self, content_length=None):
         RESPONSE = self.request.RESPONSE
         RESPONSE.setHeader(
             "Content-disposition",
@@ -334,7 +425,24 @@ class ExportView(BaseView, form.ResourceParameterView):
         RESPONSE.setHeader(
             "Content-Type", "{};charset=utf-8".format(self.content_type)
         )
-        RESPONSE.setHeader("Content-Length", len(output))
+
+        if content_length is not None:
+            RESPONSE.setHeader("Content-Length", content_length)
+
+    def render(self, **kwargs):
+
+        # streamed exports are written to the response as they are
+        # generated, so the content length is not known beforehand
+        if self.is_streamed:
+            self.set_headers()
+
+            for chunk in self.stream():
+                self.request.RESPONSE.write(chunk)
+
+            return ''
+
+        output = getattr(self.source(), self.file_extension)
+        self.set_headers(len(output))
 
         return output
 
@@ -3,14 +3,19 @@ import tablib
 from zope import i18n
 from zope.i18nmessageid import Message
 
+from sqlalchemy.orm import undefer
 from sqlalchemy.sql.expression import extract
 
 from seantis.reservation import _
+from seantis.reservation import metadata
 from seantis.reservation import Session
 from seantis.reservation import utils
 from seantis.reservation.form import ReservationDataView
 from libres.db.models import Reservation
 
+# the number of reservations loaded from the database at once
+batch_size = 500
+
 
 class Translator(object):
 
@@ -71,63 +76,91 @@ def dataset(
 
     """
 
+    headers, records = stream(
+        resources, language, year, month, transform_record, compact
+    )
+
+    # put the results in a tablib dataset
+    return generate_dataset(headers, records)
+
+
+def stream(
+    resources, language, year, month, transform_record=None, compact=False
+):
+    """ Returns the headers and a generator yielding the records of the
+    dataset described in :func:`dataset`.
+
+    The reservations are read from the database in batches, so the memory
+    used stays the same, no matter how many reservations are exported.
+
+    """
+
     translator = Translator(language)
-    reservations = fetch_records(resources, year, month)
 
     # create the headers
     headers = translator.translate(basic_headers())
-    dataheaders = additional_headers(reservations)
+    dataheaders = additional_headers(
+        fetch_records(resources, year, month, data_only=True)
+    )
     headers.extend(dataheaders)
 
-    # use dataview for display info helper view (yep, could be nicer)
-    dataview = ReservationDataView()
+    index = header_index(dataheaders)
+
+    def records():
+
+        # use dataview for display info helper view (yep, could be nicer)
+        dataview = ReservationDataView()
+
+        # for each reservation get a record per timeslot (which is a single
+        # slot for reservations targeting an allocation and n slots for a
+        # reservation targeting a group)
+        for r in fetch_records(resources, year, month):
+
+            token = utils.string_uuid(r.token)
+            resource = resources[utils.string_uuid(r.resource)]
+
+            if compact:
+                timespans = utils.unite_dates(r.timespans())
+            else:
+                timespans = r.timespans()
+
+            for start, end in timespans:
+                record = [
+                    get_parent_title(resource),
+                    get_title(resource),
+                    token,
+                    r.email,
+                    start,
+                    end,
+                    utils.whole_day(start, end),
+                    _(r.status.capitalize()),
+                    r.quota,
+                    r.created,
+                    r.modified and r.modified or None,
+                ]
+                record.extend(
+                    additional_columns(
+                        r, dataheaders, dataview.display_reservation_data,
+                        index
+                    )
+                )
 
-    # for each reservation get a record per timeslot (which is a single slot
-    # for reservations targeting an allocation and n slots for a reservation
-    # targeting a group)
-    records = []
-    for r in reservations:
+                if callable(transform_record):
+                    transform_record(record)
 
-        token = utils.string_uuid(r.token)
-        resource = resources[utils.string_uuid(r.resource)]
-
-        if compact:
-            timespans = utils.unite_dates(r.timespans())
-        else:
-            timespans = r.timespans()
-
-        for start, end in timespans:
-            record = [
-                get_parent_title(resource),
-                resource.title,
-                token,
-                r.email,
-                start,
-                end,
-                utils.whole_day(start, end),
-                _(r.status.capitalize()),
-                r.quota,
-                r.created,
-                r.modified and r.modified or None,
-            ]
-            record.extend(
-                additional_columns(
-                    r, dataheaders, dataview.display_reservation_data
-                )
-            )
+                translator.translate(record)
+                yield record
 
-            if callable(transform_record):
-                transform_record(record)
+    return headers, records()
 
-            translator.translate(record)
-            records.append(record)
 
-    # put the results in a tablib dataset
-    return generate_dataset(headers, records)
+def fetch_records(resources, year, month, data_only=False):
+    """ Returns the records used for the dataset. The records are fetched
+    from the database in batches of batch_size, as they are needed.
 
+    If data_only is True, only the data of the reservations is loaded.
 
-def fetch_records(resources, year, month):
-    """ Returns the records used for the dataset. """
+    """
     if not resources.keys():
         return []
 
@@ -148,7 +181,13 @@ def fetch_records(resources, year, month):
         Reservation.token,
     )
 
-    return query.all()
+    if data_only:
+        query = query.with_entities(Reservation.data)
+    else:
+        query = query.options(undefer('data'), undefer('created'))
+        query = query.options(undefer('modified'))
+
+    return query.yield_per(batch_size)
 
 
 def fieldkey(form, field):
@@ -156,44 +195,74 @@ def fieldkey(form, field):
     return '%s.%s' % (form["desc"], field["desc"])
 
 
+def field_keys(form):
+    """ Returns the fieldkeys of all fields of the given form, in the order
+    of the fields. Equivalent to calling :func:`fieldkey` for each field.
+
+    """
+    desc = form["desc"]
+    return ['%s.%s' % (desc, field["desc"]) for field in form["values"]]
+
+
 def additional_headers(reservations):
     """ Go through all reservations and build a list of all possible headers.
 
     """
 
-    formdata = [r.data.values() for r in reservations if r.data]
-
     headers = []
-    for forms in formdata:
-        for form in forms:
+    index = {}
+
+    for r in reservations:
+        if not r.data:
+            continue
+
+        for form in r.data.values():
+
+            # most reservations share the same fields, so the sorting is
+            # skipped unless there is at least one unknown key
+            keys = field_keys(form)
+            if all(key in index for key in keys):
+                continue
+
             for field in sorted(form["values"], key=lambda f: f["sortkey"]):
 
-                # A set could be used here, but then a separate step for
-                # sorting would be needed
+                # the index is only used for the lookup, the list keeps
+                # the order in which the keys were found
                 key = fieldkey(form, field)
-                if key not in headers:
+                if key not in index:
+                    index[key] = len(headers)
                     headers.append(key)
 
     return headers
 
 
-def additional_columns(reservation, headers, display_info=lambda x: x):
+def header_index(headers):
+    """ Returns a dictionary with the position of each header. """
+    return dict((key, ix) for ix, key in enumerate(headers))
+
+
+def additional_columns(
+    reservation, headers, display_info=lambda x: x, index=None
+):
     """ Given a reservation and the list of additional headers return a list
     of columns filled with either None or the value of the json data.
 
     The resulting list will always be of the same length as the given headers
     list.
 
+    Pass the result of :func:`header_index` as index when calling this
+    function for more than one reservation with the same headers.
+
     """
     forms = reservation.data and reservation.data.values() or []
 
+    if index is None:
+        index = header_index(headers)
+
     columns = [None] * len(headers)
     for form in forms:
-        for field in form["values"]:
-            key = fieldkey(form, field)
-            idx = headers.index(key)
-
-            columns[idx] = field["value"]
+        for key, field in zip(field_keys(form), form["values"]):
+            columns[index[key]] = field["value"]
 
     return columns
 
@@ -208,9 +277,10 @@ def generate_dataset(headers, records):
     return ds
 
 
+def get_title(resource):
+    return metadata.get_metadata(resource).title
+
+
 def get_parent_title(resource):
     # a parent will almost always be present, but it isn't a requirement
-    try:
-        return resource.aq_inner.aq_parent.title
-    except AttributeError:
-        return None
+    return metadata.parent_title(resource)
@@ -1,11 +1,14 @@
 from uuid import UUID
 
+from AccessControl import getSecurityManager
+from zope.annotation.interfaces import IAnnotations
 from zope.security import checkPermission
 from zope.component import getMultiAdapter
+from zope.component.hooks import getSite
 
-from seantis.reservation.utils import is_uuid, get_resource_by_uuid
+from seantis.reservation.utils import is_uuid, get_resources_by_uuids
 from seantis.reservation.utils import string_uuid, real_uuid
-from seantis.reservation.timeframe import timeframes_by_context
+from seantis.reservation.timeframe import timeframe_index
 
 
 def for_allocations(resources):
@@ -17,16 +20,19 @@ def for_allocations(resources):
     """
 
     # get a dictionary with uuids as keys and resources as values
-    def get_object(obj):
-        if is_uuid(obj):
-            return UUID(obj), get_resource_by_uuid(obj)
-        else:
-            return UUID(obj.uuid()), obj
+    resources = list(resources)
+    uuids = [o for o in resources if is_uuid(o)]
+    brains = get_resources_by_uuids(uuids)
 
-    resource_objects = dict([get_object(o) for o in resources])
+    resource_objects = dict(
+        (UUID(o), brains[o]) if is_uuid(o) else (UUID(o.uuid()), o)
+        for o in resources
+    )
 
     # get timeframes for each uuid
     timeframes = {}
+    index = None
+
     for uuid, resource in resource_objects.items():
 
         # Don't load the timeframes of the resources for which the user has
@@ -34,11 +40,12 @@ def for_allocations(resources):
         # 'is_exposed'
         if checkPermission(
                 'seantis.reservation.ViewHiddenAllocations', resource):
-            timeframes[uuid] = []
+            timeframes[uuid] = None
         elif resource is None:
-            timeframes[uuid] = [None]
+            timeframes[uuid] = False
         else:
-            timeframes[uuid] = timeframes_by_context(resource)
+            index = index or timeframe_index()
+            timeframes[uuid] = index.for_context(resource)
 
     # returning closure
     def is_exposed(allocation):
@@ -47,23 +54,43 @@ def for_allocations(resources):
         # as plone objects
         frames = timeframes[allocation.mirror_of]
 
-        if frames is None or len(frames) == 0:
+        if frames is None:
             return True
 
-        if frames == [None]:
+        if frames is False:
             return False
 
         # the start date is relevant
-        day = allocation.start.date()
-        for frame in frames:
-            if frame.start <= day and day <= frame.end:
-                return frame.visible()
-
-        return False
+        return frames.is_visible(allocation.start.date())
 
     return is_exposed
 
 
+def cached_for_allocations(resources):
+    """Same as :func:`for_allocations`, but the function is only built once
+    per request for the current user and the given resources.
+
+    """
+
+    resources = list(resources)
+
+    cache = user_cache(
+        getattr(getSite(), 'REQUEST', None),
+        'seantis.reservation.exposure.allocations'
+    )
+
+    # a changed timeframe leads to a new version, even during the request
+    key = (
+        frozenset(string_uuid(r) for r in resources),
+        timeframe_index().version
+    )
+
+    if key not in cache:
+        cache[key] = for_allocations(resources)
+
+    return cache[key]
+
+
 def for_views(context, request):
     """Returns a function which takes a viewname and returns true if the user
     has the right to see the view.
@@ -103,20 +130,74 @@ def for_calendar(resource):
     return is_exposed
 
 
+def visibility_cache(resources):
+    """Returns the dictionary used to store the visibility of resources for
+    the current user, which lives as long as the current request. If there's
+    no request, an empty dictionary is returned.
+
+    """
+
+    request = next(
+        (getattr(r, 'REQUEST', None) for r in resources), None
+    )
+
+    return user_cache(request, 'seantis.reservation.exposure.visibility')
+
+
+def user_cache(request, key):
+    """Returns the dictionary stored on the given request under the given
+    key for the current user. If there's no request, an empty dictionary is
+    returned.
+
+    """
+
+    if request is None:
+        return {}
+
+    try:
+        annotations = IAnnotations(request)
+    except TypeError:
+        return {}
+
+    cache = annotations.setdefault(key, {})
+
+    return cache.setdefault(getSecurityManager().getUser().getId(), {})
+
+
+def visible_resources(resources):
+    """Returns a set with the uuids of the given resources which are visible
+    to the current user. The result of the permission check is stored for
+    the duration of the request.
+
+    """
+
+    resources = list(resources)
+    cache = visibility_cache(resources)
+
+    visible = set()
+
+    for r in resources:
+        uuid = string_uuid(r)
+
+        if uuid not in cache:
+            cache[uuid] = checkPermission('zope2.View', r)
+
+        if cache[uuid]:
+            visible.add(uuid)
+
+    return visible
+
+
 def for_resources(resources):
     """Returns a function which takes a resource (object or uuid) and
     returns true if it is visible to the current user.
 
     """
 
-    visible_resources = []
-
-    for r in resources:
-        if checkPermission('zope2.View', r):
-            visible_resources.append(string_uuid(r))
+    visible = visible_resources(resources)
 
     def is_exposed(resource):
-        return string_uuid(resource) in visible_resources
+        return string_uuid(resource) in visible
 
     return is_exposed
 
@@ -138,16 +219,11 @@ def limit_resources(resources):
     else:
         resdict = resources
 
-    is_exposed = for_resources(resdict.values())
-
-    to_remove = []
+    visible = visible_resources(resdict.values())
 
     for key, resource in resdict.items():
-        if not is_exposed(resource):
-            to_remove.append(key)
-
-    for key in to_remove:
-        del resdict[key]
+        if string_uuid(resource) not in visible:
+            del resdict[key]
 
     if is_list:
         return resdict.values()
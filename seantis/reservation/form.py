@@ -247,8 +247,7 @@ class ResourceBaseForm(GroupForm, form.Form):
 
         self.request.response.redirect(url)
 
-    @property
-    @utils.memoize
+    @utils.cached_property
     def scheduler(self):
         """ Returns the scheduler of the resource. """
         language = utils.get_current_language(self.context, self.request)
@@ -416,12 +415,11 @@ class ResourceParameterView(object):
     def resources(self):
         objs = dict()
 
-        for uuid in self.uuids:
-            try:
-                objs[uuid] = utils.get_resource_by_uuid(uuid) \
-                    .getObject()
-            except AttributeError:
-                continue
+        brains = utils.get_resources_by_uuids(self.uuids)
+
+        for uuid, brain in brains.items():
+            if brain is not None:
+                objs[uuid] = brain.getObject()
 
         return objs
 
@@ -66,9 +66,94 @@ var CalendarGroups = function() {
                 calendar.is_resizing = false;
                 calendar.is_moving = false;
 
-                // refetch the calendar events
+                // the version and range of the events shown, used to only
+                // fetch the events which changed since (see slots-delta)
+                calendar.version = null;
+                calendar.range = null;
+
+                // fetches the events of the given range, storing the version
+                calendar.fetch = function(start, end, callback) {
+                    var params = {
+                        start: Math.round(start.getTime() / 1000),
+                        end: Math.round(end.getTime() / 1000)
+                    };
+
+                    $.ajax({
+                        url: calendar.eventurl,
+                        data: params,
+                        dataType: 'json',
+                        success: function(events, status, xhr) {
+                            calendar.version = xhr.getResponseHeader(
+                                'X-Seantis-Version'
+                            );
+                            calendar.range = params;
+                            callback(seantis.contextmenu.prepare(
+                                events, calendar.menus
+                            ));
+                        },
+                        error: function() {
+                            // end the loading state of the calendar, the
+                            // next refetch loads all events again
+                            calendar.version = null;
+                            callback([]);
+                        }
+                    });
+                };
+
+                // refetch the calendar events, patching the shown events with
+                // the ones that changed since the last fetch if possible
                 calendar.refetch = function() {
-                    calendar.element.fullCalendar('refetchEvents');
+                    if (!calendar.deltaurl || !calendar.version) {
+                        calendar.element.fullCalendar('refetchEvents');
+                        return;
+                    }
+
+                    var params = $.extend(
+                        {version: calendar.version}, calendar.range
+                    );
+
+                    var refetch_all = function() {
+                        calendar.version = null;
+                        calendar.element.fullCalendar('refetchEvents');
+                    };
+
+                    $.ajax({
+                        url: calendar.deltaurl,
+                        data: params,
+                        dataType: 'json',
+                        success: function(delta) {
+                            if (delta.full) {
+                                refetch_all();
+                                return;
+                            }
+
+                            calendar.patch(
+                                seantis.contextmenu.prepare(
+                                    delta.events, calendar.menus
+                                ), delta.ids
+                            );
+                            calendar.version = delta.version;
+                        },
+                        // the shown events may be outdated
+                        error: refetch_all
+                    });
+                };
+
+                // replaces the events of the changed allocations and removes
+                // the events of the allocations which no longer exist
+                calendar.patch = function(events, ids) {
+                    var changed = _.pluck(events, 'allocation');
+                    var is_outdated = function(event) {
+                        return !_.contains(ids, event.allocation) ||
+                            _.contains(changed, event.allocation);
+                    };
+
+                    calendar.groups.clear();
+                    calendar.element.fullCalendar('removeEvents', is_outdated);
+
+                    _.each(events, function(event) {
+                        calendar.element.fullCalendar('renderEvent', event);
+                    });
                 };
 
                 // have an event listener in place to refetch the calendar
@@ -371,7 +456,7 @@ var CalendarGroups = function() {
 
         // move an event
         var move_event = function(event, calendar) {
-            var url = event.moveurl;
+            var url = seantis.contextmenu.expand(event).moveurl;
             url += '&start=' + get_timestamp(event.start);
             url += '&end=' + get_timestamp(event.end);
 
@@ -448,6 +533,14 @@ var CalendarGroups = function() {
             $.extend(options, seantis.locale.fullcalendar());
             $.extend(options, seantis.calendars.defaults);
             $.extend(options, calendar.options);
+
+            // fetch the events through the calendar, to keep their version
+            // and to link them with their menus
+            if (_.isString(options.events)) {
+                calendar.eventurl = options.events;
+                options.events = calendar.fetch;
+            }
+
             calendar.element.fullCalendar(options);
         });
 
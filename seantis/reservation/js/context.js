@@ -2,6 +2,8 @@ if (!this.seantis) this.seantis = {};
 
 // adds a context menu to an event
 seantis.contextmenu = function(event, element, calendar) {
+    seantis.contextmenu.expand(event);
+
     var content = seantis.contextmenu.build(event);
     if (!content) {
         return;
@@ -58,6 +60,7 @@ seantis.contextmenu = function(event, element, calendar) {
 // returns false if the event has more than one menu item
 // returns the url of the menu item if there's only one
 seantis.contextmenu.simple = function(event) {
+    seantis.contextmenu.expand(event);
 
     if (event.menuorder.length > 1) {
         return false;
@@ -117,4 +120,71 @@ seantis.contextmenu.build = function(event) {
     }
 
     return html;
-};
\ No newline at end of file
+};
+
+// the events only carry the key of their menu template and the parameters
+// which differ between the events (see Slots.menu_templates), the templates
+// are sent once per calendar:
+//
+// menus {
+//      <menukey>: {
+//          url:   <default url>
+//          move:  <move url>
+//          menu:  <see build, with placeholders in the urls>
+//          order: [ order of menu <groupnames> ]
+//      }
+// }
+//
+// replaces the placeholders (__name__) of the given url with the parameters
+seantis.contextmenu.fill = function(url, params) {
+    return url.replace(/__([a-z]+)__/g, function(placeholder, name) {
+        return encodeURIComponent(params[name]);
+    });
+};
+
+// returns the parameters of the menu of the given event
+seantis.contextmenu.params = function(event) {
+    return $.extend(
+        {id: event.allocation, group: event.group}, event.params
+    );
+};
+
+// links the events with their menu templates and sets the default url, which
+// is needed when the event is rendered, the rest is expanded on demand
+seantis.contextmenu.prepare = function(events, menus) {
+    _.each(events, function(event) {
+        if (_.isUndefined(event.menukey) || !menus) {
+            return;
+        }
+
+        event.template = menus[event.menukey];
+        event.url = seantis.contextmenu.fill(
+            event.template.url, seantis.contextmenu.params(event)
+        );
+    });
+
+    return events;
+};
+
+// expands the menu and the move url of an event prepared by the function above
+seantis.contextmenu.expand = function(event) {
+    if (!_.isUndefined(event.menuorder) || _.isUndefined(event.template)) {
+        return event;
+    }
+
+    var fill = seantis.contextmenu.fill;
+    var params = seantis.contextmenu.params(event);
+    var template = event.template;
+
+    event.menu = {};
+    _.each(template.order, function(group) {
+        event.menu[group] = _.map(template.menu[group], function(item) {
+            return $.extend({}, item, {url: fill(item.url, params)});
+        });
+    });
+
+    event.menuorder = template.order;
+    event.moveurl = fill(template.move, params);
+
+    return event;
+};
@@ -3,10 +3,10 @@ if (!this.seantis.search) {
     this.seantis.search = {};
 }
 
-seantis.search.init_tips = function() {
+seantis.search.init_tips = function(scope) {
     // the show-tooltip class on the body signals the base.css that another
     // style for minitip should be used (miniTip is a global singleton)
-    $('.is-extra-result, .minitip').miniTip({
+    (scope || $(document)).find('.is-extra-result, .minitip').miniTip({
         anchor: 'e',
         fadeIn: 100,
         fadeOut: 100,
@@ -19,24 +19,26 @@ seantis.search.init_tips = function() {
     });
 };
 
-seantis.search.init_select_buttons = function() {
-    var available_checkboxes = $(
-        '.searchresults input[type="checkbox"]:not([disabled])'
-    );
+seantis.search.available_checkboxes = function() {
+    return $('.searchresults input[type="checkbox"]:not([disabled])');
+};
 
+seantis.search.init_select_buttons = function() {
     $('#select-all-searchresults').click(function() {
-        available_checkboxes.prop('checked', true);
+        seantis.search.available_checkboxes().prop('checked', true);
         seantis.search.adjust_button_state_to_selection();
         seantis.search.update_remove_link();
     });
 
     $('#select-no-searchresults').click(function() {
-        available_checkboxes.prop('checked', false);
+        seantis.search.available_checkboxes().prop('checked', false);
         seantis.search.adjust_button_state_to_selection();
         seantis.search.update_remove_link();
     });
+};
 
-    available_checkboxes.change(function() {
+seantis.search.init_rows = function(rows) {
+    rows.find('input[type="checkbox"]:not([disabled])').change(function() {
         seantis.search.adjust_button_state_to_selection();
         seantis.search.update_remove_link();
 
@@ -45,7 +47,7 @@ seantis.search.init_select_buttons = function() {
         );
     });
 
-    $('.searchresults .result-time').click(function() {
+    rows.find('.result-time').click(function() {
         var group = $(this).data('group');
         var checkboxes = $(
             '.searchresults input[type="checkbox"][data-group="' + group + '"'
@@ -55,14 +57,27 @@ seantis.search.init_select_buttons = function() {
             $(checkboxes[0]).click();
         }
     });
+
+    seantis.search.init_highlighting(rows);
+
+    // deselect all groups with extra results by default
+    // would be better to do on the server, but it is much easier here
+    var groups = [];
+    _.each(rows.find('.is-extra-result'), function(extra) {
+        var group = $(extra).data('group');
+        if (groups.indexOf(group) === -1) {
+            seantis.search.select_group(group, false);
+            groups.push(group);
+        }
+    });
 };
 
-seantis.search.init_highlighting = function() {
-    var targets = $(
+seantis.search.init_highlighting = function(rows) {
+    var targets = rows.find(
         [
-            '.searchresults input[type="checkbox"]',
-            '.searchresults .result-time',
-            '.searchresults .is-extra-result'
+            'input[type="checkbox"]',
+            '.result-time',
+            '.is-extra-result'
         ].join(', ')
     );
 
@@ -256,6 +271,9 @@ seantis.search.run_search = function() {
     formdata += '&form.buttons.search=';
     formdata += $('.searchbox input[type="submit"]').val();
 
+    // the results are loaded from the search-results view (see load_next)
+    formdata += '&ajax_search=1';
+
     $('.loading').show();
     $('.resultbox').hide();
 
@@ -268,24 +286,150 @@ seantis.search.run_search = function() {
     });
 };
 
+seantis.search.load_next = function() {
+    "use strict";
+
+    // the following results are loaded as json, one page at a time, when
+    // the end of the table comes within one screen of the visible area
+    var results = $('.searchresults[data-next]');
+
+    if (results.length === 0 || results.data('loading') === true) {
+        return;
+    }
+
+    var table = results.find('.allocations-table');
+    var bottom = table.offset().top + table.outerHeight();
+    var visible = $(window).scrollTop() + $(window).height();
+
+    if (bottom > visible + $(window).height()) {
+        return;
+    }
+
+    results.data('loading', true);
+
+    $.getJSON(results.attr('data-next'), function(data) {
+        results.data('loading', false);
+
+        if (data.next) {
+            results.attr('data-next', data.next);
+        } else {
+            results.removeAttr('data-next');
+        }
+
+        seantis.search.init_rows(seantis.search.append_rows(table, data.rows));
+        seantis.search.update_result_count(results, !data.next);
+
+        if (!data.next && results.find('.result-time').length === 0) {
+            seantis.search.show_no_results(results);
+            return;
+        }
+
+        seantis.search.init_tips(table);
+        seantis.search.adjust_button_state_to_selection();
+        seantis.search.update_remove_link();
+
+        // continue until the table reaches beyond the screen
+        _.defer(seantis.search.load_next);
+    });
+};
+
+seantis.search.update_result_count = function(results, is_complete) {
+    "use strict";
+
+    // the total is only known once the last page has been loaded, until
+    // then the number of results loaded so far is shown as "n+"
+    results.find('.resultcount').text(results.find('.result-time').length);
+
+    if (is_complete) {
+        results.find('.resultmore').remove();
+    }
+};
+
+seantis.search.show_no_results = function(results) {
+    "use strict";
+
+    results.find('.searchresults-header, form').remove();
+    results.find('.noresults').show();
+};
+
+seantis.search.append_rows = function(table, rows) {
+    "use strict";
+
+    // the empty table of the first page carries the hint itself
+    var hint = table.attr('data-hint') ||
+        table.find('.result-hint div').first().attr('title');
+    var last_date = table.find('.result-day').last().text();
+
+    var added = _.map(rows, function(row) {
+        var existing = table.find('.result-time[data-id="' + row.id + '"]');
+
+        // members of a group are included with the first page showing the
+        // group, the row is kept and shown as regular result from now on
+        if (existing.length !== 0) {
+            if (!row.is_extra_result) {
+                existing.closest('tr').find('.is-extra-result').removeClass(
+                    'is-extra-result'
+                );
+            }
+            return null;
+        }
+
+        var unavailable = row['class'].indexOf('unavailable') !== -1;
+        var is_first_of_date = row.date !== last_date;
+        last_date = row.date;
+
+        var tr = $('<tr />').toggleClass('new-day', is_first_of_date);
+
+        var day = $('<td />').appendTo(tr);
+        if (is_first_of_date) {
+            $('<div class="result-day" />').text(row.date).appendTo(day);
+        }
+
+        $('<input type="checkbox" name="allocation_id" />')
+            .val(row.id)
+            .attr('data-group', row.group)
+            .prop('checked', !unavailable)
+            .prop('disabled', unavailable)
+            .appendTo($('<td />').appendTo(tr));
+
+        $('<div />')
+            .addClass('result-time ' + row['class'])
+            .attr('data-id', row.id)
+            .attr('data-group', row.group)
+            .append($('<span />').text(row.time))
+            .append(' ')
+            .append($('<span />').text(row.text))
+            .appendTo($('<td />').appendTo(tr));
+
+        $('<div />')
+            .attr('data-group', row.group)
+            .attr('title', hint)
+            .toggleClass('is-extra-result', row.is_extra_result)
+            .html('&nbsp;')
+            .appendTo($('<td class="result-hint" />').appendTo(tr));
+
+        return tr[0];
+    });
+
+    return $(_.compact(added)).appendTo(table);
+};
+
+seantis.search.init_paging = function() {
+    $(window).off('scroll.search').on('scroll.search', _.throttle(
+        seantis.search.load_next, 100
+    ));
+
+    seantis.search.load_next();
+};
+
 seantis.search.init = function() {
     seantis.search.init_overlays();
     seantis.search.init_select_buttons();
-    seantis.search.init_highlighting();
+    seantis.search.init_rows($('.searchresults'));
     seantis.search.init_tips();
     seantis.search.update_remove_link();
     seantis.search.init_ajax_search();
-
-    // deselect all groups with extra results by default
-    // would be better to do on the server, but it is much easier here
-    var groups = [];
-    _.each($('.searchresults .is-extra-result'), function(extra) {
-        var group = $(extra).data('group');
-        if (groups.indexOf(group) === -1) {
-            seantis.search.select_group(group, false);
-            groups.push(group);
-        }
-    });
+    seantis.search.init_paging();
 };
 
 (function($) {
@@ -71,8 +71,13 @@ class View(BaseView, ReservationUrls, ReservationDataView):
         """
         result = []
 
+        reservations = list(reservations)
+        resources = utils.get_resources_by_uuids(
+            set(r.resource for r in reservations)
+        )
+
         for reservation in reservations:
-            resource = utils.get_resource_by_uuid(reservation.resource)
+            resource = resources[reservation.resource]
 
             if resource is None:
                 log.warn('Invalid UUID %s' % str(reservation.resource))
@@ -1,9 +1,15 @@
+from collections import namedtuple
 from itertools import groupby
 
 import logging
 log = logging.getLogger('seantis.reservation')
 
+import isodate
+import re
 import six
+import threading
+import time
+import transaction
 
 from five import grok
 
@@ -11,15 +17,24 @@ from email.MIMEText import MIMEText
 from email.Header import Header
 from email.Utils import parseaddr, formataddr
 
+from plone.app.workflow.interfaces import ILocalrolesModifiedEvent
 from plone.dexterity.content import Item
 from plone.directives import dexterity
 from plone.memoize import view
 from Products.CMFCore.interfaces import IFolderish
 from Products.CMFCore.utils import getToolByName
+from Products.PluggableAuthService.interfaces.events import (
+    IPrincipalDeletedEvent,
+    IPropertiesUpdatedEvent
+)
 from z3c.form import button
+from zope.lifecycleevent.interfaces import IObjectModifiedEvent
+from zope.lifecycleevent.interfaces import IObjectMovedEvent
 from zope.schema import getFields
 
 from seantis.reservation import _
+from seantis.reservation import metadata
+from seantis.reservation import outbox
 from seantis.reservation import settings
 from seantis.reservation import utils
 from seantis.reservation.base import BaseViewlet
@@ -40,6 +55,36 @@ from seantis.reservation.reservations import (
 )
 from seantis.reservation.reserve import ReservationUrls
 
+try:
+    from Products.PluggableAuthService.interfaces.events import (
+        IPrincipalAddedToGroupEvent,
+        IPrincipalRemovedFromGroupEvent
+    )
+except ImportError:  # PluggableAuthService < 1.11
+    IPrincipalAddedToGroupEvent = IPrincipalRemovedFromGroupEvent = None
+
+
+# the number of seconds after which the manager emails of a resource are
+# looked up anew, as not all changes to the managers lead to an event
+manager_emails_max_age = 5 * 60
+
+# the maximum number of resources kept in the manager emails cache
+manager_emails_max_size = 1000
+
+# resource path -> (timestamp, emails), least recently used first
+_manager_emails = utils.OrderedDict()
+_manager_emails_lock = threading.Lock()
+
+# the number of seconds after which the template index of a site is built
+# anew, as the changes made by other Zope instances are not seen otherwise
+template_index_max_age = 5 * 60
+
+# site path -> (timestamp, TemplateIndex)
+_template_indexes = {}
+_template_indexes_lock = threading.Lock()
+
+TemplateIndex = namedtuple('TemplateIndex', ['folders', 'content'])
+
 
 @grok.subscribe(IReservationsConfirmedEvent)
 def on_reservations_confirmed(event):
@@ -50,6 +95,7 @@ def on_reservations_confirmed(event):
 
     # send many mails to the admins
     if settings.get('send_email_to_managers') != 'never':
+
         for reservation in combine_reservations(event.reservations):
 
             if reservation.autoapprovable:
@@ -177,40 +223,237 @@ def get_manager_emails_by_context(context):
     return emails
 
 
+def get_cached_manager_emails_by_context(context):
+    """ Same as :func:`get_manager_emails_by_context`, with the emails kept
+    by path of the context for manager_emails_max_age seconds.
+
+    """
+    key = tuple(context.getPhysicalPath())
+    now = time.time()
+
+    with _manager_emails_lock:
+        timestamp, emails = _manager_emails.pop(key, (0, None))
+
+        if emails is not None and now - timestamp < manager_emails_max_age:
+            _manager_emails[key] = (timestamp, emails)
+            return list(emails)
+
+    emails = tuple(get_manager_emails_by_context(context))
+
+    with _manager_emails_lock:
+        _manager_emails[key] = (now, emails)
+
+        while len(_manager_emails) > manager_emails_max_size:
+            _manager_emails.popitem(last=False)
+
+    return list(emails)
+
+
+def invalidate_manager_emails(path=None):
+    """ Removes the manager emails of the resources at or below the given
+    path from the cache, or all of them if no path is given.
+
+    The emails are removed again after the current transaction has been
+    committed, as other threads might have cached the old state in the
+    meantime.
+
+    """
+    path = path and tuple(path) or ()
+    depth = len(path)
+
+    def remove(*args):
+        with _manager_emails_lock:
+            for key in _manager_emails.keys():
+                if key[:depth] == path:
+                    del _manager_emails[key]
+
+    remove()
+    transaction.get().addAfterCommitHook(remove)
+
+
+def clear_manager_emails():
+    """ Clears the whole manager emails cache, for testing. """
+    with _manager_emails_lock:
+        _manager_emails.clear()
+
+
+@grok.subscribe(ILocalrolesModifiedEvent)
+def on_local_roles_modified(event):
+    if _manager_emails:
+        invalidate_manager_emails(event.object.getPhysicalPath())
+
+
+# the groups and emails of the principals are not bound to a path
+@grok.subscribe(IPrincipalDeletedEvent)
+def on_principal_deleted(event):
+    if _manager_emails:
+        invalidate_manager_emails()
+
+
+@grok.subscribe(IPropertiesUpdatedEvent)
+def on_principal_properties_updated(event):
+    if _manager_emails:
+        invalidate_manager_emails()
+
+
+if IPrincipalAddedToGroupEvent is not None:
+
+    @grok.subscribe(IPrincipalAddedToGroupEvent)
+    def on_principal_added_to_group(event):
+        if _manager_emails:
+            invalidate_manager_emails()
+
+    @grok.subscribe(IPrincipalRemovedFromGroupEvent)
+    def on_principal_removed_from_group(event):
+        if _manager_emails:
+            invalidate_manager_emails()
+
+
 def get_manager_emails(context):
     if settings.get('send_email_to_managers') == 'by_path':
-        return get_manager_emails_by_context(context)
+        return get_cached_manager_emails_by_context(context)
     elif settings.get('send_email_to_managers') == 'by_address':
         return [settings.get('manager_email')]
     else:
         return []
 
 
-def get_email_content(context, email_type, language):
-    user_templates = utils.portal_type_by_context(
-        context, portal_type='seantis.reservation.emailtemplate'
+def build_template_index(site):
+    """ Returns the index of the email templates of the given site, which
+    contains the paths of the folders with templates and the subject and
+    body of each folder, language and email type.
+
+    """
+    catalog = getToolByName(site, 'portal_catalog')
+    brains = catalog.unrestrictedSearchResults(
+        portal_type='seantis.reservation.emailtemplate',
+        path='/'.join(site.getPhysicalPath())
     )
 
-    for t in user_templates:
-        if t.language != language:
-            continue
+    folders = set()
+    content = {}
+
+    # the first template of a folder and language wins, like it did when
+    # the templates were looked up through the catalog on each mail
+    for brain in sorted(brains, key=lambda b: b.getPath()):
+        template = brain._unrestrictedGetObject()
+        folder = tuple(brain.getPath().split('/')[:-1])
+
+        folders.add(folder)
+
+        for email_type in templates:
+            key = (folder, template.language, email_type)
+
+            if key not in content:
+                content[key] = (
+                    getattr(template, email_type + '_subject', None),
+                    getattr(template, email_type + '_content', None)
+                )
+
+    return TemplateIndex(folders, content)
+
+
+def get_template_index(site):
+    key = tuple(site.getPhysicalPath())
+    now = time.time()
+
+    with _template_indexes_lock:
+        timestamp, index = _template_indexes.get(key, (0, None))
+
+        if index is not None and now - timestamp < template_index_max_age:
+            return index
+
+    index = build_template_index(site)
+
+    with _template_indexes_lock:
+        _template_indexes[key] = (now, index)
 
-        subject = getattr(t, email_type + '_subject')
-        body = getattr(t, email_type + '_content')
+    return index
 
-        return subject, body
+
+def invalidate_template_index(site_path):
+    """ Removes the template index of the given site, now and after the
+    current transaction has been committed, as other threads might have
+    built an index with the old templates in the meantime.
+
+    """
+    key = tuple(site_path)
+
+    def remove(*args):
+        with _template_indexes_lock:
+            _template_indexes.pop(key, None)
+
+    remove()
+    transaction.get().addAfterCommitHook(remove)
+
+
+def clear_template_indexes():
+    """ Clears the template indexes of all sites, for testing. """
+    with _template_indexes_lock:
+        _template_indexes.clear()
+
+
+# moving, adding and removing folders is dispatched to the templates inside
+@grok.subscribe(IEmailTemplate, IObjectMovedEvent)
+def on_template_moved(template, event):
+    invalidate_template_index(utils.getSite().getPhysicalPath())
+
+
+@grok.subscribe(IEmailTemplate, IObjectModifiedEvent)
+def on_template_modified(template, event):
+    invalidate_template_index(utils.getSite().getPhysicalPath())
+
+
+def get_email_content(context, email_type, language):
+    """ Returns the subject and the body of the given email type and
+    language. The templates of the closest folder with templates are used,
+    or the default templates if there are none or none in that language.
+
+    """
+    site = utils.getSite()
+    index = get_template_index(site)
+
+    if index.folders:
+        path = tuple(utils.context_path(context))
+        depth = len(site.getPhysicalPath())
+
+        for end in range(len(path), depth - 1, -1):
+            folder = path[:end]
+
+            if folder not in index.folders:
+                continue
+
+            subject, body = index.content.get(
+                (folder, language, email_type), (None, None)
+            )
+
+            if subject is not None and body is not None:
+                return subject, body
+
+            break
 
     return templates[email_type].get(language)
 
 
-def load_resources(reservations):
-    resources = dict()
+def load_resources(reservations, resources=None):
+    """ Returns a dictionary with the resources of the given reservations by
+    uuid (None for the ones which are gone). The resources found in the
+    given dictionary are not loaded again.
 
-    for resource in (r.resource for r in reservations):
-        if resource in resources:
-            continue
+    The resources are loaded regardless of the permissions of the current
+    user, as the mails are rendered by the outbox worker, which is called
+    anonymously.
 
-        resources[resource] = utils.get_resource_by_uuid(resource).getObject()
+    """
+    resources = resources if resources is not None else {}
+    missing = set(r.resource for r in reservations) - set(resources)
+
+    if missing:
+        brains = utils.get_resources_by_uuids(missing, unrestricted=True)
+        resources.update(
+            (uuid, brain and brain._unrestrictedGetObject() or None)
+            for uuid, brain in brains.items()
+        )
 
     return resources
 
@@ -226,213 +469,425 @@ def may_send_mail(resource, mail, intended_for_admin):
 
 
 def send_reservations_confirmed(reservations, language):
+    """ Queues the mail to each reservee, listing the confirmed reservations
+    (see render_reservations_confirmed).
 
-    sender = utils.get_site_email_sender()
-
-    if not sender:
-        log.warn('Cannot send email as no sender is configured')
-        return
-
-    # load resources
-    resources = load_resources(reservations)
+    """
 
     # send reservations grouped by reservee email
     groupkey = lambda r: r.email
     by_recipient = groupby(sorted(reservations, key=groupkey), key=groupkey)
 
     for recipient, grouped_reservations in by_recipient:
+        queue_mail(dict(
+            kind='reservations_confirmed',
+            language=language,
+            recipient=recipient,
+            reservations=[
+                reservation_snapshot(r, autoapprovable=r.autoapprovable)
+                for r in combine_reservations(grouped_reservations)
+            ]
+        ))
 
-        lines = []
 
-        for reservation in combine_reservations(grouped_reservations):
+def send_reservation_mail(
+    reservations, email_type, language, to_managers=False,
+        reason=u'', old_time=None, new_time=None
+):
+    """ Queues the mail of the given type about the given reservations to the
+    reservee or to the managers (see render_reservation_mail).
 
-            resource = resources[reservation.resource]
+    """
 
-            prefix = '' if reservation.autoapprovable else '* '
-            title_prefix = '{}x '.format(reservation.quota)
-            lines.append(
-                prefix + utils.get_resource_title(resource, title_prefix)
-            )
+    if isinstance(reservations, CombinedReservations):
+        reservation = reservations
+    else:
+        reservation = tuple(combine_reservations(reservations))[0]
 
-            for start, end in reservation.timespans():
-                lines.append(utils.display_date(start, end))
+    queue_mail(dict(
+        kind='reservation',
+        email_type=email_type,
+        language=language,
+        to_managers=to_managers,
+        reason=reason,
+        old_time=old_time and timespan_snapshot(*old_time),
+        new_time=new_time and timespan_snapshot(*new_time),
+        reservation=reservation_snapshot(reservation)
+    ))
 
-            lines.append('')
 
-        # differs between resources
-        subject, body = get_email_content(
-            resource, 'reservation_received', language
-        )
+def queue_mail(payload):
+    """ Queues the mail described by the given payload in the outbox. The
+    mail is rendered by the outbox worker (see mail_renderer) and sent once
+    the transaction has been committed (see outbox.py).
 
-        mail = ReservationMail(
-            resource, reservation,
-            sender=sender,
-            recipient=recipient,
-            subject=subject,
-            body=body,
-            reservations=lines[:-1]
+    The url of the site is kept with the payload, as the worker is not
+    called through the url the users see.
+
+    """
+    payload['site_url'] = utils.getSite().absolute_url()
+    outbox.queue_job(payload)
+
+
+def timespan_snapshot(start, end):
+    # isoformat keeps the microseconds of the end dates, which
+    # utils.display_date relies on
+    return [start.isoformat(), end.isoformat()]
+
+
+def reservation_snapshot(reservation, autoapprovable=False):
+    """ Returns the values of the given reservation needed to render its
+    mails, as the reservation may be gone once the mails are rendered
+    (denied and revoked reservations are deleted).
+
+    """
+    return dict(
+        token=utils.string_uuid(reservation.token),
+        resource=utils.string_uuid(reservation.resource),
+        email=reservation.email,
+        quota=reservation.quota,
+        data=reservation.data,
+        autoapprovable=autoapprovable,
+        timespans=[timespan_snapshot(*t) for t in reservation.timespans()]
+    )
+
+
+class QueuedReservation(object):
+    """ Stands in for the reservation of a queued mail, built from the
+    result of :func:`reservation_snapshot`.
+
+    """
+
+    def __init__(self, snapshot):
+        self.token = snapshot['token']
+        self.resource = snapshot['resource']
+        self.email = snapshot['email']
+        self.quota = snapshot['quota']
+        self.data = snapshot['data']
+        self.autoapprovable = snapshot['autoapprovable']
+        self._timespans = [
+            parse_timespan(t) for t in snapshot['timespans']
+        ]
+
+    def timespans(self):
+        return self._timespans
+
+
+def parse_timespan(timespan):
+    return tuple(isodate.parse_datetime(d) for d in timespan)
+
+
+def resource_url(site_url, resource):
+    """ Returns the url of the given resource below the given site url. """
+    site = utils.getSite()
+    path = resource.getPhysicalPath()[len(site.getPhysicalPath()):]
+
+    return '/'.join((site_url.rstrip('/'), ) + tuple(path))
+
+
+def mail_renderer():
+    """ Returns the function used by the outbox worker to render the mails
+    queued by :func:`queue_mail`. The function takes the payload of the
+    queued mail and returns a list of sender, recipient and message tuples.
+
+    The resources are loaded once for all mails rendered by the function.
+
+    """
+    resources = {}
+
+    def render(payload):
+        sender = utils.get_site_email_sender()
+
+        if not sender:
+            log.warn('Cannot send email as no sender is configured')
+            return []
+
+        if payload['kind'] == 'reservations_confirmed':
+            return render_reservations_confirmed(sender, payload, resources)
+        else:
+            return render_reservation_mail(sender, payload, resources)
+
+    return render
+
+
+def render_reservations_confirmed(sender, payload, resources):
+    reservations = [QueuedReservation(r) for r in payload['reservations']]
+    load_resources(reservations, resources)
+
+    lines = []
+    resource = None
+
+    for queued in reservations:
+
+        if resources[queued.resource] is None:
+            log.warn('Cannot list a reservation of a resource which is gone')
+            continue
+
+        reservation, resource = queued, resources[queued.resource]
+
+        prefix = '' if reservation.autoapprovable else '* '
+        title_prefix = '{}x '.format(reservation.quota)
+        lines.append(
+            prefix + metadata.resource_title(resource, title_prefix)
         )
 
-        if may_send_mail(resource, mail, intended_for_admin=False):
-            send_mail(resource, mail)
+        for start, end in reservation.timespans():
+            lines.append(utils.display_date(start, end))
 
+        lines.append('')
 
-def send_reservation_mail(
-    reservations, email_type, language, to_managers=False,
-        reason=u'', old_time=None, new_time=None
-):
+    if resource is None:
+        return []
+
+    # differs between resources
+    subject, body = get_email_content(
+        resource, 'reservation_received', payload['language']
+    )
+
+    mail = ReservationMail(
+        resource, reservation,
+        sender=sender,
+        recipient=payload['recipient'],
+        subject=subject,
+        body=body,
+        reservations=lines[:-1],
+        resource_url=resource_url(payload['site_url'], resource)
+    )
+
+    if not may_send_mail(resource, mail, intended_for_admin=False):
+        return []
+
+    return [(mail.sender, mail.recipient, mail.as_string())]
 
-    if isinstance(reservations, CombinedReservations):
-        reservation = reservations
-    else:
-        reservation = tuple(combine_reservations(reservations))[0]
 
-    resource = utils.get_resource_by_uuid(reservation.resource)
+def render_reservation_mail(sender, payload, resources):
+    reservation = QueuedReservation(payload['reservation'])
+    resource = load_resources([reservation], resources)[reservation.resource]
 
     # the resource doesn't currently exist in testing so we quietly
     # exit. This should be changed => #TODO
     if not resource:
         log.warn('Cannot send email as the resource does not exist')
-        return
-
-    sender = utils.get_site_email_sender()
-
-    if not sender:
-        log.warn('Cannot send email as no sender is configured')
-        return
+        return []
 
-    resource = resource.getObject()
+    to_managers = payload['to_managers']
 
     if to_managers:
         recipients = get_manager_emails(resource)
         if not recipients:
             log.warn("Couldn't find a manager to send an email to")
-            return
+            return []
     else:
         recipients = [reservation.email]
 
-    subject, body = get_email_content(resource, email_type, language)
+    subject, body = get_email_content(
+        resource, payload['email_type'], payload['language']
+    )
+
+    # shared by the mails of all recipients
+    parameters = MailParameters(
+        resource, reservation,
+        reason=payload['reason'],
+        old_time=payload['old_time'] and parse_timespan(payload['old_time']),
+        new_time=payload['new_time'] and parse_timespan(payload['new_time']),
+        resource_url=resource_url(payload['site_url'], resource)
+    )
+
+    mails = []
 
     for recipient in recipients:
         mail = ReservationMail(
             resource, reservation,
+            parameters=parameters,
             sender=sender,
             recipient=recipient,
             subject=subject,
-            body=body,
-            reason=reason,
-            old_time=old_time,
-            new_time=new_time
+            body=body
         )
 
         if may_send_mail(resource, mail, intended_for_admin=to_managers):
-            send_mail(resource, mail)
+            mails.append((mail.sender, mail.recipient, mail.as_string()))
 
+    return mails
 
-def send_mail(context, mail):
-    context.MailHost.send(mail.as_string(), immediate=False)
 
+# matches the names of the parameters in the subject and body templates,
+# skipping escaped percent signs
+placeholder_pattern = re.compile(r'%%|%\((\w+)\)')
 
-class ReservationMail(ReservationDataView, ReservationUrls):
 
-    sender = u''
-    recipient = u''
-    subject = u''
-    body = u''
-    reservations = u''
-    reason = u''
-    old_time = None
-    new_time = None
+@utils.memoize(maxsize=256)
+def template_placeholders(text):
+    """ Returns the names of the parameters used in the given template text.
+    Each text is only parsed once, as the same templates are used for most
+    mails.
 
-    def __init__(self, resource, reservation, **kwargs):
-        for k, v in kwargs.items():
-            if hasattr(self, k):
-                setattr(self, k, v)
+    """
+    return frozenset(
+        name for name in placeholder_pattern.findall(text) if name
+    )
 
-        # get information for the body/subject string
 
-        p = dict()
-        is_needed = lambda key: key in self.subject or key in self.body
+class MailParameters(ReservationDataView, ReservationUrls):
+    """ The parameters of the mails about a reservation, each computed once
+    it is first needed. The mails sent to the recipients of the same
+    reservation share an instance, so the dates, the data and the links are
+    computed once per reservation, not once per mail.
 
-        # title of the resource
-        if is_needed('resource'):
-            p['resource'] = utils.get_resource_title(resource)
+    The links start with the given resource url, if any.
 
-        # reservation email
-        if is_needed('reservation_mail'):
-            p['reservation_mail'] = reservation.email
+    """
 
-        # a list of reservations
-        if is_needed('reservations'):
-            p['reservations'] = '\n'.join(self.reservations)
+    def __init__(self, resource, reservation, reservations=(), reason=u'',
+                 old_time=None, new_time=None, resource_url=None):
+        self.resource = resource
+        self.reservation = reservation
+        self.reservations = reservations
+        self.reason = reason
+        self.old_time = old_time
+        self.new_time = new_time
+        self.resource_url = resource_url
+        self.values = dict()
 
-        # a list of dates
-        if is_needed('dates'):
-            lines = []
-            dates = sorted(reservation.timespans(), key=lambda i: i[0])
-            for start, end in dates:
-                lines.append(utils.display_date(start, end))
+    def url_base(self, context):
+        return self.resource_url or context.absolute_url()
 
-            p['dates'] = '\n'.join(lines)
+    def get(self, names):
+        """ Returns a dictionary with the values of the given parameters.
+        Unknown names are left out, so formatting the template fails as
+        before.
 
-        # reservation quota
-        if is_needed('quota'):
-            p['quota'] = reservation.quota
+        """
+        parameters = dict()
 
-        # tabbed reservation data
-        if is_needed('data'):
-            data = reservation.data
-            lines = []
-            for key in self.sort_reservation_data(data):
-                interface = data[key]
+        for name in names:
+            if name not in self.values:
+                compute = getattr(self, 'parameter_' + name, None)
 
-                lines.append(interface['desc'])
-                sorted_values = self.sort_reservation_data_values(
-                    interface['values']
-                )
+                if compute is None:
+                    continue
 
-                for value in sorted_values:
-                    lines.append(
-                        '\t' + value['desc'] + ': ' +
-                        six.text_type(
-                            self.display_reservation_data(value['value'])
-                        )
-                    )
+                self.values[name] = compute()
 
-            p['data'] = '\n'.join(lines)
+            parameters[name] = self.values[name]
 
-        if is_needed('reservation_link'):
-            p['reservation_link'] = self.show_all_url(
-                reservation.token, resource
-            )
+        return parameters
+
+    # title of the resource
+    def parameter_resource(self):
+        return metadata.resource_title(self.resource)
 
-        # approval link
-        if is_needed('approval_link'):
-            p['approval_link'] = self.approve_all_url(
-                reservation.token, resource
+    # reservation email
+    def parameter_reservation_mail(self):
+        return self.reservation.email
+
+    # a list of reservations
+    def parameter_reservations(self):
+        return '\n'.join(self.reservations)
+
+    # a list of dates
+    def parameter_dates(self):
+        lines = []
+        dates = sorted(self.reservation.timespans(), key=lambda i: i[0])
+        for start, end in dates:
+            lines.append(utils.display_date(start, end))
+
+        return '\n'.join(lines)
+
+    # reservation quota
+    def parameter_quota(self):
+        return self.reservation.quota
+
+    # tabbed reservation data
+    def parameter_data(self):
+        data = self.reservation.data
+        lines = []
+        for key in self.sort_reservation_data(data):
+            interface = data[key]
+
+            lines.append(interface['desc'])
+            sorted_values = self.sort_reservation_data_values(
+                interface['values']
             )
 
-        # denial link
-        if is_needed('denial_link'):
-            p['denial_link'] = self.deny_all_url(reservation.token, resource)
+            for value in sorted_values:
+                lines.append(
+                    '\t' + value['desc'] + ': ' +
+                    six.text_type(
+                        self.display_reservation_data(value['value'])
+                    )
+                )
+
+        return '\n'.join(lines)
+
+    def parameter_reservation_link(self):
+        return self.show_all_url(self.reservation.token, self.resource)
+
+    # approval link
+    def parameter_approval_link(self):
+        return self.approve_all_url(self.reservation.token, self.resource)
+
+    # denial link
+    def parameter_denial_link(self):
+        return self.deny_all_url(self.reservation.token, self.resource)
 
-        # cancel link
-        if is_needed('cancel_link'):
-            p['cancel_link'] = self.revoke_all_url(reservation.token, resource)
+    # cancel link
+    def parameter_cancel_link(self):
+        return self.revoke_all_url(self.reservation.token, self.resource)
 
-        # revocation reason
-        if is_needed('reason'):
-            p['reason'] = self.reason
+    # revocation reason
+    def parameter_reason(self):
+        return self.reason
 
-        # old time
-        if is_needed('old_time'):
-            p['old_time'] = utils.display_date(*self.old_time)
+    # old time
+    def parameter_old_time(self):
+        return utils.display_date(*self.old_time)
 
-        # new time
-        if is_needed('new_time'):
-            p['new_time'] = utils.display_date(*self.new_time)
+    # new time
+    def parameter_new_time(self):
+        return utils.display_date(*self.new_time)
 
-        self.parameters = p
+
+class ReservationMail(object):
+
+    sender = u''
+    recipient = u''
+    subject = u''
+    body = u''
+    reservations = u''
+    reason = u''
+    old_time = None
+    new_time = None
+    resource_url = None
+
+    def __init__(self, resource, reservation, parameters=None, **kwargs):
+        """ Prepares the mail about the given reservation. Pass the
+        :class:`MailParameters` of the reservation when sending it to more
+        than one recipient, so they are shared by all mails.
+
+        """
+        for k, v in kwargs.items():
+            if hasattr(self, k):
+                setattr(self, k, v)
+
+        if parameters is None:
+            parameters = MailParameters(
+                resource, reservation,
+                reservations=self.reservations,
+                reason=self.reason,
+                old_time=self.old_time,
+                new_time=self.new_time,
+                resource_url=self.resource_url
+            )
+
+        # only the parameters used by subject and body are computed
+        self.parameters = parameters.get(self.placeholders)
+
+    @property
+    def placeholders(self):
+        return template_placeholders(self.subject) | template_placeholders(
+            self.body
+        )
 
     def as_string(self):
         subject = self.subject % self.parameters
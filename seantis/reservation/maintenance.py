@@ -12,6 +12,9 @@ from zope.interface import Interface
 
 from ZServer.ClockServer import ClockServer
 
+from seantis.reservation import expiry
+from seantis.reservation import pool
+from seantis.reservation import utils
 from seantis.reservation.base import BaseView
 from seantis.reservation.interfaces import IResourceViewedEvent
 from seantis.reservation.session import ILibresUtility
@@ -23,7 +26,8 @@ _clockservers = dict()  # list of registered Zope Clockservers
 # by the GIL, but it's better to be safe than sorry.
 locks = {
     '_clockservers': threading.Lock(),
-    '_connections': threading.Lock()
+    '_connections': threading.Lock(),
+    '_sites': threading.Lock()
 }
 
 
@@ -34,10 +38,25 @@ locks = {
 # not safe enough to use if one has to rely on a site being setup.
 @grok.subscribe(IResourceViewedEvent)
 def on_resource_viewed(event):
+
+    # the expired sessions may be removed by a cronjob instead (see expiry.py)
+    if runs_externally():
+        return
+
     period = 15 * 60  # 15 minutes
     register_once_per_connection('/remove-expired-sessions', getSite(), period)
 
 
+def runs_externally():
+    """ Returns True if the 'session-expiry' option of the product config is
+    set to 'external', in which case the expired sessions are removed and the
+    mail outbox is processed by cronjobs (see expiry.py and outbox.py),
+    instead of Zope clockservers.
+
+    """
+    return utils.get_config('session-expiry') == 'external'
+
+
 def clear_clockservers():
     """ Clears the clockservers and connections for testing. """
 
@@ -84,6 +103,30 @@ def register_once_per_connection(method, site, period):
     return True
 
 
+def register_once_per_site(method, site, period):
+    """ Registers the given method of the given site with a clockserver,
+    unless it was registered already. Unlike
+    :func:`register_once_per_connection`, each site sharing a connection
+    gets its own clockserver.
+
+    Returns True if a new server was registered, False if the method was
+    already present.
+
+    """
+
+    assert method.startswith('/')
+
+    method = '/'.join(site.getPhysicalPath()) + method
+
+    with locks['_sites']:
+        if method in _clockservers:
+            return False
+
+        register_server(method, period)
+
+    return True
+
+
 def register_server(method, period):
     """ Registers the given method with a clockserver.
 
@@ -134,7 +177,8 @@ class ClockLogger(object):
 
 
 class RemoveExpiredSessions(BaseView):
-    """ Removes all expired sessions when called. Does not require permission.
+    """ Removes the expired sessions of the site's database when called, see
+    expiry.remove_expired_sessions. Does not require permission.
 
     """
 
@@ -146,11 +190,11 @@ class RemoveExpiredSessions(BaseView):
     grok.context(Interface)
 
     def render(self):
-        # LIBRES it might make sense to have some scheduler-less access here.
-        scheduler = getUtility(ILibresUtility).scheduler('maintenance', 'UTC')
-        removed = scheduler.queries.remove_expired_reservation_sessions()
+        dsn = getUtility(ILibresUtility).get_dsn(getSite())
+        result = expiry.remove_expired_sessions(pool.get_engine(dsn))
 
-        # don't give out the session ids to the public, log instead
-        log.info('removed the following reservation sessions: %s' % removed)
+        # the session ids are not given out to the public, nor logged, as
+        # there may be thousands of them
+        log.info(expiry.describe(result))
 
-        return "removed %i reservation sessions" % len(removed)
+        return expiry.describe(result)
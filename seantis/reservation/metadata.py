@@ -0,0 +1,197 @@
+""" Keeps the display metadata of resources (title, parent title and path)
+in memory, for the reports, exports and mails which show the titles of many
+resources at once.
+
+Without the cache each title costs a wake-up of the resource's parent. The
+cache is bounded in size as well as in time and it is invalidated whenever
+a resource or one of its parents is modified or moved. As this is checked
+for every modified or moved object, the cached resources are indexed by the
+paths of their parents, which makes the check a single lookup.
+
+"""
+
+import threading
+import time
+import transaction
+
+from collections import namedtuple
+
+from Acquisition import aq_inner, aq_parent
+from five import grok
+from Products.CMFCore.interfaces import IFolderish
+from zope.component.hooks import getSite
+from zope.interface import Interface
+from zope.lifecycleevent.interfaces import IObjectModifiedEvent
+from zope.lifecycleevent.interfaces import IObjectMovedEvent
+
+from seantis.reservation import utils
+from seantis.reservation.interfaces import IResourceBase
+
+
+# the maximum number of resources kept in the cache
+max_size = 1000
+
+# the number of seconds after which the metadata of a resource is loaded anew
+max_age = 60 * 60
+
+# resource uuid -> (timestamp, ResourceMetadata), least recently used first
+_cache = utils.OrderedDict()
+_cache_lock = threading.Lock()
+
+# path -> set of the uuids of the cached resources at or below the path
+_paths = {}
+
+ResourceMetadata = namedtuple(
+    'ResourceMetadata', ['title', 'parent_title', 'path']
+)
+
+
+def get_metadata(resource):
+    """ Returns the metadata of the given resource, from the cache if
+    possible.
+
+    """
+    key = utils.string_uuid(resource)
+    now = time.time()
+
+    with _cache_lock:
+        timestamp, metadata = _cache.get(key, (0, None))
+
+        if metadata is not None and now - timestamp < max_age:
+            # move the resource to the end, as the most recently used
+            _cache[key] = _cache.pop(key)
+            return metadata
+
+    metadata = load_metadata(resource)
+
+    with _cache_lock:
+        remove_entry(key)
+
+        _cache[key] = (now, metadata)
+
+        for depth in range(1, len(metadata.path) + 1):
+            _paths.setdefault(metadata.path[:depth], set()).add(key)
+
+        while len(_cache) > max_size:
+            remove_entry(next(iter(_cache)))
+
+    return metadata
+
+
+def remove_entry(key):
+    """ Removes the given resource from the cache and from the path index,
+    if present. Must be called with the cache lock held.
+
+    """
+    timestamp, metadata = _cache.pop(key, (0, None))
+
+    if metadata is None:
+        return
+
+    for depth in range(1, len(metadata.path) + 1):
+        prefix = metadata.path[:depth]
+        keys = _paths[prefix]
+        keys.discard(key)
+
+        if not keys:
+            del _paths[prefix]
+
+
+def load_metadata(resource):
+    parent = aq_parent(aq_inner(resource))
+
+    return ResourceMetadata(
+        resource.title,
+        getattr(parent, 'title', None),
+        tuple(resource.getPhysicalPath())
+    )
+
+
+def resource_title(resource, title_prefix=''):
+    """ Same as :func:`seantis.reservation.utils.get_resource_title`, using
+    the cache.
+
+    """
+    metadata = get_metadata(resource)
+
+    if metadata.parent_title is None:
+        return title_prefix + metadata.title
+
+    return ' - '.join((metadata.parent_title, title_prefix + metadata.title))
+
+
+def parent_title(resource):
+    return get_metadata(resource).parent_title
+
+
+def resource_url(resource, request=None):
+    """ Returns the absolute url of the given resource, without touching the
+    parents of the resource.
+
+    """
+    request = request or getSite().REQUEST
+    return request.physicalPathToURL(get_metadata(resource).path)
+
+
+def invalidate(path):
+    """ Removes all resources from the cache which are found at or below
+    the given path. A modified folder thus removes its resources, as their
+    parent title might have changed.
+
+    The resources are removed again after the current transaction has been
+    committed, as other threads might have cached the old state in the
+    meantime.
+
+    """
+
+    path = tuple(path)
+
+    def remove(*args):
+        with _cache_lock:
+            for key in tuple(_paths.get(path, ())):
+                remove_entry(key)
+
+    remove()
+    transaction.get().addAfterCommitHook(remove)
+
+
+def clear_cache():
+    """ Clears the whole cache, for testing. """
+    with _cache_lock:
+        _cache.clear()
+        _paths.clear()
+
+
+def may_be_cached(obj, path):
+    """ Returns True if resources at or below the given path of the given
+    object may be in the cache. Besides the cached ones this includes all
+    resources and folders, as other threads might cache them before the
+    current transaction is committed.
+
+    """
+    if path in _paths:
+        return True
+
+    return IResourceBase.providedBy(obj) or IFolderish.providedBy(obj)
+
+
+@grok.subscribe(Interface, IObjectModifiedEvent)
+def on_object_modified(obj, event):
+    if not hasattr(obj, 'getPhysicalPath'):
+        return
+
+    path = tuple(obj.getPhysicalPath())
+
+    if may_be_cached(obj, path):
+        invalidate(path)
+
+
+@grok.subscribe(Interface, IObjectMovedEvent)
+def on_object_moved(obj, event):
+    if event.oldParent is None:
+        return
+
+    path = tuple(event.oldParent.getPhysicalPath()) + (event.oldName, )
+
+    if may_be_cached(obj, path):
+        invalidate(path)
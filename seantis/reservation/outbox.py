@@ -0,0 +1,517 @@
+""" Keeps the reservation mails in an outbox table of the reservation
+database, from which they are sent in batches by a background worker.
+
+A mail is queued in the same transaction as the changes of the reservations
+it describes. It is therefore only sent if the changes are committed, and
+the request doesn't wait for the mail server anymore.
+
+The worker is the process-mail-outbox view, called by a Zope clockserver
+every minute (see maintenance.py), or by the console script, for example
+through a cronjob running every minute:
+
+    bin/process-mail-outbox http://localhost:8080/site
+
+The clockserver is only registered once a mail is queued or a resource is
+viewed, so mails queued before a restart wait for that. Instances which
+should not depend on it set the 'session-expiry' option of the product
+config to 'external', which stops the clockservers of the outbox and of the
+session expiry, and run both console scripts instead.
+
+The request only queues the data each mail needs (see mail.queue_mail), the
+mails are rendered by the worker. The data includes the reservations the
+mails describe, as they may be gone once the worker runs (denied and revoked
+reservations are deleted).
+
+The worker first renders the queued mails, replacing each with the rendered
+mail of each recipient. It then claims the mails which are due, sends
+them over a single SMTP connection and removes them from the outbox. Mails
+which could not be sent are tried again later, with a growing delay between
+the attempts. Mails rejected by the mail server for good, or which failed
+max_attempts times, stay in the outbox with their last error, but are not
+sent anymore. The same goes for mails which could not be rendered.
+
+"""
+
+import logging
+log = logging.getLogger('seantis.reservation')
+
+import argparse
+import smtplib
+import socket
+import sys
+
+from datetime import timedelta
+from email.Utils import parseaddr
+
+import sedate
+
+from five import grok
+from libres.db.models.types import UTCDateTime
+from sqlalchemy import Column, Index, Integer, Text
+from sqlalchemy import and_, exc, or_, select
+from sqlalchemy.ext.declarative import declarative_base
+from six.moves.urllib.error import URLError
+from six.moves.urllib.request import urlopen
+from zope.component import getUtility
+from zope.component.hooks import getSite
+from zope.interface import Interface
+
+from seantis.reservation import maintenance
+from seantis.reservation import pool
+from seantis.reservation import utils
+from seantis.reservation.base import BaseView
+from seantis.reservation.interfaces import IResourceViewedEvent
+from seantis.reservation.session import ILibresUtility, Session
+
+
+# the number of mails claimed by the worker at once
+batch_size = 100
+
+# the number of batches sent by the worker per run
+max_batches = 10
+
+# the number of seconds after which claimed mails which were neither sent
+# nor released (e.g. because the worker was stopped) are claimed again
+lease = 10 * 60
+
+# the number of attempts after which a mail is not sent anymore
+max_attempts = 10
+
+# the number of seconds waited after the first failed attempt, doubled after
+# each further attempt, up to max_backoff
+backoff = 60
+max_backoff = 6 * 60 * 60
+
+# the number of seconds between the runs of the worker
+period = 60
+
+Base = declarative_base()
+
+
+class OutboxMail(Base):
+    """ A mail waiting to be rendered (with a payload) or to be sent (with
+    a sender, a recipient and a message).
+
+    """
+
+    __tablename__ = 'seantis_reservation_outbox'
+
+    id = Column(Integer, primary_key=True)
+
+    # the physical path of the site which queued the mail, as the sites
+    # sharing a database use different mail hosts
+    site = Column(Text, nullable=False)
+
+    # the json data the worker renders the mails from
+    payload = Column(Text, nullable=True)
+
+    sender = Column(Text, nullable=True)
+    recipient = Column(Text, nullable=True)
+    message = Column(Text, nullable=True)
+
+    created = Column(
+        UTCDateTime(timezone=False), nullable=False, default=sedate.utcnow
+    )
+
+    # the number of failed attempts and the time of the next one (None if
+    # the mail is not sent anymore)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt = Column(UTCDateTime(timezone=False), nullable=True)
+    last_error = Column(Text, nullable=True)
+
+    # set while the mail is being sent by a worker
+    claimed_until = Column(UTCDateTime(timezone=False), nullable=True)
+
+    __table_args__ = (
+        Index('seantis_reservation_outbox_due', 'site', 'next_attempt'),
+    )
+
+
+def setup_database(bind):
+    """ Creates the outbox table if it doesn't exist yet. """
+    Base.metadata.create_all(bind)
+
+
+def site_path(site):
+    return '/'.join(site.getPhysicalPath())
+
+
+def queue_job(payload, site=None):
+    """ Adds the mail described by the given payload to the outbox of the
+    given site (or the current site). The payload is rendered by the worker
+    (see process_outbox).
+
+    """
+    site = site or getSite()
+
+    Session().add(OutboxMail(
+        site=site_path(site),
+        payload=utils.json_dumps(payload),
+        next_attempt=sedate.utcnow()
+    ))
+
+    register_worker(site)
+
+
+def envelope(sender, recipient, message):
+    """ Returns the values of the outbox row of the given rendered mail.
+    Sender and recipient may include a name, only the address is used for
+    the envelope.
+
+    """
+    return dict(
+        sender=parseaddr(sender)[1],
+        recipient=parseaddr(recipient)[1],
+        message=message
+    )
+
+
+def register_worker(site):
+    # the outbox may be processed by a cronjob instead (see main)
+    if maintenance.runs_externally():
+        return
+
+    maintenance.register_once_per_site('/process-mail-outbox', site, period)
+
+
+# mails queued before a restart are sent once a resource is viewed again
+@grok.subscribe(IResourceViewedEvent)
+def on_resource_viewed(event):
+    register_worker(getSite())
+
+
+def backoff_delay(attempts):
+    """ Returns the seconds to wait after the given number of attempts. """
+    return min(backoff * 2 ** (attempts - 1), max_backoff)
+
+
+def is_permanent(error):
+    """ Returns True if the given smtp error will not go away by trying
+    again later.
+
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, msg in error.recipients.values())
+
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code >= 500
+
+    return False
+
+
+def is_disconnect(error):
+    """ Returns True if the given error leaves the smtp connection unusable.
+
+    """
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+
+    return isinstance(error, socket.error)
+
+
+class SMTPTransport(object):
+    """ Sends mails over a single connection to an SMTP server. """
+
+    def __init__(self, host, port, user=None, password=None, tls=False,
+                 timeout=30):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.tls = tls
+        self.timeout = timeout
+        self.smtp = None
+
+    @classmethod
+    def from_mailhost(cls, mailhost):
+        return cls(
+            mailhost.smtp_host or 'localhost',
+            int(mailhost.smtp_port or 25),
+            getattr(mailhost, 'smtp_uid', None) or None,
+            getattr(mailhost, 'smtp_pwd', None) or None,
+            getattr(mailhost, 'force_tls', False)
+        )
+
+    def open(self):
+        self.smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        self.smtp.ehlo()
+
+        # like the MailHost, TLS is only used if it is forced
+        if self.tls:
+            self.smtp.starttls()
+            self.smtp.ehlo()
+
+        if self.user:
+            self.smtp.login(self.user, self.password)
+
+    def send(self, sender, recipient, message):
+        self.smtp.sendmail(sender, [recipient], message)
+
+    def close(self):
+        if self.smtp is None:
+            return
+
+        try:
+            self.smtp.quit()
+        except (smtplib.SMTPException, socket.error):
+            self.smtp.close()
+        finally:
+            self.smtp = None
+
+
+def claim_mails(engine, site, limit, jobs=False):
+    """ Claims the due mails of the given site for the duration of the lease
+    and returns them. With jobs, the mails which are yet to be rendered are
+    claimed instead of the rendered ones.
+
+    """
+    table = OutboxMail.__table__
+    now = sedate.utcnow()
+
+    if jobs:
+        kind = table.c.payload != None  # noqa
+        columns = (table.c.payload, )
+    else:
+        kind = table.c.payload == None  # noqa
+        columns = (table.c.sender, table.c.recipient, table.c.message)
+
+    due = select([table.c.id]).where(and_(
+        table.c.site == site,
+        table.c.next_attempt <= now,
+        kind,
+        or_(table.c.claimed_until == None, table.c.claimed_until < now)  # noqa
+    )).order_by(table.c.next_attempt, table.c.id).limit(limit)
+
+    claim = table.update().where(table.c.id.in_(due))
+    claim = claim.values(claimed_until=now + timedelta(seconds=lease))
+    claim = claim.returning(table.c.id, table.c.attempts, *columns)
+
+    try:
+        with engine.begin() as connection:
+            mails = connection.execute(claim).fetchall()
+    except exc.OperationalError as e:
+        # most likely the mails were claimed by another worker at the same
+        # time, which leads to a serialization failure
+        log.warn('Could not claim the mails of the outbox: %s' % e)
+        return []
+
+    return sorted(mails, key=lambda mail: mail.id)
+
+
+def release_mails(engine, sent, failed):
+    """ Removes the sent mails (a list of ids) from the outbox and schedules
+    the next attempt of the failed ones (a list of mails and errors).
+
+    """
+    table = OutboxMail.__table__
+    now = sedate.utcnow()
+
+    with engine.begin() as connection:
+        if sent:
+            connection.execute(table.delete().where(table.c.id.in_(sent)))
+
+        for mail, error in failed:
+            attempts = mail.attempts + 1
+
+            if is_permanent(error) or attempts >= max_attempts:
+                log.error('Giving up on mail %i to %s: %s' % (
+                    mail.id, getattr(mail, 'recipient', 'be rendered'), error
+                ))
+                next_attempt = None
+            else:
+                next_attempt = now + timedelta(
+                    seconds=backoff_delay(attempts)
+                )
+
+            connection.execute(table.update().where(
+                table.c.id == mail.id
+            ).values(
+                attempts=attempts,
+                next_attempt=next_attempt,
+                last_error=str(error),
+                claimed_until=None
+            ))
+
+
+def render_jobs(engine, site, render, jobs):
+    """ Renders the given (claimed) jobs with the given function, which
+    returns the sender, the recipient and the message of each mail of a
+    payload. Each job is replaced by its mails in one transaction. Returns
+    the number of jobs rendered and the failed jobs with their errors.
+
+    """
+    table = OutboxMail.__table__
+    rendered, failed = 0, []
+
+    for job in jobs:
+        try:
+            mails = render(utils.json_loads(job.payload))
+        except Exception as e:
+            log.exception('Could not render mail %i' % job.id)
+            failed.append((job, e))
+            continue
+
+        now = sedate.utcnow()
+
+        with engine.begin() as connection:
+            if mails:
+                connection.execute(table.insert(), [
+                    dict(site=site, next_attempt=now, **envelope(*mail))
+                    for mail in mails
+                ])
+
+            connection.execute(table.delete().where(table.c.id == job.id))
+
+        rendered += 1
+
+    return rendered, failed
+
+
+def default_renderer():
+    # imported here, as the mails depend on the outbox
+    from seantis.reservation.mail import mail_renderer
+    return mail_renderer()
+
+
+def send_batch(transport, mails):
+    """ Sends the given mails through the given (open) transport. Returns
+    the ids of the mails sent and the failed mails with their errors.
+
+    """
+    sent, failed = [], []
+
+    for ix, mail in enumerate(mails):
+        try:
+            transport.send(mail.sender, mail.recipient, mail.message)
+        except (smtplib.SMTPException, socket.error) as e:
+            if is_disconnect(e):
+                failed.extend((m, e) for m in mails[ix:])
+                break
+
+            failed.append((mail, e))
+        else:
+            sent.append(mail.id)
+
+    return sent, failed
+
+
+def process_outbox(site, transport=None, render=None):
+    """ Renders the queued mails of the given site, then sends the due
+    mails, using one connection to the mail server for all batches. Returns
+    the number of mails sent and the number of mails which failed (to be
+    rendered or sent).
+
+    """
+    dsn = getUtility(ILibresUtility).get_dsn(site)
+    engine = pool.get_engine(dsn)
+    path = site_path(site)
+
+    render = render or default_renderer()
+    transport = transport or SMTPTransport.from_mailhost(site.MailHost)
+    is_open = False
+    sent_count, failed_count = 0, 0
+
+    for batch in range(max_batches):
+        jobs = claim_mails(engine, path, batch_size, jobs=True)
+
+        if not jobs:
+            break
+
+        rendered, failed = render_jobs(engine, path, render, jobs)
+        release_mails(engine, [], failed)
+
+        failed_count += len(failed)
+
+        if len(jobs) < batch_size:
+            break
+
+    try:
+        for batch in range(max_batches):
+            mails = claim_mails(engine, path, batch_size)
+
+            if not mails:
+                break
+
+            if not is_open:
+                try:
+                    transport.open()
+                    is_open = True
+                except (smtplib.SMTPException, socket.error) as e:
+                    log.warn('Could not connect to the mail server: %s' % e)
+                    release_mails(engine, [], [(m, e) for m in mails])
+                    failed_count += len(mails)
+                    break
+
+            sent, failed = send_batch(transport, mails)
+            release_mails(engine, sent, failed)
+
+            sent_count += len(sent)
+            failed_count += len(failed)
+
+            if failed and is_disconnect(failed[-1][1]):
+                break
+
+            if len(mails) < batch_size:
+                break
+    finally:
+        if is_open:
+            transport.close()
+
+    return sent_count, failed_count
+
+
+class ProcessOutbox(BaseView):
+    """ Sends the due mails of the outbox when called, see process_outbox.
+    Does not require permission, like remove-expired-sessions.
+
+    """
+
+    permission = 'zope2.View'
+
+    grok.name('process-mail-outbox')
+    grok.require(permission)
+
+    grok.context(Interface)
+
+    def render(self):
+        sent, failed = process_outbox(getSite())
+
+        if sent or failed:
+            log.info('sent %i mails from the outbox, %i failed' % (
+                sent, failed
+            ))
+
+        return 'sent %i mails, %i failed' % (sent, failed)
+
+
+def main(argv=None):
+    """ The process-mail-outbox console script. The mails are sent by the
+    process-mail-outbox view of the given site, as they are sent through the
+    mail host of the site.
+
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Sends the due mails of the outbox of a site.'
+    )
+    parser.add_argument(
+        'url', help='the url of the site, e.g. http://localhost:8080/site'
+    )
+    parser.add_argument(
+        '--timeout', type=int, default=lease,
+        help='seconds to wait for the worker (default %(default)s)'
+    )
+
+    args = parser.parse_args(argv)
+    url = args.url.rstrip('/') + '/process-mail-outbox'
+
+    try:
+        response = urlopen(url, timeout=args.timeout)
+    except (URLError, socket.error) as e:
+        print('could not process the outbox at %s: %s' % (url, e))
+        sys.exit(1)
+
+    try:
+        print(response.read())
+    finally:
+        response.close()
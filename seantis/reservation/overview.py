@@ -2,12 +2,16 @@ import json
 from datetime import timedelta, datetime
 
 from five import grok
+from zope.component import getUtility
 from zope.interface import Interface
 
-from seantis.reservation.resource import CalendarRequest, get_queries
+from seantis.reservation.resource import CalendarRequest
+from seantis.reservation import availability
+from seantis.reservation import exposure
 from seantis.reservation import utils
 from seantis.reservation.base import BaseView, BaseViewlet
 from seantis.reservation.interfaces import IOverview, OverviewletManager
+from seantis.reservation.session import ILibresUtility
 
 
 class Overviewlet(BaseViewlet):
@@ -83,6 +87,9 @@ class Overview(BaseView, CalendarRequest):
         result = CalendarRequest.render(self)
         return result
 
+    def etag_resources(self):
+        return [utils.string_uuid(uuid) for uuid in self.uuids()]
+
     def events(self, daterange=None, uuids=None):
         """ Returns the events for the overview. """
 
@@ -93,21 +100,23 @@ class Overview(BaseView, CalendarRequest):
         events = []
 
         uuids = uuids or self.uuids()
-        queries = get_queries(uuids)
-        days = queries.availability_by_day(start, end, uuids)
+        days = availability.availability_by_day(
+            getUtility(ILibresUtility).context, start, end, uuids,
+            exposure.for_allocations(uuids)
+        )
 
         for day, result in days.items():
 
             event_start = datetime(day.year, day.month, day.day, 0, 0)
             event_end = event_start + timedelta(days=+1, microseconds=-1)
 
-            availability, resources = result
+            value, resources = result
             events.append(dict(
                 start=event_start.isoformat(),
                 end=event_end.isoformat(),
                 title=u'',
                 uuids=[utils.string_uuid(r) for r in resources],
-                className=utils.event_class(availability)
+                className=utils.event_class(value)
             ))
 
         return events
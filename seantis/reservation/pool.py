@@ -0,0 +1,366 @@
+""" Shares the database engines of libres between the sites of a Zope
+instance and keeps statistics about their connection pools, as well as the
+versions of the database servers.
+
+All sites using the same dsn use the same engine and therefore the same
+connection pool. The pool is configured in the zope.conf, next to the dsn
+(see database.cfg.example):
+
+    pool-size          The number of connections kept open (default 5).
+    pool-max-overflow  The number of connections opened on top of those
+                       if needed, -1 for no limit (default 5).
+    pool-timeout       The number of seconds to wait for a connection to be
+                       returned once all are in use (default 30).
+    pool-recycle       The number of seconds after which a connection is
+                       replaced, -1 to keep the connections (default -1).
+    pool-pre-ping      True if connections are tested before they are used,
+                       which hides restarts of the database (default False).
+
+"""
+
+import json
+import re
+import threading
+import time
+
+from five import grok
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+from zope.interface import Interface
+
+from seantis.reservation import utils
+from seantis.reservation.base import BaseView
+
+
+# libres assumes serializable connections throughout
+SERIALIZABLE = 'SERIALIZABLE'
+
+
+def boolean(value):
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+# product config key, engine argument, type, default
+settings_spec = (
+    ('pool-size', 'pool_size', int, 5),
+    ('pool-max-overflow', 'max_overflow', int, 5),
+    ('pool-timeout', 'pool_timeout', int, 30),
+    ('pool-recycle', 'pool_recycle', int, -1),
+    ('pool-pre-ping', 'pre_ping', boolean, False),
+)
+
+# (dsn, settings) -> engine
+_engines = {}
+_engines_lock = threading.Lock()
+
+# (host, port) -> (major, minor)
+_versions = {}
+_versions_lock = threading.Lock()
+
+
+def pool_settings():
+    """ Returns the pool settings found in the zope.conf, using the defaults
+    for the missing ones.
+
+    """
+    settings = {}
+
+    for key, argument, convert, default in settings_spec:
+        value = utils.get_config(key)
+
+        if value is None or value == '':
+            settings[argument] = default
+        else:
+            settings[argument] = convert(value)
+
+    return settings
+
+
+def default_engine_config():
+    return {
+        'json_serializer': utils.json_dumps,
+        'json_deserializer': utils.json_loads
+    }
+
+
+def get_engine(dsn, engine_config=None):
+    """ Returns the engine of the given dsn, creating it if necessary. The
+    engine config is only used when the engine is created.
+
+    """
+    settings = pool_settings()
+    key = (dsn, tuple(sorted(settings.items())))
+
+    with _engines_lock:
+        if key not in _engines:
+            _engines[key] = create_pooled_engine(
+                dsn, settings, engine_config or default_engine_config()
+            )
+
+        return _engines[key]
+
+
+def create_pooled_engine(dsn, settings, engine_config):
+    settings = settings.copy()
+    pre_ping = settings.pop('pre_ping')
+
+    engine = create_engine(
+        dsn, poolclass=InstrumentedQueuePool, isolation_level=SERIALIZABLE,
+        **dict(settings, **engine_config)
+    )
+
+    if pre_ping:
+        statistics = engine.pool.statistics
+
+        def on_checkout(dbapi_connection, connection_record, proxy):
+            ping_connection(dbapi_connection, statistics)
+
+        event.listen(engine, 'checkout', on_checkout)
+
+    return engine
+
+
+def ping_connection(dbapi_connection, statistics):
+    """ Tests the connection before it is used. A broken connection is
+    replaced by the pool, which retries the checkout.
+
+    """
+    cursor = dbapi_connection.cursor()
+
+    try:
+        cursor.execute('SELECT 1')
+    except Exception:
+        statistics.add_ping_failure()
+        raise exc.DisconnectionError()
+    finally:
+        cursor.close()
+
+
+def server_key(dsn):
+    url = make_url(dsn)
+    return url.host or 'localhost', url.port or 5432
+
+
+def parse_version(text):
+    """ Returns the major and the minor version found in the result of
+    postgres' version() function.
+
+    """
+    major, minor = re.search(r'PostgreSQL (\d+)(?:\.(\d+))?', text).groups()
+    return int(major), int(minor or 0)
+
+
+def server_version(dsn):
+    """ Returns the version of the postgres server of the given dsn in a
+    tuple with the major and the minor version.
+
+    The version is queried once per server (host and port) and process,
+    through the pooled engine of the dsn. Sites with different databases
+    on the same server therefore don't open any further connection.
+
+    """
+    key = server_key(dsn)
+
+    with _versions_lock:
+        if key in _versions:
+            return _versions[key]
+
+    # the lock is not held while querying, so the servers of other dsns
+    # may be queried at the same time
+    connection = get_engine(dsn).connect()
+
+    try:
+        version = parse_version(
+            connection.execute('select version()').scalar()
+        )
+    finally:
+        connection.close()
+
+    with _versions_lock:
+        _versions[key] = version
+
+    return version
+
+
+def server_versions():
+    """ Returns the versions known to this process by "host:port". """
+    with _versions_lock:
+        return dict(
+            ('{}:{}'.format(*key), '{}.{}'.format(*version))
+            for key, version in _versions.items()
+        )
+
+
+def clear_server_versions():
+    """ Forgets the versions of the servers, for testing. """
+    with _versions_lock:
+        _versions.clear()
+
+
+def dispose_engines():
+    """ Closes the connections of all engines and forgets the engines, for
+    testing.
+
+    """
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+
+        _engines.clear()
+
+
+class PoolStatistics(object):
+    """ Counts the checkouts of a connection pool, the checkouts which had
+    to wait for a connection and the connections opened.
+
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.timeouts = 0
+        self.connects = 0
+        self.connect_time = 0.0
+        self.max_connect_time = 0.0
+        self.ping_failures = 0
+
+    def add_checkout(self, waited=None):
+        with self.lock:
+            self.checkouts += 1
+
+            if waited is not None:
+                self.waits += 1
+                self.wait_time += waited
+                self.max_wait_time = max(self.max_wait_time, waited)
+
+    def add_timeout(self):
+        with self.lock:
+            self.timeouts += 1
+
+    def add_connect(self, duration):
+        with self.lock:
+            self.connects += 1
+            self.connect_time += duration
+            self.max_connect_time = max(self.max_connect_time, duration)
+
+    def add_ping_failure(self):
+        with self.lock:
+            self.ping_failures += 1
+
+    def as_dict(self):
+        with self.lock:
+            return dict(
+                checkouts=self.checkouts,
+                waits=self.waits,
+                wait_time=self.wait_time,
+                max_wait_time=self.max_wait_time,
+                timeouts=self.timeouts,
+                connects=self.connects,
+                average_connect_time=(
+                    self.connects and self.connect_time / self.connects or 0.0
+                ),
+                max_connect_time=self.max_connect_time,
+                ping_failures=self.ping_failures
+            )
+
+
+class InstrumentedQueuePool(QueuePool):
+    """ The default pool of SQLAlchemy, keeping :class:`PoolStatistics`. """
+
+    def __init__(self, *args, **kwargs):
+        super(InstrumentedQueuePool, self).__init__(*args, **kwargs)
+        self.statistics = PoolStatistics()
+
+    def recreate(self):
+        # the pool is recreated when the engine is disposed
+        pool = super(InstrumentedQueuePool, self).recreate()
+        pool.statistics = self.statistics
+
+        return pool
+
+    def is_exhausted(self):
+        if self._max_overflow < 0:
+            return False
+
+        return self.checkedin() == 0 and self.overflow() >= self._max_overflow
+
+    def _do_get(self):
+        waiting = self.is_exhausted()
+        started = time.time()
+
+        try:
+            connection = super(InstrumentedQueuePool, self)._do_get()
+        except exc.TimeoutError:
+            self.statistics.add_timeout()
+            raise
+
+        self.statistics.add_checkout(
+            time.time() - started if waiting else None
+        )
+
+        return connection
+
+    def _create_connection(self):
+        started = time.time()
+        connection = super(InstrumentedQueuePool, self)._create_connection()
+        self.statistics.add_connect(time.time() - started)
+
+        return connection
+
+
+def mask_password(dsn):
+    return re.sub(r'://([^:/@]+):[^@]*@', r'://\1:***@', dsn)
+
+
+def statistics():
+    """ Returns the configuration, the state and the statistics of the
+    connection pool of each engine in this process.
+
+    """
+    with _engines_lock:
+        engines = _engines.items()
+
+    result = []
+    versions = server_versions()
+
+    for (dsn, settings), engine in sorted(engines):
+        pool = engine.pool
+
+        info = dict(settings)
+        info.update(pool.statistics.as_dict())
+        info.update(
+            dsn=mask_password(dsn),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=max(pool.overflow(), 0),
+            server_version=versions.get('{}:{}'.format(*server_key(dsn)))
+        )
+
+        result.append(info)
+
+    return result
+
+
+class PoolStatisticsView(BaseView):
+    """ Returns the pool statistics of this process as json, to find out
+    how many connections are needed by the Zope instances. Each pool also
+    shows the version of its database server, once it is known.
+
+    """
+
+    permission = 'cmf.ManagePortal'
+
+    grok.name('reservation-pool-statistics')
+    grok.require(permission)
+    grok.context(Interface)
+
+    def render(self):
+        self.request.response.setHeader('Content-Type', 'application/json')
+        self.request.response.setHeader('Cache-Control', 'no-cache')
+
+        return json.dumps(statistics(), indent=2, sort_keys=True)
@@ -1,5 +1,6 @@
 from seantis.reservation import (
     form,
+    metadata,
     utils
 )
 
@@ -11,14 +12,9 @@ class GeneralReportParametersMixin(
     form.ResourceParameterView
 ):
 
-    titles = {}
-
     def resource_title(self, uuid):
-        if not uuid in self.titles:
-            self.titles[uuid] = utils.get_resource_title(self.resources[uuid])
-        
-        return self.titles[uuid]
-    
+        return metadata.resource_title(self.resources[uuid])
+
     @property
     def statuses(self):
         return (
@@ -1,7 +1,7 @@
 import json
 import sedate
 
-from calendar import Calendar
+from calendar import Calendar, monthrange
 from datetime import date, timedelta, datetime
 
 from five import grok
@@ -9,11 +9,14 @@ from zope.interface import Interface
 from plone.memoize import view
 
 from seantis.reservation import _
+from seantis.reservation import metadata
 from seantis.reservation import Session
 from seantis.reservation import settings
 from seantis.reservation import utils
 from libres import modules
 from libres.db.models import Allocation, Reservation
+from libres.db.models.types import UTCDateTime
+from sqlalchemy import case, type_coerce
 from seantis.reservation.reports import GeneralReportParametersMixin
 from seantis.reservation.interfaces import ISeantisReservationSpecific
 
@@ -143,120 +146,138 @@ def monthly_report(year, month, resources, reservations='*'):
     titles = dict()
 
     for uuid in resources.keys():
-        titles[uuid] = utils.get_resource_title(resources[uuid])
-
-    # timezone of the report
-    timezone = settings.timezone()
+        titles[uuid] = metadata.resource_title(resources[uuid])
 
     # this order is used for every day in the month
     ordered_uuids = [i[0] for i in sorted(titles.items(), key=lambda i: i[1])]
 
-    # build the hierarchical structure of the report data
-    report = utils.OrderedDict()
-    last_day = 28
-
-    for d in sorted((d for d in calendar.itermonthdates(year, month))):
-        if not d.month == month:
-            continue
-
-        day = d.day
-        last_day = max(last_day, day)
-        report[day] = utils.OrderedDict()
-
-        for uuid in ordered_uuids:
-            report[day][uuid] = dict()
-            report[day][uuid][u'title'] = titles[uuid]
-            report[day][uuid][u'approved'] = list()
-            report[day][uuid][u'pending'] = list()
-            report[day][uuid][u'url'] = resources[uuid].absolute_url()
-            report[day][uuid][u'lists'] = {
-                u'approved': _(u'Approved'),
-                u'pending': _(u'Pending'),
-            }
+    # timezone of the report
+    timezone = settings.timezone()
 
-    # gather the reservations with as much bulk loading as possible
     period_start = datetime(year, month, 1, tzinfo=timezone)
-    period_end = datetime(year, month, last_day, tzinfo=timezone)
+    period_end = datetime(
+        year, month, monthrange(year, month)[1], tzinfo=timezone
+    )
     period_end += timedelta(days=1, microseconds=-1)
 
-    # get a list of relevant allocations in the given period
-    query = Session().query(Allocation)
-    query = query.filter(period_start <= Allocation._start)
-    query = query.filter(Allocation._start <= period_end)
-    query = query.filter(Allocation.resource == Allocation.mirror_of)
-    query = query.filter(Allocation.resource.in_(resources.keys()))
-
-    allocations = query.all()
+    rows = report_rows(period_start, period_end, resources, reservations)
 
-    # quit if there are no allocations at this point
-    if not allocations:
+    if not rows:
         return {}
 
-    # store by group as it will be needed multiple times over later
-    groups = dict()
-    for allocation in allocations:
-        groups.setdefault(allocation.group, list()).append(allocation)
-
-    # using the groups get the relevant reservations
-    query = Session().query(Reservation)
-    query = query.filter(Reservation.target.in_(groups.keys()))
-
-    if reservations != '*':
-        query = query.filter(Reservation.token.in_(reservations))
-
-    query = query.order_by(Reservation.status)
-
-    reservations = query.all()
-
-    @utils.memoize
+    # the caches only live as long as the report is built, but a month may
+    # hold many more reservations than the default size of memoize
+    @utils.memoize(maxsize=4096)
     def json_timespans(start, end):
         return json.dumps([dict(start=start, end=end)])
 
-    used_days = dict([(i, False) for i in range(1, 32)])
-    timezone = settings.timezone()
-
-    def add_reservation(start, end, reservation):
-        day = start.day
-
-        used_days[day] = True
-
-        end += timedelta(microseconds=1)
-
-        start = sedate.to_timezone(start, timezone=timezone)
-        end = sedate.to_timezone(end, timezone=timezone)
+    @utils.memoize(maxsize=4096)
+    def localize_time(date):
+        date = sedate.to_timezone(date, timezone=timezone)
+        return utils.localize_date(date, time_only=True)
 
-        start = utils.localize_date(start, time_only=True)
-        end = utils.localize_date(end, time_only=True)
+    @utils.memoize
+    def quota_statement(quota):
+        return utils.get_reservation_quota_statement(quota)
+
+    lists = {
+        u'approved': _(u'Approved'),
+        u'pending': _(u'Pending'),
+    }
+
+    # day -> resource -> entry, only for the days and resources in use
+    entries = dict()
+
+    for row in rows:
+        uuid = utils.string_uuid(row.resource)
+        day = row.start.day
+
+        by_resource = entries.setdefault(day, dict())
+
+        if uuid not in by_resource:
+            by_resource[uuid] = {
+                u'title': titles[uuid],
+                u'approved': list(),
+                u'pending': list(),
+                u'url': metadata.resource_url(resources[uuid]),
+                u'lists': lists,
+            }
 
-        context = resources[utils.string_uuid(reservation.resource)]
+        start = localize_time(row.start)
+        end = localize_time(row.end + timedelta(microseconds=1))
 
-        reservation_lists = report[day][utils.string_uuid(
-            reservation.resource
-        )]
-        reservation_lists[reservation.status].append(
+        by_resource[uuid][row.status].append(
             dict(
                 start=start,
                 end=end,
-                email=reservation.email,
-                data=reservation.data,
+                email=row.email,
+                data=row.data,
                 timespans=json_timespans(start, end),
-                id=reservation.id,
-                token=reservation.token,
-                quota=utils.get_reservation_quota_statement(reservation.quota),
-                resource=context,
+                id=row.id,
+                token=row.token,
+                quota=quota_statement(row.quota),
+                resource=resources[uuid],
             )
         )
 
-    for reservation in reservations:
-        if reservation.target_type == u'allocation':
-            add_reservation(reservation.start, reservation.end, reservation)
-        else:
-            for allocation in groups[reservation.target]:
-                add_reservation(allocation.start, allocation.end, reservation)
+    report = utils.OrderedDict()
 
-    # remove unused days
-    for day in report:
-        if not used_days[day]:
-            del report[day]
+    for day in sorted(entries):
+        report[day] = utils.OrderedDict(
+            (uuid, entries[day][uuid])
+            for uuid in ordered_uuids if uuid in entries[day]
+        )
 
     return report
+
+
+def report_rows(period_start, period_end, resources, reservations='*'):
+    """ Returns the reservations of the given resources in the given period,
+    with one row per reserved allocation, ordered by start.
+
+    Reservations targeting a group are joined with the allocations of the
+    group in the period, reservations targeting a single allocation keep
+    their own start and end. Only the columns needed for the report are
+    loaded.
+
+    """
+
+    if not resources:
+        return []
+
+    is_single = Reservation.target_type == u'allocation'
+
+    start = type_coerce(
+        case([(is_single, Reservation.start)], else_=Allocation._start),
+        UTCDateTime(timezone=False)
+    ).label('start')
+
+    end = type_coerce(
+        case([(is_single, Reservation.end)], else_=Allocation._end),
+        UTCDateTime(timezone=False)
+    ).label('end')
+
+    query = Session().query(
+        Reservation.id,
+        Reservation.token,
+        Reservation.email,
+        Reservation.status,
+        Reservation.quota,
+        Reservation.resource,
+        Reservation.data,
+        start,
+        end
+    )
+
+    query = query.join(Allocation, Allocation.group == Reservation.target)
+    query = query.filter(period_start <= Allocation._start)
+    query = query.filter(Allocation._start <= period_end)
+    query = query.filter(Allocation.resource == Allocation.mirror_of)
+    query = query.filter(Allocation.resource.in_(resources.keys()))
+
+    if reservations != '*':
+        query = query.filter(Reservation.token.in_(reservations))
+
+    query = query.order_by(start, Reservation.status, Reservation.id)
+
+    return query.all()
@@ -56,34 +56,37 @@ from seantis.reservation.throttle import throttled
 class ReservationUrls(object):
     """ Mixin class to create admin URLs for a specific reservation. """
 
+    def url_base(self, context):
+        return context.absolute_url()
+
     def revoke_all_url(self, token, context=None):
         context = context or self.context
-        base = context.absolute_url()
+        base = self.url_base(context)
         return base + u'/revoke-reservation?token={}'.format(token)
 
     def approve_all_url(self, token, context=None):
         context = context or self.context
-        base = context.absolute_url()
+        base = self.url_base(context)
         return base + u'/approve-reservation?token={}'.format(token)
 
     def deny_all_url(self, token, context=None):
         context = context or self.context
-        base = context.absolute_url()
+        base = self.url_base(context)
         return base + u'/deny-reservation?token={}'.format(token)
 
     def update_all_url(self, token, context=None):
         context = context or self.context
-        base = context.absolute_url()
+        base = self.url_base(context)
         return base + u'/update-reservation-data?token={}'.format(token)
 
     def print_all_url(self, token, context):
         context = context or self.context
-        base = context.absolute_url()
+        base = self.url_base(context)
         return base + u'/reservations?token={}&print=1'.format(token)
 
     def show_all_url(self, token, context):
         context = context or self.contex
-        base = context.absolute_url()
+        base = self.url_base(context)
         return base + u'/reservations?token={}'.format(token)
 
 
@@ -1,21 +1,26 @@
 from logging import getLogger
 log = getLogger('seantis.reservation')
 
+import hashlib
+import isodate
 import json
-import libres
 import pytz
 
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 
 from Products.ATContentTypes.interface import IATFolder
 
+from AccessControl import getSecurityManager
 from Acquisition import aq_inner
 from five import grok
+from libres.db.models import Allocation, Reservation
 from plone import api
 from plone.dexterity.content import Container
 from plone.uuid.interfaces import IUUID
 from plone.app.linkintegrity.interfaces import ILinkIntegrityInfo
 from plone.memoize import view
+from sqlalchemy import and_, func, or_
+from zope.annotation.interfaces import IAnnotations
 from zope.component import getUtility
 from zope.event import notify
 from zope.interface import implements, Interface
@@ -23,31 +28,44 @@ from zope.lifecycleevent.interfaces import IObjectRemovedEvent
 
 from seantis.reservation import _
 from seantis.reservation import exposure
+from seantis.reservation import Session
 from seantis.reservation import settings
 from seantis.reservation import utils
 from seantis.reservation.base import BaseView
 from seantis.reservation.events import ResourceViewedEvent
 from seantis.reservation.timeframe import timeframes_by_context
+from seantis.reservation.timeframe import timeframe_index
 from seantis.reservation.form import AllocationGroupView, ResourceParameterView
 from seantis.reservation.interfaces import IResourceBase
 from seantis.reservation.interfaces import IOverview
 from seantis.reservation.session import ILibresUtility
 
 
-class LibresExposure(object):
+# the request annotations holding the schedulers of the current request
+schedulers_key = 'seantis.reservation.schedulers'
 
-    def __init__(self, fn):
-        self.is_allocation_exposed = fn
+# the request annotations holding the number of schedulers built
+constructions_key = 'seantis.reservation.scheduler_constructions'
 
 
-def get_queries(resources):
-    libres_util = getUtility(ILibresUtility)
-    libres_util.context.set_service(
-        'exposure',
-        lambda ctx: LibresExposure(exposure.for_allocations(resources))
-    )
+def count_scheduler_construction(request):
+    try:
+        annotations = IAnnotations(request)
+    except TypeError:
+        return
+
+    annotations[constructions_key] = annotations.get(constructions_key, 0) + 1
+
+
+def scheduler_constructions(request):
+    """ Returns the number of schedulers built by :meth:`Resource.scheduler`
+    during the given request.
 
-    return libres.db.queries.Queries(libres_util.context)
+    """
+    try:
+        return IAnnotations(request).get(constructions_key, 0)
+    except TypeError:
+        return 0
 
 
 class Resource(Container):
@@ -62,15 +80,31 @@ class Resource(Container):
         return utils.string_uuid(self.uuid())
 
     def scheduler(self, language=None):
+        """ Returns the scheduler of this resource. The scheduler is kept
+        for the rest of the request, as long as the exposure of the current
+        user stays the same.
+
+        """
         uuid = utils.string_uuid(self.uuid())
+        timezone = settings.timezone().zone
 
-        libres_util = getUtility(ILibresUtility)
-        libres_util.context.set_service(
-            'exposure',
-            lambda ctx: LibresExposure(exposure.for_allocations([uuid]))
-        )
+        request = getattr(self, 'REQUEST', None)
+        schedulers = exposure.user_cache(request, schedulers_key)
+
+        is_exposed = exposure.cached_for_allocations([uuid])
+        scheduler = schedulers.get((uuid, timezone))
 
-        return libres_util.scheduler(uuid, settings.timezone().zone)
+        if scheduler is None or scheduler.is_allocation_exposed is not \
+                is_exposed:
+
+            scheduler = getUtility(ILibresUtility).scheduler(
+                uuid, timezone, is_exposed=is_exposed
+            )
+            schedulers[(uuid, timezone)] = scheduler
+
+            count_scheduler_construction(request)
+
+        return scheduler
 
     def timeframes(self):
         return timeframes_by_context(self)
@@ -174,10 +208,11 @@ class View(BaseView, YourReservationsViewlet):
         if not hasattr(uids, '__iter__'):
             uids = [uids]
 
+        brains = utils.get_resources_by_uuids(uids)
+
         resources = [self.context]
         for uid in uids:
-            resource = utils.get_resource_by_uuid(uid)
-            resources.append(resource.getObject())
+            resources.append(brains[uid].getObject())
 
         template = 'seantis-reservation-calendar-%i'
         for ix, resource in enumerate(resources):
@@ -227,12 +262,15 @@ class View(BaseView, YourReservationsViewlet):
         this.seantis.calendars.push({
             id:'#%s',
             options:%s,
-            addurl:'%s'
+            addurl:'%s',
+            deltaurl:'%s',
+            menus:%s
         })
         """
         baseurl = resource.absolute_url_path()
         addurl = baseurl + '/allocate'
         eventurl = baseurl + '/slots'
+        deltaurl = baseurl + '/slots-delta'
 
         options = {}
         options['events'] = eventurl
@@ -278,8 +316,12 @@ class View(BaseView, YourReservationsViewlet):
                 'year': 'dddd M/d'
             }
 
+        # the menus of the events are sent once with the page (see Slots)
+        menus = Slots(resource, self.request).menu_templates()
+
         return template % (
-            resource._v_calendar_id, json.dumps(options), addurl
+            resource._v_calendar_id, json.dumps(options), addurl, deltaurl,
+            json.dumps(menus)
         )
 
     @property
@@ -346,7 +388,61 @@ class ThankYouPage(BaseView, ResourceParameterView):
         return blocks
 
 
+def changes_stamp(session, resources, start, end):
+    """ Returns a tuple which changes whenever an allocation or a reservation
+    of the given resources in the given range is added, changed or removed.
+
+    The tuple consists of the number of allocations and reservations and
+    their last change, which are all loaded in a single query.
+
+    """
+
+    if not resources:
+        return None
+
+    allocations = session.query(
+        func.count(Allocation.id), func.max(last_change(Allocation))
+    )
+    allocations = allocations.filter(Allocation.mirror_of.in_(resources))
+    allocations = allocations.filter(Allocation._start <= end)
+    allocations = allocations.filter(start <= Allocation._end)
+
+    reservations = session.query(
+        func.count(Reservation.id), func.max(last_change(Reservation))
+    )
+    reservations = filter_reservations_in_range(
+        reservations, resources, start, end
+    )
+
+    return session.query(
+        allocations.subquery(), reservations.subquery()
+    ).one()
+
+
+def last_change(model):
+    return func.coalesce(model.modified, model.created)
+
+
+def filter_reservations_in_range(query, resources, start, end):
+    """ Limits the given reservation query to the reservations of the given
+    resources in the given range.
+
+    """
+    query = query.filter(Reservation.resource.in_(resources))
+
+    # reservations targeting a group have no start and end
+    return query.filter(or_(
+        Reservation.start == None,
+        and_(Reservation.start <= end, start <= Reservation.end)
+    ))
+
+
 class CalendarRequest(object):
+    """ Base for the views which return the events of a fullcalendar range as
+    json. The events are only built if the client's version of the range is
+    out of date, which is checked through the etag.
+
+    """
 
     @property
     def range(self):
@@ -366,10 +462,66 @@ class CalendarRequest(object):
         if not all((start, end)):
             return json.dumps([])
 
+        stamp = self.changes_stamp()
+        etag = self.etag(stamp)
+
+        response = self.request.response
+        response.setHeader('ETag', etag)
+        response.setHeader('Cache-Control', 'private, no-cache')
+
+        self.set_version_header(stamp)
+
+        if etag == self.request.getHeader('If-None-Match'):
+            response.setStatus(304)
+            return ''
+
         events = self.events()
 
         return json.dumps(events, cls=utils.UUIDEncoder)
 
+    def changes_stamp(self):
+        start, end = self.range
+        return changes_stamp(Session(), self.etag_resources(), start, end)
+
+    def etag(self, stamp=None):
+        """ Returns a version of the events in the requested range, which
+        changes if the allocations or reservations of the range change, or
+        if the events would look differently to the current user.
+
+        """
+        if stamp is None:
+            stamp = self.changes_stamp()
+
+        key = (stamp, self.presentation_key())
+        return '"{}"'.format(hashlib.md5(repr(key)).hexdigest())
+
+    def set_version_header(self, stamp):
+        """ Hook to send further headers derived from the changes stamp. """
+
+    def presentation_key(self):
+        """ Returns a key which changes if the events would look differently
+        to the current user, even though the allocations and reservations
+        stayed the same.
+
+        """
+        start, end = self.range
+        user = getSecurityManager().getUser()
+
+        key = (
+            start, end, sorted(self.etag_resources()),
+            user.getId(), sorted(user.getRolesInContext(self.context)),
+            timeframe_index().version,
+            utils.get_current_language(self.context, self.request),
+            settings.get('available_threshold'),
+            settings.get('partly_available_threshold')
+        )
+
+        return hashlib.md5(repr(key)).hexdigest()
+
+    def etag_resources(self):
+        """ Returns the uuids of the resources shown by the events. """
+        raise NotImplementedError
+
     def events(self):
         raise NotImplementedError
 
@@ -384,6 +536,33 @@ class Slots(BaseView, CalendarRequest):
     def render(self):
         return CalendarRequest.render(self)
 
+    def etag_resources(self):
+        return [self.context.string_uuid()]
+
+    def set_version_header(self, stamp):
+        # the version to pass to slots-delta to get the changes since
+        self.request.response.setHeader(
+            'X-Seantis-Version', self.version(stamp)
+        )
+
+    def version(self, stamp=None):
+        """ Returns the version of the events in the requested range, as
+        understood by the slots-delta view.
+
+        """
+        if stamp is None:
+            stamp = self.changes_stamp()
+
+        # the last change of the allocations and the reservations, either
+        # of which is None if there are none in the range
+        last = max([d for d in (stamp[1], stamp[3]) if d] or [None])
+
+        return '|'.join((
+            self.presentation_key(),
+            last and last.isoformat() or '',
+            str(stamp[2])
+        ))
+
     @property
     def resource(self):
         return self.context
@@ -392,43 +571,89 @@ class Slots(BaseView, CalendarRequest):
     def scheduler(self):
         return self.context.scheduler()
 
-    def urls(self, allocation):
-        """Returns the options for the js contextmenu for the given allocation
-        as well as other links associated with the event.
+    @utils.cached_property
+    def url_cache(self):
+        # the permissions of the views are checked once for all events
+        return utils.EventUrlCache(self.context, self.request, exposure)
+
+    # the variants of the event menus (see menu_key)
+    menu_keys = ('allocation', 'allocation-in-group', 'group')
+
+    def menu_key(self, allocation, in_group):
+        """Returns the variant of the menu used by the given allocation."""
+
+        if allocation.partly_available or not in_group:
+            return in_group and 'allocation-in-group' or 'allocation'
+
+        return 'group'
+
+    def menu_params(self, allocation):
+        """Returns the parameters which are filled into the menu of the given
+        allocation.
 
         """
+        return dict(
+            id=allocation.id,
+            group=allocation.group,
+            start=utils.utctimestamp(
+                allocation.display_start(settings.timezone())),
+            end=utils.utctimestamp(
+                allocation.display_end(settings.timezone())),
+            date=allocation.start.strftime('%Y-%m-%d')
+        )
+
+    def menu_templates(self):
+        """Returns the menus of all variants with placeholders instead of the
+        parameters of the allocations, to be expanded by the client (see
+        context.js).
+
+        The events only carry the variant of their menu and the parameters
+        which are not found on the event already, which keeps the events of
+        busy calendars small.
 
-        items = utils.EventUrls(self.context, self.request, exposure)
+        """
+        placeholders = dict(
+            (key, utils.menu_placeholder(key))
+            for key in ('id', 'group', 'start', 'end', 'date')
+        )
 
-        start = utils.utctimestamp(
-            allocation.display_start(settings.timezone()))
-        end = utils.utctimestamp(
-            allocation.display_end(settings.timezone()))
+        return dict(
+            (key, self.menu_urls(key, placeholders).as_template())
+            for key in self.menu_keys
+        )
+
+    def menu_urls(self, key, params):
+        """Returns the urls of the given menu variant with the given
+        parameters (see menu_params).
+
+        """
 
-        items.move_url('edit-allocation', dict(id=allocation.id))
+        in_group = key != 'allocation'
+
+        items = utils.EventUrls(self.url_cache)
+
+        items.move_url('edit-allocation', dict(id=params['id']))
 
         # Reservation
         res_add = lambda n, v, p, t: \
             items.menu_add(_(u'Reservations'), n, v, p, t)
-        if allocation.is_separate:
-            res_add(
-                _(u'Reserve'), 'reserve',
-                dict(id=allocation.id, start=start, end=end), 'overlay'
-            )
-            items.default_url(
-                'reserve', dict(id=allocation.id, start=start, end=end)
+        if key != 'group':
+            reserve = dict(
+                id=params['id'], start=params['start'], end=params['end']
             )
+            res_add(_(u'Reserve'), 'reserve', reserve, 'overlay')
+            items.default_url('reserve', reserve)
         else:
             res_add(
-                _(u'Reserve'), 'reserve-group', dict(group=allocation.group),
+                _(u'Reserve'), 'reserve-group', dict(group=params['group']),
                 'overlay'
             )
             items.default_url(
-                'reserve', dict(group=allocation.group)
+                'reserve', dict(group=params['group'])
             )
 
         res_add(
-            _(u'Manage'), 'reservations', dict(group=allocation.group),
+            _(u'Manage'), 'reservations', dict(group=params['group']),
             'inpage'
         )
 
@@ -437,26 +662,26 @@ class Slots(BaseView, CalendarRequest):
             items.menu_add(_('Entry'), n, v, p, t)
 
         entry_add(
-            _(u'Edit'), 'edit-allocation', dict(id=allocation.id), 'overlay'
+            _(u'Edit'), 'edit-allocation', dict(id=params['id']), 'overlay'
         )
 
         entry_add(
-            _(u'Remove'), 'remove-allocation', dict(id=allocation.id),
+            _(u'Remove'), 'remove-allocation', dict(id=params['id']),
             'overlay'
         )
 
-        if allocation.in_group:
+        if in_group:
             # menu entries for group items
             group_add = lambda n, v, p, t: \
                 items.menu_add(_('Recurrences'), n, v, p, t)
 
             group_add(
-                _(u'List'), 'group', dict(name=allocation.group), 'overlay'
+                _(u'List'), 'group', dict(name=params['group']), 'overlay'
             )
 
             group_add(
                 _(u'Remove'), 'remove-allocation',
-                dict(group=allocation.group),
+                dict(group=params['group']),
                 'overlay'
             )
 
@@ -466,35 +691,53 @@ class Slots(BaseView, CalendarRequest):
                 _(u'Reservations'), _(u'Daily View'), 'view',
                 dict(
                     selected_view='agendaDay',
-                    specific_date=allocation.start.strftime('%Y-%m-%d')
+                    specific_date=params['date']
                 ), 'window'
             )
 
         return items
 
-    def events(self):
+    def exposed_allocations(self):
+        is_exposed = exposure.for_allocations([self.context])
+
+        return [
+            a for a in self.scheduler.allocations_in_range(*self.range)
+            if is_exposed(a)
+        ]
+
+    def events(self, allocations=None):
+        """ Returns the events of the exposed allocations in the requested
+        range, or the events of the given allocations.
+
+        """
         resource = self.context
         scheduler = resource.scheduler()
         translate = utils.translator(self.context, self.request)
 
-        is_exposed = exposure.for_allocations([resource])
+        if allocations is None:
+            allocations = self.exposed_allocations()
+
+        # the availability of all allocations is fetched at once, as a
+        # separate query per allocation adds up quickly on busy calendars
+        statistics = scheduler.allocation_statistics(allocations)
 
         # get an event for each exposed allocation
         events = []
-        for alloc in scheduler.allocations_in_range(*self.range):
-
-            if not is_exposed(alloc):
-                continue
+        for alloc in allocations:
 
             start = alloc.display_start(settings.timezone())
             end = alloc.display_end(settings.timezone())
 
-            # get the urls
-            urls = self.urls(alloc)
+            stats = statistics[alloc.id]
+
+            # the menu is expanded by the client (see menu_templates)
+            params = self.menu_params(alloc)
 
             # calculate the availability for title and class
             availability, title, klass = utils.event_availability(
-                resource, self.request, scheduler, alloc
+                resource, self.request, scheduler, alloc,
+                availability=stats.availability,
+                waitinglist_length=stats.waitinglist_length
             )
 
             if alloc.partly_available:
@@ -512,15 +755,133 @@ class Slots(BaseView, CalendarRequest):
                 start=start.isoformat(),
                 end=end.isoformat(),
                 className=klass,
-                url=urls.default,
-                menu=urls.menu,
-                menuorder=urls.order,
+                menukey=self.menu_key(alloc, stats.group_size > 1),
+                params=dict(
+                    start=params['start'],
+                    end=params['end'],
+                    date=params['date']
+                ),
                 allocation=alloc.id,
                 partitions=partitions,
                 group=alloc.group,
                 allDay=False,
-                moveurl=urls.move,
                 header=event_header
             ))
 
         return events
+
+
+class SlotsDelta(Slots):
+    """ Returns the events of the requested range which changed since the
+    given version, to patch the calendar in place after a change. The version
+    of the events is sent by the slots view in the X-Seantis-Version header.
+
+    Returns a json object with the following keys:
+
+    version:  The version to pass on the next request.
+    full:     True if the calendar needs to fetch all events.
+    events:   The events of the added or changed allocations.
+    ids:      The ids of all allocations in the range. Events of other
+              allocations were removed.
+
+    The events of all allocations touched by a change are returned, not just
+    the changed data. The changes are found through the last change of the
+    allocations and reservations. As reservations are deleted without a
+    trace, any removed reservation leads to a full fetch.
+
+    """
+
+    grok.name('slots-delta')
+
+    # changes committed after a version was read may have an older timestamp,
+    # so the changes of this many seconds before the version are included
+    overlap = timedelta(seconds=10)
+
+    def render(self):
+        start, end = self.range
+        if not all((start, end)):
+            return json.dumps(dict(version=None, full=True))
+
+        self.request.response.setHeader('Cache-Control', 'no-cache')
+
+        return json.dumps(self.delta(), cls=utils.UUIDEncoder)
+
+    def parse_version(self, version):
+        """ Returns the presentation key, last change and number of
+        reservations of the given version or None if it is invalid.
+
+        """
+        try:
+            key, last, reservations = version.split('|')
+
+            return (
+                key,
+                last and isodate.parse_datetime(last) or None,
+                int(reservations)
+            )
+        except (AttributeError, ValueError, isodate.ISO8601Error):
+            return None
+
+    def delta(self):
+        version = self.version()
+        previous = self.parse_version(self.request.get('version'))
+
+        if previous is None:
+            return dict(version=version, full=True)
+
+        key, since, reservations = previous
+
+        if key != self.presentation_key():
+            return dict(version=version, full=True)
+
+        changed = self.changed_allocations(since, reservations)
+
+        if changed is None:
+            return dict(version=version, full=True)
+
+        allocations = self.exposed_allocations()
+
+        return dict(
+            version=version,
+            full=False,
+            events=self.events([a for a in allocations if a.id in changed]),
+            ids=[a.id for a in allocations]
+        )
+
+    def changed_allocations(self, since, reservations):
+        """ Returns the ids of the allocations in the range which were added
+        or changed since the given date, or whose reservations were. Returns
+        None if reservations were removed, since that cannot be known.
+
+        """
+        start, end = self.range
+        resources = self.etag_resources()
+        session = Session()
+
+        if since is None:
+            since = datetime(1970, 1, 1, tzinfo=pytz.utc)
+
+        current = session.query(func.count(Reservation.id))
+        current = filter_reservations_in_range(current, resources, start, end)
+
+        added = current.filter(since < Reservation.created)
+
+        if current.scalar() != reservations + added.scalar():
+            return None
+
+        since -= self.overlap
+
+        groups = session.query(Reservation.target)
+        groups = filter_reservations_in_range(groups, resources, start, end)
+        groups = groups.filter(since < last_change(Reservation))
+
+        query = session.query(Allocation.id)
+        query = query.filter(Allocation.mirror_of.in_(resources))
+        query = query.filter(Allocation._start <= end)
+        query = query.filter(start <= Allocation._end)
+        query = query.filter(or_(
+            since < last_change(Allocation),
+            Allocation.group.in_(groups.subquery())
+        ))
+
+        return set(row.id for row in query)
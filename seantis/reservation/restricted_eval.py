@@ -3,6 +3,7 @@
 import functools
 import six
 import sys
+import threading
 
 from logging import getLogger
 log = getLogger('seantis.reservation')
@@ -31,6 +32,9 @@ from byteplay import (
     SETUP_EXCEPT, END_FINALLY
 )
 
+from five import grok
+from plone.registry.interfaces import IRecordModifiedEvent
+
 import seantis.reservation
 
 from seantis.reservation import utils
@@ -76,35 +80,81 @@ def validate_expression(expression, mode='eval'):
     return code
 
 
+allowed_builtins = {
+    'True': True,
+    'False': False,
+    'None': None,
+    'str': str,
+    'globals': locals,
+    'locals': locals,
+    'bool': bool,
+    'dict': dict,
+    'list': list,
+    'tuple': tuple,
+    'map': map,
+    'abs': abs,
+    'min': min,
+    'max': max,
+    'reduce': functools.reduce,
+    'filter': filter,
+    'round': round,
+    'len': len,
+    'set': set
+}
+
+# the number of compiled expressions kept before the cache is cleared
+max_compiled_expressions = 32
+
+# (mode, expression) -> validated code object
+_compiled_expressions = {}
+_compiled_lock = threading.Lock()
+
+
+def compile_expression(expression, mode='eval'):
+    """ Returns the validated code object of the given expression. Each
+    expression is only compiled and validated once, after which the code
+    object is taken from the cache.
+
+    """
+    key = (mode, expression)
+    code = _compiled_expressions.get(key)
+
+    if code is None:
+        code = validate_expression(expression, mode=mode)
+
+        with _compiled_lock:
+            if len(_compiled_expressions) >= max_compiled_expressions:
+                _compiled_expressions.clear()
+
+            _compiled_expressions[key] = code
+
+    return code
+
+
+def clear_compiled_expressions():
+    with _compiled_lock:
+        _compiled_expressions.clear()
+
+
+@grok.subscribe(IRecordModifiedEvent)
+def on_record_modified(event):
+    """ Drops the compiled pre-reservation script once it is changed. Other
+    instances only compile the new script once they see it, as the cache is
+    keyed by the script itself.
+
+    """
+    if event.record.__name__.endswith('.pre_reservation_script'):
+        clear_compiled_expressions()
+
+
 def evaluate_expression(expression, globals_=None, locals_=None, mode='eval'):
     globals_ = globals_ if globals_ is not None else {}
     locals_ = locals_ if locals_ is not None else {}
 
-    globals_.update(
-        __builtins__={
-            'True': True,
-            'False': False,
-            'None': None,
-            'str': str,
-            'globals': locals,
-            'locals': locals,
-            'bool': bool,
-            'dict': dict,
-            'list': list,
-            'tuple': tuple,
-            'map': map,
-            'abs': abs,
-            'min': min,
-            'max': max,
-            'reduce': functools.reduce,
-            'filter': filter,
-            'round': round,
-            'len': len,
-            'set': set
-        }
-    )
+    # copied, as the expression may change the builtins it is given
+    globals_.update(__builtins__=dict(allowed_builtins))
 
-    code = validate_expression(expression, mode=mode)
+    code = compile_expression(expression, mode=mode)
     return eval(code, globals_, locals_)
 
 
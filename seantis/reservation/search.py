@@ -1,19 +1,33 @@
+import isodate
+import json
+import sedate
+
 from datetime import date, datetime, time
 from five import grok
+from libres.db.models import Allocation
 from plone.autoform.form import AutoExtensibleForm
 from plone.directives import form
 from plone.supermodel import model
+from sqlalchemy import func, not_, tuple_
+from sqlalchemy.sql.expression import extract
 from z3c.form.browser.checkbox import CheckBoxFieldWidget
 from zope import schema
 from zope.security import checkPermission
 
 from seantis.reservation import _
+from seantis.reservation import utils
+from seantis.reservation.base import BaseView
 from seantis.reservation.utils import cached_property
 from seantis.reservation.form import BaseForm
 from seantis.reservation.resource import YourReservationsViewlet
 from seantis.reservation.interfaces import IResourceBase, days as weekdays
 
 
+# the number of allocations shown at once, the following results are loaded
+# through the search-results view as the user scrolls down
+page_size = 100
+
+
 class ISearchAndReserveForm(model.Schema):
     """ Search form for search & reserve view. """
 
@@ -128,40 +142,336 @@ class SearchForm(BaseForm, AutoExtensibleForm, YourReservationsViewlet):
         if not params:
             return None
 
-        options = {}
-
-        options['days'] = tuple(d.weekday for d in params['days'])
-        options['minspots'] = params['minspots'] or 0
-        options['available_only'] = params['available_only']
-        options['whole_day'] = params['whole_day'] and 'yes' or 'any'
+        options = search_options(params)
 
-        if options['whole_day'] == 'yes':
-            start = datetime.combine(params['recurrence_start'], time(0, 0))
-            end = datetime.combine(
-                params['recurrence_end'], time(23, 59, 59, 999999)
-            )
-        else:
-            self.start_time = params['start_time'] or time(0, 0)
-            self.end_time = params['end_time'] or time(23, 59, 59, 999999)
+        if options['whole_day'] != 'yes':
+            self.start_time = options['start'].time()
+            self.end_time = options['end'].time()
 
-            start = datetime.combine(
-                params['recurrence_start'], self.start_time
-            )
-            end = datetime.combine(
-                params['recurrence_end'], self.end_time
-            )
+        return options
 
-        options['start'] = start
-        options['end'] = end
+    @property
+    def loads_results(self):
+        """ True if the results are loaded by search.js, which fetches the
+        first page from the search-results view, like the following pages.
+        Without javascript the first page is rendered with the form.
 
-        return options
+        """
+        return bool(self.request.get('ajax_search'))
 
     def handle_search(self):
         self.searched = True
 
         if not self.options:
             self.results = tuple()
+            self.next_url = None
+        elif self.loads_results:
+            self.results = tuple()
+            self.next_url = results_url(self.context, self.options)
+        else:
+            search = AllocationSearch(
+                self.context.scheduler(), **self.options
+            )
+
+            self.results, cursor = search.page()
+            self.next_url = cursor and results_url(
+                self.context, self.options, cursor
+            )
+
+
+def search_options(params):
+    """ Returns the options passed to the search, given the data of the
+    search form.
+
+    """
+    options = {}
+
+    options['days'] = tuple(d.weekday for d in params['days'] or ())
+    options['minspots'] = params['minspots'] or 0
+    options['available_only'] = params['available_only'] and True or False
+    options['whole_day'] = params['whole_day'] and 'yes' or 'any'
+
+    if options['whole_day'] == 'yes':
+        start = datetime.combine(params['recurrence_start'], time(0, 0))
+        end = datetime.combine(
+            params['recurrence_end'], time(23, 59, 59, 999999)
+        )
+    else:
+        start = datetime.combine(
+            params['recurrence_start'], params['start_time'] or time(0, 0)
+        )
+        end = datetime.combine(
+            params['recurrence_end'],
+            params['end_time'] or time(23, 59, 59, 999999)
+        )
+
+    options['start'] = start
+    options['end'] = end
+
+    return options
+
+
+def results_url(context, options, cursor=None):
+    """ Returns the url of the search-results view for the given options,
+    starting after the given cursor.
+
+    """
+    params = dict(
+        start=options['start'].isoformat(),
+        end=options['end'].isoformat(),
+        days=','.join(str(d) for d in options['days']),
+        minspots=options['minspots'],
+        available_only=options['available_only'] and 1 or 0,
+        whole_day=options['whole_day']
+    )
+
+    if cursor:
+        params['after'] = format_cursor(cursor)
+
+    return utils.urlparam(context.absolute_url(), 'search-results', params)
+
+
+def format_cursor(cursor):
+    return '{}|{}'.format(cursor[0].isoformat(), cursor[1])
+
+
+def parse_cursor(text):
+    """ Returns the start and the id of the given cursor or None if it
+    is invalid.
+
+    """
+    try:
+        start, id = text.split('|')
+        return isodate.parse_datetime(start), int(id)
+    except (AttributeError, ValueError, isodate.ISO8601Error):
+        return None
+
+
+class AllocationSearch(object):
+    """ Searches the allocations of a scheduler page by page. The options
+    and the results are the same as those of
+    :meth:`libres.db.scheduler.Scheduler.search_allocations`, without
+    the strict and the groups option.
+
+    The allocations are ordered by start and id. Each page continues after
+    the last allocation looked at by the previous page, which is passed as
+    cursor (keyset pagination). That way a page is found through the index,
+    no matter how many results come before it.
+
+    The range, the days and the quota limit are matched by the database.
+    The exposure, the time of the day and the availability are checked
+    by libres, for the allocations of the current page only.
+
+    """
+
+    def __init__(
+        self, scheduler, start, end,
+        days=None, minspots=0, available_only=False, whole_day='any'
+    ):
+        assert whole_day in ('yes', 'any')
+
+        self.scheduler = scheduler
+        self.start, self.end = scheduler._prepare_range(start, end)
+        self.days = days
+        self.minspots = minspots
+        self.available_only = available_only
+        self.whole_day = whole_day
+
+    def query(self):
+        """ Returns the query of the allocations matching the search, before
+        the checks done by libres.
+
+        """
+        query = self.scheduler.allocations_in_range(self.start, self.end)
+
+        if self.days:
+            # libres compares the weekday of the start in UTC
+            query = query.filter(
+                (extract('isodow', Allocation._start) - 1).in_(
+                    self.days
+                )
+            )
+
+        if self.minspots:
+            query = query.filter(
+                (Allocation.quota_limit == 0) |
+                (Allocation.quota_limit >= self.minspots)
+            )
+
+        return query
+
+    def page(self, cursor=None, limit=page_size):
+        """ Returns at most limit allocations after the given cursor, together
+        with the cursor of the next page. The cursor of the next page is None
+        if there are no further results.
+
+        Allocations of the same group are added to the page, even though they
+        don't match the search (as groups must be reserved together). Those
+        are marked with is_extra_result and may show up again on a later page.
+
+        """
+        query = self.query().order_by(Allocation._start, Allocation.id)
+        results = []
+
+        while True:
+            batch = query
+
+            if cursor:
+                batch = batch.filter(
+                    tuple_(Allocation._start, Allocation.id) > cursor
+                )
+
+            batch = batch.limit(limit).all()
+
+            for allocation in batch:
+                cursor = (allocation._start, allocation.id)
+
+                if self.matches(allocation):
+                    results.append(allocation)
+
+                    if len(results) == limit:
+                        return self.with_groups(results), cursor
+
+            if len(batch) < limit:
+                return self.with_groups(results), None
+
+    def matches(self, allocation):
+        """ Runs the checks of libres which are not done by the database. """
+
+        scheduler = self.scheduler
+
+        if not scheduler.is_allocation_exposed(allocation):
+            return False
+
+        s = datetime.combine(allocation.start.date(), self.start.time())
+        e = datetime.combine(allocation.end.date(), self.end.time())
+
+        s = sedate.replace_timezone(s, allocation.start.tzname())
+        e = sedate.replace_timezone(e, allocation.start.tzname())
+
+        if not allocation.overlaps(s, e):
+            return False
+
+        if self.whole_day == 'yes' and not allocation.whole_day:
+            return False
+
+        if self.available_only:
+            if not allocation.find_spot(s, e):
+                return False
+
+        if self.minspots:
+            availability = scheduler.availability(
+                allocation.start, allocation.end
+            )
+
+            if (self.minspots / float(allocation.quota) * 100.0) \
+                    > availability:
+                return False
+
+        return True
+
+    def with_groups(self, allocations):
+        """ Adds the other members of the groups in the given allocations
+        to the list.
+
+        """
+        if not allocations:
+            return allocations
+
+        masters = self.scheduler.managed_allocations().filter(
+            Allocation.resource == self.scheduler.resource
+        )
+
+        groups = masters.filter(
+            Allocation.group.in_(tuple(set(a.group for a in allocations)))
+        )
+        groups = groups.with_entities(Allocation.group)
+        groups = groups.group_by(Allocation.group)
+        groups = groups.having(func.count(Allocation.id) > 1)
+        groups = set(row.group for row in groups)
+
+        if not groups:
+            return allocations
+
+        extra = masters.filter(Allocation.group.in_(tuple(groups)))
+        extra = extra.filter(not_(Allocation.id.in_(
+            tuple(a.id for a in allocations)
+        )))
+        extra = extra.all()
+
+        for allocation in extra:
+            allocation.is_extra_result = True
+
+        return sorted(allocations + extra, key=lambda a: (a._start, a.id))
+
+
+class SearchResults(BaseView):
+    """ Returns a page of search results as json, for the search view to
+    load the results as the user scrolls down. The url of the first page is
+    built by the search view.
+
+    Returns a json object with the following keys:
+
+    rows:   The allocations of the page, prepared for the allocations table.
+    next:   The url of the next page or None.
+
+    The total number of results is not known before the last page, as
+    the checks done by libres only run for the allocations of a page. A
+    count of the database query would include the allocations failing those
+    checks, so there is no separate count.
+
+    """
+
+    permission = 'zope2.View'
+
+    grok.context(IResourceBase)
+    grok.require(permission)
+    grok.name('search-results')
+
+    def render(self):
+        options = self.options()
+
+        if options is None:
+            return json.dumps(dict(rows=[], next=None))
+
+        cursor = parse_cursor(self.request.get('after'))
+        search = AllocationSearch(self.context.scheduler(), **options)
+
+        allocations, cursor = search.page(cursor)
+
+        if options['whole_day'] == 'yes':
+            start_time, end_time = None, None
         else:
-            self.results = self.context.scheduler().search_allocations(
-                **self.options
+            start_time = options['start'].time()
+            end_time = options['end'].time()
+
+        macros = self.context.unrestrictedTraverse(
+            '@@seantis-reservation-macros'
+        )
+        rows = macros.build_allocations_table(
+            allocations, start_time, end_time
+        )
+
+        return json.dumps(dict(
+            rows=rows,
+            next=cursor and results_url(self.context, options, cursor)
+        ), cls=utils.UUIDEncoder)
+
+    def options(self):
+        """ Returns the options of the search, as passed by
+        :func:`results_url`, or None if they are invalid.
+
+        """
+        get = self.request.get
+
+        try:
+            return dict(
+                start=isodate.parse_datetime(get('start')),
+                end=isodate.parse_datetime(get('end')),
+                days=tuple(int(d) for d in get('days', '').split(',') if d),
+                minspots=int(get('minspots', 0) or 0),
+                available_only=get('available_only') == '1',
+                whole_day=get('whole_day') == 'yes' and 'yes' or 'any'
             )
+        except (AttributeError, ValueError, isodate.ISO8601Error):
+            return None
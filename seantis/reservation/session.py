@@ -1,11 +1,15 @@
 import libres
 import threading
-import re
 
+from collections import namedtuple
 from five import grok
+from libres.db.models import Allocation, Reservation, ReservedSlot
 from plone import api
+from seantis.reservation import availability
+from seantis.reservation import pool
 from seantis.reservation import utils
-from sqlalchemy import create_engine
+from sqlalchemy import func
+from sqlalchemy.orm import aliased, scoped_session, sessionmaker
 from zope.component import getUtility
 from zope.event import notify
 from zope.interface import implements
@@ -25,17 +29,13 @@ def get_postgres_version(dsn):
     """ Returns the postgres version in a tuple with the first value being
     the major version, the second being the minor version.
 
-    Uses it's own connection to be independent from any session.
+    The version is only queried once per database server, through the
+    connection pool of the dsn (see :func:`pool.server_version`).
 
     """
     assert 'postgres' in dsn, "Not a postgres database"
 
-    engine = create_engine(dsn)
-    version = engine.execute('select version()').fetchone()[0]
-    engine.dispose()
-
-    version = re.findall('PostgreSQL (.*?) on', version)[0]
-    return map(int, version.split('.'))[:2]
+    return pool.server_version(dsn)
 
 
 def assert_dsn(dsn):
@@ -55,10 +55,31 @@ def assert_dsn(dsn):
     return dsn
 
 
+class PooledSessionProvider(libres.context.session.SessionProvider):
+    """ Provides the libres sessions through the engine shared by all sites
+    using the same dsn, with the connection pool configured in the zope.conf
+    (see pool.py).
+
+    """
+
+    def __init__(self, dsn, engine_config={}, session_config={}):
+        # the postgres version has been checked by assert_dsn already
+        self.dsn = dsn
+        self.engine = pool.get_engine(dsn, engine_config)
+
+        self.session = scoped_session(sessionmaker(
+            bind=self.engine, **session_config
+        ))
+
+    def stop_service(self):
+        # the engine is used by other sites, only the session is closed
+        self.session().close()
+
+
 class ILibresUtility(Interface):
     """ Global access to libres. """
 
-    def scheduler(name, timezone):
+    def scheduler(name, timezone, is_exposed=None):
         pass
 
 
@@ -80,12 +101,149 @@ def db():
 #
 
 
+AllocationStatistics = namedtuple('AllocationStatistics', [
+    'availability', 'reserved_slots', 'waitinglist_length', 'group_size'
+])
+
+
 class CustomScheduler(libres.db.scheduler.Scheduler):
     """ Builds on the Libres scheduler to include functions that don't fit
     the scope of Libres.
 
+    The exposure of the allocations may be passed as is_exposed function.
+    It is bound to the scheduler, as the libres context (and its exposure
+    service) is shared by all threads.
+
     """
 
+    def __init__(self, context, name, timezone, is_exposed=None):
+        super(CustomScheduler, self).__init__(context, name, timezone)
+
+        if is_exposed is not None:
+            self.is_allocation_exposed = is_exposed
+            self.queries.is_allocation_exposed = is_exposed
+
+    def allocation_statistics(self, allocations):
+        """ Returns a dictionary keyed by allocation id with an
+        :class:`AllocationStatistics` tuple for each of the given master
+        allocations.
+
+        The result is the same as calling :meth:`availability` with the
+        range of each allocation, but all numbers are gathered in a single
+        query instead of one query per allocation (and another one for each
+        waitinglist).
+
+        """
+
+        allocations = [a for a in allocations if a.is_master]
+
+        if not allocations:
+            return {}
+
+        # the reserved slots of the master and its mirrors
+        mirror = aliased(Allocation)
+        reserved_slots = self.session.query(func.count(ReservedSlot.start))
+        reserved_slots = reserved_slots.join(
+            mirror, ReservedSlot.allocation_id == mirror.id
+        )
+        reserved_slots = reserved_slots.filter(
+            mirror.mirror_of == Allocation.resource,
+            mirror.group == Allocation.group,
+            mirror._start == Allocation._start
+        )
+        reserved_slots = reserved_slots.correlate(Allocation).as_scalar()
+
+        # the number of pending reservations targeting the allocation's group
+        waitinglist = self.session.query(func.count(Reservation.id))
+        waitinglist = waitinglist.filter(
+            Reservation.target == Allocation.group,
+            Reservation.status == u'pending'
+        )
+        waitinglist = waitinglist.correlate(Allocation).as_scalar()
+
+        # the number of master allocations in the same group
+        sibling = aliased(Allocation)
+        group_size = self.session.query(func.count(sibling.id))
+        group_size = group_size.filter(
+            sibling.resource == Allocation.resource,
+            sibling.group == Allocation.group
+        )
+        group_size = group_size.correlate(Allocation).as_scalar()
+
+        query = self.session.query(
+            Allocation.id, reserved_slots, waitinglist, group_size
+        )
+        query = query.filter(Allocation.id.in_([a.id for a in allocations]))
+
+        counts = dict((row[0], row[1:]) for row in query)
+
+        statistics = {}
+        for allocation in allocations:
+            reserved, waiting, size = counts.get(allocation.id, (0, 0, 1))
+
+            # the availability of each allocation sinks linearly with the
+            # number of reserved slots and mirrors which do not exist yet
+            # count as completely free (see Queries.availability_by_range)
+            if allocation.partly_available:
+                total = sum(1 for s in allocation.all_slots())
+            else:
+                total = 1
+
+            availability = 100.0 - (
+                float(reserved) / float(total * allocation.quota) * 100.0
+            )
+
+            statistics[allocation.id] = AllocationStatistics(
+                availability=availability,
+                reserved_slots=reserved,
+                waitinglist_length=waiting,
+                group_size=size
+            )
+
+        return statistics
+
+    def invalidate_availability(self, dates=None):
+        """ Removes the cached availability of the given dates (or all dates
+        if None) of this scheduler's resource. See availability.py.
+
+        """
+        availability.invalidate(self.context.name, self.resource, dates)
+
+    def move_allocation(self, master_id, *args, **kwargs):
+        master = self.allocation_by_id(master_id)
+        old_start = master._start
+
+        super(CustomScheduler, self).move_allocation(
+            master_id, *args, **kwargs
+        )
+
+        self.invalidate_availability((old_start, master._start))
+
+    def change_quota(self, master, new_quota):
+        super(CustomScheduler, self).change_quota(master, new_quota)
+        self.invalidate_availability((master._start, ))
+
+    def remove_allocation(self, id=None, groups=None):
+        if id:
+            dates = (self.allocation_by_id(id)._start, )
+        else:
+            dates = None
+
+        super(CustomScheduler, self).remove_allocation(id=id, groups=groups)
+        self.invalidate_availability(dates)
+
+    def remove_unused_allocations(self, start, end):
+        removed = super(CustomScheduler, self).remove_unused_allocations(
+            start, end
+        )
+        self.invalidate_availability()
+
+        return removed
+
+    def extinguish_managed_records(self):
+        super(CustomScheduler, self).extinguish_managed_records()
+        self.invalidate_availability()
+
     def revoke_reservation(self, token, reason, id=None, send_email=True):
         """ Revoke a reservation and inform the user of that."""
 
@@ -135,6 +293,7 @@ class LibresUtility(grok.GlobalUtility):
     def __init__(self):
         self.reset()
         self.setup_event_translation()
+        availability.setup_invalidation()
 
     def setup_event_translation(self):
         """ Libres events are different from the old seantis.reservation
@@ -182,15 +341,12 @@ class LibresUtility(grok.GlobalUtility):
             raise utils.ConfigurationError('No database configuration found.')
 
     def session_provider(self, context):
-        return libres.context.session.SessionProvider(
+        return PooledSessionProvider(
             context.get_setting('dsn'),
             session_config={
                 'extension': ZopeTransactionExtension()
             },
-            engine_config={
-                'json_serializer': utils.json_dumps,
-                'json_deserializer': utils.json_loads
-            }
+            engine_config=pool.default_engine_config()
         )
 
     def uuid_generator_factory(self, context):
@@ -216,8 +372,10 @@ class LibresUtility(grok.GlobalUtility):
 
         return context
 
-    def scheduler(self, name, timezone):
-        return CustomScheduler(self.context, name, timezone)
+    def scheduler(self, name, timezone, is_exposed=None):
+        return CustomScheduler(
+            self.context, name, timezone, is_exposed=is_exposed
+        )
 
     def get_dsn(self, site):
         """ Returns the DSN for the given site. Will look for those dsns
@@ -1,7 +1,9 @@
 from zope.component import getUtility
+from seantis.reservation import outbox
 from seantis.reservation.session import ILibresUtility
 
 
 def dbsetup(context):
     scheduler = getUtility(ILibresUtility).scheduler('maintenance', 'UTC')
     scheduler.setup_database()
+    outbox.setup_database(scheduler.session.bind)
@@ -0,0 +1,31 @@
+import json
+
+from five import grok
+from zope.interface import Interface
+
+from seantis.reservation import utils
+from seantis.reservation.base import BaseView
+
+
+class MemoizeStatisticsView(BaseView):
+    """ Returns the largest caches of memoized functions and methods in this
+    process as json, with their hits and misses (see utils.memoize). Pass
+    'limit' to get more or less than 50 caches.
+
+    """
+
+    permission = 'cmf.ManagePortal'
+
+    grok.name('reservation-memoize-statistics')
+    grok.require(permission)
+    grok.context(Interface)
+
+    def render(self):
+        self.request.response.setHeader('Content-Type', 'application/json')
+        self.request.response.setHeader('Cache-Control', 'no-cache')
+
+        limit = utils.request_id_as_int(self.request.get('limit')) or 50
+
+        return json.dumps(
+            utils.memoize_statistics(limit), indent=2, sort_keys=True
+        )
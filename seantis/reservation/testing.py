@@ -1,5 +1,9 @@
 from __future__ import absolute_import
 
+import re
+import SocketServer
+import threading
+
 from App.config import getConfiguration, setConfiguration
 from plone.app.testing import PloneSandboxLayer
 from plone.app.testing import PLONE_FIXTURE
@@ -64,6 +68,136 @@ class SqlLayer(PloneSandboxLayer):
         z2.uninstallProduct(app, 'seantis.reservation')
         self.stop_postgres()
 
+
+class LocalSMTPHandler(SocketServer.StreamRequestHandler):
+    """ Speaks just enough SMTP for smtplib, see :class:`LocalSMTPServer`. """
+
+    def reply(self, line):
+        self.wfile.write(line + '\r\n')
+
+    def address(self, command):
+        match = re.search(r'<(.*)>', command)
+        return match and match.group(1) or ''
+
+    def read_data(self):
+        lines = []
+
+        while True:
+            line = self.rfile.readline()
+
+            if not line or line == '.\r\n':
+                break
+
+            # remove the dot-stuffing (RFC 5321, 4.5.2)
+            if line.startswith('..'):
+                line = line[1:]
+
+            lines.append(line)
+
+        return ''.join(lines)
+
+    def handle(self):
+        server = self.server
+
+        with server.lock:
+            server.connections += 1
+            unavailable = server.unavailable > 0
+
+            if unavailable:
+                server.unavailable -= 1
+
+        if unavailable:
+            self.reply('421 localhost Service not available')
+            return
+
+        self.reply('220 localhost ESMTP')
+        sender, recipients = None, []
+
+        while True:
+            line = self.rfile.readline()
+
+            if not line:
+                return
+
+            command = line.strip()
+            verb = command[:4].upper()
+
+            if verb in ('HELO', 'EHLO'):
+                self.reply('250 localhost')
+            elif verb == 'MAIL':
+                sender, recipients = self.address(command), []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                recipient = self.address(command)
+
+                if recipient in server.refused:
+                    self.reply('550 Mailbox unavailable')
+                else:
+                    recipients.append(recipient)
+                    self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                message = self.read_data()
+
+                with server.lock:
+                    server.messages.append((sender, recipients, message))
+
+                self.reply('250 OK')
+            elif verb == 'RSET':
+                sender, recipients = None, []
+                self.reply('250 OK')
+            elif verb == 'NOOP':
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class LocalSMTPServer(SocketServer.ThreadingTCPServer):
+    """ A stand-in for a mail server on localhost, keeping the received
+    mails in memory, to test the sending of mails.
+
+    The recipients in refused are rejected for good. The next connections
+    are rejected as well, with a temporary error, as long as unavailable is
+    greater than zero.
+
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        SocketServer.ThreadingTCPServer.__init__(
+            self, ('127.0.0.1', 0), LocalSMTPHandler
+        )
+
+        self.lock = threading.Lock()
+        self.messages = []
+        self.connections = 0
+        self.refused = set()
+        self.unavailable = 0
+
+    @property
+    def host(self):
+        return self.server_address[0]
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.thread.join()
+
+
 SQL_FIXTURE = SqlLayer()
 
 SQL_INTEGRATION_TESTING = IntegrationTesting(
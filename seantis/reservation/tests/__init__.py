@@ -1,7 +1,11 @@
 import libres
+import os
+import time
 import unittest2 as unittest
 
+from contextlib import contextmanager
 from sqlalchemy import create_engine
+from sqlalchemy import event as sqlalchemy_event
 
 from zope import event
 from zope.component import getUtility
@@ -20,7 +24,12 @@ from plone.app.testing import login, logout, setRoles
 
 from collective.betterbrowser import new_browser
 
+from seantis.reservation import availability
+from seantis.reservation import mail
+from seantis.reservation import metadata
 from seantis.reservation import setuphandlers
+from seantis.reservation import timeframe
+from seantis.reservation import utils
 from seantis.reservation.utils import getSite
 from seantis.reservation.session import ILibresUtility
 from seantis.reservation.testing import SQL_INTEGRATION_TESTING
@@ -30,6 +39,14 @@ from seantis.reservation import maintenance
 from Products.CMFCore.utils import getToolByName
 
 
+# benchmarks take a while and their timings depend on the machine, so they
+# only run if the environment variable is set
+benchmark = unittest.skipUnless(
+    os.environ.get('SEANTIS_RESERVATION_BENCHMARKS'),
+    'set SEANTIS_RESERVATION_BENCHMARKS=1 to run the benchmarks'
+)
+
+
 class TestCase(unittest.TestCase):
 
     @property
@@ -97,6 +114,11 @@ class TestCase(unittest.TestCase):
         )
 
         maintenance.clear_clockservers()
+        availability.clear_cache()
+        timeframe.clear_timeframe_indexes()
+        metadata.clear_cache()
+        mail.clear_manager_emails()
+        mail.clear_template_indexes()
 
         # since the testbrowser may create different records we need
         # to clear the database by hand each time
@@ -105,6 +127,7 @@ class TestCase(unittest.TestCase):
         outlaw.execute('DELETE FROM reservations')
         outlaw.execute('DELETE FROM reserved_slots')
         outlaw.execute('DELETE FROM allocations')
+        outlaw.execute('DELETE FROM seantis_reservation_outbox')
         outlaw.dispose()
 
         self.logout()
@@ -168,6 +191,40 @@ class TestCase(unittest.TestCase):
     def mailhost(self):
         return self.portal.MailHost
 
+    @contextmanager
+    def count_queries(self):
+        """ Collects the statements sent to the database inside the with
+        block and yields them as a list, to keep track of the number of
+        queries a function needs.
+
+        """
+        engine = self.context.get_service('session_provider').engine
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        sqlalchemy_event.listen(
+            engine, 'before_cursor_execute', before_cursor_execute
+        )
+
+        try:
+            yield statements
+        finally:
+            sqlalchemy_event.remove(
+                engine, 'before_cursor_execute', before_cursor_execute
+            )
+
+    @contextmanager
+    def timed(self, name):
+        """ Prints the time spent inside the with block, for benchmarks. """
+        before = time.time()
+
+        try:
+            yield
+        finally:
+            print('{}: {:.0f}ms'.format(name, (time.time() - before) * 1000))
+
 
 class TestEventSubscriber(object):
 
@@ -186,6 +243,46 @@ class TestEventSubscriber(object):
         self.event = None
 
 
+def allocation_menu(view, allocation, in_group=None):
+    """Returns the menu of the given allocation, as built by the given slots
+    view. If in_group is not given, the database is asked whether the
+    allocation is part of a group.
+
+    """
+
+    if in_group is None:
+        in_group = allocation.in_group
+
+    return view.menu_urls(
+        view.menu_key(allocation, in_group), view.menu_params(allocation)
+    )
+
+
+def expand_menu(template, params):
+    """Replaces the placeholders of the given menu template (see
+    Slots.menu_templates) with the given parameters, like context.js does on
+    the client. Returns the same structure as EventUrls.as_template.
+
+    """
+
+    def expand(url):
+        for key, value in params.items():
+            placeholder = utils.menu_placeholder(key)
+            url = url.replace(placeholder, utils.urlquote(value))
+
+        return url
+
+    return dict(
+        url=expand(template['url']),
+        move=expand(template['move']),
+        order=list(template['order']),
+        menu=dict(
+            (group, [dict(item, url=expand(item['url'])) for item in items])
+            for group, items in template['menu'].items()
+        )
+    )
+
+
 # to use with integration where security interactions need to be done manually
 class IntegrationTestCase(TestCase):
     layer = SQL_INTEGRATION_TESTING
@@ -1,5 +1,6 @@
 import six
 import json
+import re
 import transaction
 
 from datetime import timedelta, datetime
@@ -10,7 +11,7 @@ from Products.CMFCore.interfaces import IPropertiesTool
 
 from seantis.reservation import utils
 from seantis.reservation.session import ILibresUtility
-from seantis.reservation.tests import FunctionalTestCase
+from seantis.reservation.tests import FunctionalTestCase, expand_menu
 
 
 class FormsetField(object):
@@ -202,8 +203,20 @@ class TestBrowser(FunctionalTestCase):
         slots = self.load_slot_data(resource, start, end)
         assert len(slots) == 1
 
+        # the menu templates are sent with the calendar
+        browser = self.admin_browser
+        browser.open(self.infolder('/%s' % resource))
+        templates = json.loads(
+            re.search(r'^\s*menus:(.*)$', browser.contents, re.M).group(1)
+        )
+
+        params = dict(slots[0]['params'])
+        params.update(id=slots[0]['allocation'], group=slots[0]['group'])
+
+        expanded = expand_menu(templates[slots[0]['menukey']], params)
+
         menu = {}
-        for group, entries in slots[0]['menu'].items():
+        for group, entries in expanded['menu'].items():
             for e in entries:
                 menu[e['name'].lower()] = e['url'].replace('/plone', '')
 
@@ -1,13 +1,21 @@
 # -*- coding: utf-8 -*-
+import json
+import mock
+import resource as rusage
+
+from collections import namedtuple
 from datetime import datetime
+from uuid import uuid4
 
 from Acquisition import aq_base
 
 from pytz import timezone
-from seantis.reservation.tests import IntegrationTestCase
+from seantis.reservation.tests import IntegrationTestCase, benchmark
 from seantis.reservation import utils
 from seantis.reservation import exports
-from seantis.reservation.export import ExportView, prepare_record
+from seantis.reservation.export import (
+    ExportView, prepare_record, csv_chunks, json_chunks
+)
 
 
 class TestExports(IntegrationTestCase):
@@ -194,10 +202,13 @@ class TestExports(IntegrationTestCase):
         view = MyJsonExportView(self.portal, self.request())
 
         view.request['source'] = 'reservations'
-        self.assertEqual('[]', view.render())
+        self.assertTrue(view.is_streamed)
+        self.assertEqual('[]', ''.join(view.stream()))
+
+        view.set_headers()
 
         response = view.request.RESPONSE
-        self.assertEqual(response.headers['content-length'], '2')
+        self.assertNotIn('content-length', response.headers)
         self.assertEqual(
             response.headers['content-disposition'],
             'filename="Plone site.Reservations (Normal).json"'
@@ -205,3 +216,127 @@ class TestExports(IntegrationTestCase):
         self.assertEqual(
             response.headers['content-type'], 'application/json;charset=utf-8'
         )
+
+    def test_streaming_formats(self):
+        headers = [u'Title', u'Quota']
+        records = ([u'R\xe4um {}'.format(i), i] for i in range(5))
+
+        chunks = list(csv_chunks(headers, records, rows_per_chunk=2))
+        self.assertEqual(len(chunks), 3)
+
+        lines = ''.join(chunks).splitlines()
+        self.assertEqual(lines[0], 'Title,Quota')
+        self.assertEqual(lines[1], 'R\xc3\xa4um 0,0')
+        self.assertEqual(len(lines), 6)
+
+        records = ([u'Room {}'.format(i), None] for i in range(3))
+        chunks = list(json_chunks(headers, records, rows_per_chunk=2))
+        self.assertEqual(len(chunks), 2)
+
+        self.assertEqual(json.loads(''.join(chunks)), [
+            {u'Title': u'Room 0', u'Quota': None},
+            {u'Title': u'Room 1', u'Quota': None},
+            {u'Title': u'Room 2', u'Quota': None},
+        ])
+        self.assertEqual(''.join(json_chunks(headers, iter([]))), '[]')
+
+    def test_header_index(self):
+        field = lambda key, sortkey, value: dict(
+            key=key, sortkey=sortkey, value=value, desc=key
+        )
+        form = lambda *fields: {
+            'mock': dict(desc='Form', interface='mock', values=list(fields))
+        }
+
+        MockReservation = namedtuple('MockReservation', ['data'])
+        reservations = [
+            MockReservation(form(field('b', 2, 'b1'), field('a', 1, 'a1'))),
+            MockReservation(form(field('c', 3, 'c2'), field('a', 1, 'a2'))),
+            MockReservation(None)
+        ]
+
+        # the headers follow the sortkey, new ones are added at the end
+        headers = exports.reservations.additional_headers(reservations)
+        self.assertEqual(headers, ['Form.a', 'Form.b', 'Form.c'])
+
+        index = exports.reservations.header_index(headers)
+        self.assertEqual(index, {'Form.a': 0, 'Form.b': 1, 'Form.c': 2})
+
+        # missing fields lead to empty columns
+        columns = [
+            exports.reservations.additional_columns(r, headers, index=index)
+            for r in reservations
+        ]
+        self.assertEqual(columns, [
+            ['a1', 'b1', None],
+            ['a2', None, 'c2'],
+            [None, None, None]
+        ])
+
+        # without index the same columns are returned
+        self.assertEqual(
+            exports.reservations.additional_columns(reservations[1], headers),
+            columns[1]
+        )
+
+    @benchmark
+    def test_export_benchmark(self):
+        self.login_manager()
+
+        resource = self.create_resource()
+        resources = {resource.uuid(): resource}
+        created = datetime(2014, 1, 1, tzinfo=timezone('UTC'))
+
+        # 50k reservations with 80 fields each, spread over four variants
+        # which leave out different fields, as optional fields would
+        variants = [
+            utils.mock_data_dictionary(dict(
+                ('field{:02d}'.format(f), u'value {}'.format(f))
+                for f in range(80) if f % 4 != v
+            )) for v in range(4)
+        ]
+
+        class MockReservation(object):
+
+            def __init__(self, ix):
+                self.token = uuid4()
+                self.resource = resource.uuid()
+                self.email = u'test@example.org'
+                self.status = u'approved'
+                self.quota = 1
+                self.created = created
+                self.modified = None
+                self.data = variants[ix % 4]
+
+            def timespans(self):
+                return [(self.created, self.created)]
+
+        # the reservations are created as they are fetched, as they would
+        # be by the batched query
+        def fetch_records(resources, year, month, data_only=False):
+            return (MockReservation(ix) for ix in range(50000))
+
+        with mock.patch.object(
+            exports.reservations, 'fetch_records', side_effect=fetch_records
+        ):
+            headers, records = exports.reservations.stream(
+                resources, 'en', 'all', 'all'
+            )
+            records = (prepare_record(r, 'csv') for r in records)
+
+            # ru_maxrss is in kilobytes on linux
+            before = rusage.getrusage(rusage.RUSAGE_SELF).ru_maxrss
+
+            with self.timed('export: 50000 reservations, 80 fields'):
+                size = sum(len(c) for c in csv_chunks(headers, records))
+
+            growth = rusage.getrusage(rusage.RUSAGE_SELF).ru_maxrss - before
+
+        self.assertEqual(len(headers), 11 + 80)
+
+        # the csv alone is larger than the memory used to stream it
+        self.assertLess(growth * 1024, size)
+
+        print('export: {:.1f}mb csv, {:.1f}mb peak memory growth'.format(
+            size / 1024.0 / 1024.0, growth / 1024.0
+        ))
@@ -0,0 +1,123 @@
+import mock
+
+from zope.annotation.interfaces import IAnnotations
+from zope.component import getUtility
+
+from seantis.reservation import exposure
+from seantis.reservation.session import ILibresUtility
+from seantis.reservation.tests import IntegrationTestCase, benchmark
+
+
+class TestExposure(IntegrationTestCase):
+
+    def test_limit_resources(self):
+        self.login_manager()
+
+        resources = [self.create_resource() for i in range(3)]
+        resources[1].manage_permission('View', roles=['Manager'])
+
+        self.logout()
+
+        visible = exposure.limit_resources(resources)
+        self.assertEqual(
+            sorted(r.uuid() for r in visible),
+            sorted(r.uuid() for r in (resources[0], resources[2]))
+        )
+
+        is_exposed = exposure.for_resources(resources)
+        self.assertTrue(is_exposed(resources[0]))
+        self.assertFalse(is_exposed(resources[1]))
+        self.assertTrue(is_exposed(resources[2].uuid()))
+
+        by_uuid = dict((r.uuid(), r) for r in resources)
+        self.assertEqual(
+            sorted(exposure.limit_resources(by_uuid).keys()),
+            sorted(r.uuid() for r in (resources[0], resources[2]))
+        )
+
+        # the visibility is kept per user
+        self.login_manager()
+
+        self.assertEqual(len(exposure.limit_resources(resources)), 3)
+
+        self.logout()
+
+        self.assertEqual(len(exposure.limit_resources(resources)), 2)
+
+    def test_limit_resources_memoized(self):
+        self.login_manager()
+
+        resources = [self.create_resource() for i in range(4)]
+
+        for resource in resources[::2]:
+            resource.manage_permission('View', roles=['Manager'])
+
+        self.logout()
+
+        with mock.patch.object(
+            exposure, 'checkPermission', wraps=exposure.checkPermission
+        ) as check:
+            self.assertEqual(len(exposure.limit_resources(resources)), 2)
+            self.assertEqual(len(exposure.limit_resources(resources)), 2)
+            self.assertEqual(
+                len(exposure.limit_resources(resources[:2])), 1
+            )
+
+            # the permissions are checked once per resource and request
+            self.assertEqual(check.call_count, 4)
+
+        cache = IAnnotations(self.request())
+        cache = cache['seantis.reservation.exposure.visibility']
+
+        self.assertEqual(len(cache[None]), 4)
+
+    @benchmark
+    def test_limit_resources_benchmark(self):
+        self.login_manager()
+
+        resources = [self.create_resource() for i in range(1000)]
+
+        for resource in resources[::2]:
+            resource.manage_permission('View', roles=['Manager'])
+
+        self.logout()
+
+        with self.timed('exposure: 1000 resources, first'):
+            visible = exposure.limit_resources(resources)
+
+        self.assertEqual(len(visible), 500)
+
+        with self.timed('exposure: 1000 resources, memoized'):
+            visible = exposure.limit_resources(resources)
+
+        self.assertEqual(len(visible), 500)
+
+    def test_scheduler_exposure(self):
+        self.login_manager()
+
+        first, second = self.create_resource(), self.create_resource()
+
+        context = getUtility(ILibresUtility).context
+        service = context.get('service/exposure')
+
+        with mock.patch.object(
+            exposure, 'for_allocations', wraps=exposure.for_allocations
+        ) as for_allocations:
+            schedulers = [r.scheduler() for r in (first, second, first)]
+            self.assertEqual(for_allocations.call_count, 2)
+
+        # each scheduler keeps its own exposure, the shared context is
+        # left alone
+        self.assertIs(context.get('service/exposure'), service)
+        self.assertIs(
+            schedulers[0].is_allocation_exposed,
+            schedulers[2].is_allocation_exposed
+        )
+        self.assertIsNot(
+            schedulers[0].is_allocation_exposed,
+            schedulers[1].is_allocation_exposed
+        )
+        self.assertIs(
+            schedulers[1].queries.is_allocation_exposed,
+            schedulers[1].is_allocation_exposed
+        )
@@ -4,6 +4,7 @@ from datetime import date, datetime, timedelta
 
 from seantis.reservation import utils
 from seantis.reservation import settings
+from seantis.reservation import restricted_eval
 from seantis.reservation.error import CustomReservationError
 from seantis.reservation.tests import IntegrationTestCase
 from seantis.reservation.restricted_eval import (
@@ -114,3 +115,36 @@ class TestCustomFilterScript(IntegrationTestCase):
         }, 'personalien')
 
         run()  # ok
+
+    def test_pre_reserve_script_cache(self):
+
+        class MockContext(object):
+            def getPhysicalPath(self):
+                return ['', 'foo', 'bar']
+
+        restricted_eval.clear_compiled_expressions()
+        compiled = restricted_eval._compiled_expressions
+
+        start, end = datetime.now(), datetime.now()
+        data = utils.mock_data_dictionary({})
+
+        settings.set('pre_reservation_script', u'x = 1')
+        self.assertEqual(len(compiled), 0)
+
+        run_pre_reserve_script(MockContext(), start, end, data)
+        self.assertEqual(compiled.keys(), [('exec', u'x = 1')])
+
+        code = compiled[('exec', u'x = 1')]
+
+        run_pre_reserve_script(MockContext(), start, end, data)
+        self.assertIs(compiled[('exec', u'x = 1')], code)
+
+        # changing the script drops the compiled code
+        settings.set('pre_reservation_script', u'error("nope")')
+        self.assertEqual(len(compiled), 0)
+
+        self.assertRaises(
+            CustomReservationError,
+            run_pre_reserve_script, MockContext(), start, end, data
+        )
+        self.assertEqual(compiled.keys(), [('exec', u'error("nope")')])
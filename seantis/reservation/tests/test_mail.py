@@ -1,10 +1,26 @@
+import mock
+import time
+
+from datetime import datetime, timedelta
+from email import message_from_string
+
 from plone.app.testing import TEST_USER_ID
+from plone.app.workflow.events import LocalrolesModifiedEvent
+from plone.dexterity.utils import createContentInContainer
+from zope.event import notify
+from zope.lifecycleevent import ObjectModifiedEvent
 
+from seantis.reservation import mail
+from seantis.reservation import outbox
+from seantis.reservation import plone_session
 from seantis.reservation import settings
-from seantis.reservation.tests import IntegrationTestCase
+from seantis.reservation import Session
+from seantis.reservation import utils
+from seantis.reservation.tests import IntegrationTestCase, benchmark
 from seantis.reservation.mail import (
-    get_managers_by_context, get_manager_emails
+    get_email_content, get_managers_by_context, get_manager_emails
 )
+from seantis.reservation.mail_templates import templates
 
 
 class MailTestCase(IntegrationTestCase):
@@ -48,3 +64,314 @@ class MailTestCase(IntegrationTestCase):
             get_manager_emails(resource),
             []
         )
+
+    def test_manager_emails_cache(self):
+        self.login_manager()
+
+        resource = self.create_resource()
+        self.assign_reservation_manager('ted@example.com', resource)
+
+        settings.set('send_email_to_managers', 'by_path')
+
+        with mock.patch.object(
+            mail, 'get_manager_emails_by_context',
+            wraps=mail.get_manager_emails_by_context
+        ) as lookup:
+            self.assertEqual(
+                get_manager_emails(resource), ['ted@example.com']
+            )
+            self.assertEqual(
+                get_manager_emails(resource), ['ted@example.com']
+            )
+
+            # the managers are only looked up once for all mails
+            self.assertEqual(lookup.call_count, 1)
+
+            # a change of the local roles of a parent removes the emails of
+            # the resources below it
+            self.assign_reservation_manager('brad@example.com', resource)
+            notify(LocalrolesModifiedEvent(
+                resource.aq_inner.aq_parent, self.request()
+            ))
+
+            self.assertEqual(
+                sorted(get_manager_emails(resource)),
+                ['brad@example.com', 'ted@example.com']
+            )
+            self.assertEqual(lookup.call_count, 2)
+
+        # the emails expire after a while
+        with mock.patch.object(mail, 'manager_emails_max_age', 0):
+            with mock.patch.object(
+                mail, 'get_manager_emails_by_context', return_value=[]
+            ):
+                self.assertEqual(get_manager_emails(resource), [])
+
+    def test_email_content(self):
+        self.login_admin()
+
+        self.portal.invokeFactory('Folder', 'folder')
+        folder = self.portal.folder
+
+        inside = createContentInContainer(
+            folder, 'seantis.reservation.resource'
+        )
+        outside = self.create_resource()
+
+        default = templates['reservation_made'].get('en')
+
+        self.assertEqual(
+            get_email_content(inside, 'reservation_made', 'en'), default
+        )
+
+        template = createContentInContainer(
+            folder, 'seantis.reservation.emailtemplate',
+            language='en',
+            reservation_made_subject=u'Subject',
+            reservation_made_content=u'Body'
+        )
+
+        # the index is built anew once a template is added
+        self.assertEqual(
+            get_email_content(inside, 'reservation_made', 'en'),
+            (u'Subject', u'Body')
+        )
+        self.assertEqual(
+            get_email_content(outside, 'reservation_made', 'en'), default
+        )
+        self.assertEqual(
+            get_email_content(inside, 'reservation_made', 'de'),
+            templates['reservation_made'].get('de')
+        )
+
+        with mock.patch.object(
+            mail, 'build_template_index', wraps=mail.build_template_index
+        ) as build:
+            for i in range(10):
+                get_email_content(inside, 'reservation_made', 'en')
+
+            self.assertEqual(build.call_count, 0)
+
+        template.reservation_made_subject = u'Changed'
+        notify(ObjectModifiedEvent(template))
+
+        self.assertEqual(
+            get_email_content(inside, 'reservation_made', 'en'),
+            (u'Changed', u'Body')
+        )
+
+        folder.manage_delObjects([template.id])
+
+        self.assertEqual(
+            get_email_content(inside, 'reservation_made', 'en'), default
+        )
+
+    def test_template_placeholders(self):
+        self.assertEqual(
+            mail.template_placeholders(u'%(resource)s: %(dates)s, %%(no)s'),
+            frozenset(('resource', 'dates'))
+        )
+        self.assertEqual(mail.template_placeholders(u'none'), frozenset())
+
+        subject, body = templates['reservation_made'].get('en')
+        self.assertEqual(
+            mail.template_placeholders(subject) |
+            mail.template_placeholders(body),
+            frozenset((
+                'resource', 'dates', 'reservation_mail', 'quota', 'data',
+                'cancel_link'
+            ))
+        )
+
+    def render_queued_mails(self):
+        """ Renders the mails queued by the current transaction, like the
+        outbox worker does once they are committed.
+
+        """
+        render = mail.mail_renderer()
+        mails = []
+
+        for job in Session().query(outbox.OutboxMail).all():
+            self.assertIsNone(job.message)
+            mails.extend(render(utils.json_loads(job.payload)))
+
+        return mails
+
+    def test_shared_mail_parameters(self):
+        self.login_manager()
+
+        resource = self.create_resource()
+        scheduler = resource.scheduler()
+
+        managers = ['{}@example.com'.format(n) for n in ('ted', 'brad', 'kim')]
+        for manager in managers:
+            self.assign_reservation_manager(manager, resource)
+
+        settings.set('send_email_to_managers', 'by_path')
+        settings.set('send_email_to_reservees', True)
+
+        dates = (datetime(2014, 1, 1, 8), datetime(2014, 1, 1, 9))
+        data = utils.mock_data_dictionary({'field': u'value'})
+        session_id = plone_session.get_session_id(resource)
+
+        scheduler.allocate(dates)
+        scheduler.reserve(
+            u'test@example.com', dates, data=data, session_id=session_id
+        )
+
+        with mock.patch.object(
+            mail.MailParameters, 'parameter_data', autospec=True,
+            side_effect=mail.MailParameters.parameter_data
+        ) as parameter_data:
+            scheduler.confirm_reservations_for_session(session_id)
+
+            # the mails are rendered by the outbox worker, not the request
+            self.assertEqual(parameter_data.call_count, 0)
+
+            mails = self.render_queued_mails()
+
+        # the data is rendered once for the mails of all managers
+        self.assertEqual(parameter_data.call_count, 1)
+
+        # one mail to the reservee and one to each manager
+        self.assertEqual(
+            sorted(recipient for sender, recipient, message in mails),
+            sorted(managers + ['test@example.com'])
+        )
+
+        # the links of the mails to the managers point to the resource
+        for sender, recipient, message in mails:
+            if recipient in managers:
+                body = message_from_string(message).get_payload(decode=True)
+                self.assertIn(resource.absolute_url(), body)
+
+    def test_render_queued_mails_anonymously(self):
+        self.login_manager()
+
+        resource = self.create_resource()
+        scheduler = resource.scheduler()
+
+        settings.set('send_email_to_reservees', True)
+
+        dates = (datetime(2014, 1, 1, 8), datetime(2014, 1, 1, 9))
+        scheduler.allocate(dates, approve_manually=True)
+        scheduler.approve_reservations(
+            scheduler.reserve(u'test@example.com', dates)
+        )
+
+        # the outbox worker is called anonymously, but still finds the
+        # resources the anonymous user is not allowed to see
+        self.logout()
+
+        mails = self.render_queued_mails()
+        self.assertIn(
+            u'test@example.com',
+            [recipient for sender, recipient, message in mails]
+        )
+
+    def confirm_reservations(self, count):
+        """ Confirms count reservations of one session, with three managers
+        getting a mail about each, and renders the queued mails. Returns the
+        parameters computed for the mails, as tuples of parameter name and
+        reservation token, the duration of the confirmation and the duration
+        of the rendering.
+
+        """
+        resource = self.create_resource()
+        scheduler = resource.scheduler()
+
+        managers = ['{}@example.com'.format(n) for n in ('ted', 'brad', 'kim')]
+        for manager in managers:
+            self.assign_reservation_manager(manager, resource)
+
+        settings.set('send_email_to_managers', 'by_path')
+        settings.set('send_email_to_reservees', False)
+
+        data = utils.mock_data_dictionary(dict(
+            ('field{:02d}'.format(f), u'value {}'.format(f)) for f in range(20)
+        ))
+        session_id = plone_session.get_session_id(resource)
+
+        for day in range(count):
+            start = datetime(2014, 1, 1, 8) + timedelta(days=day)
+            dates = (start, start + timedelta(hours=1))
+
+            scheduler.allocate(dates)
+            scheduler.reserve(
+                u'test@example.com', dates, data=data, session_id=session_id
+            )
+
+        computed = []
+
+        def track(name):
+            compute = getattr(mail.MailParameters, name)
+
+            def tracked(self):
+                computed.append((name, self.reservation.token))
+                return compute(self)
+
+            return tracked
+
+        patches = [
+            mock.patch.object(mail.MailParameters, name, track(name))
+            for name in dir(mail.MailParameters)
+            if name.startswith('parameter_')
+        ]
+
+        for patch in patches:
+            patch.start()
+
+        try:
+            before = time.time()
+            scheduler.confirm_reservations_for_session(session_id)
+            duration = time.time() - before
+
+            # nothing is rendered by the request
+            self.assertEqual(computed, [])
+
+            before = time.time()
+            mails = self.render_queued_mails()
+            rendering = time.time() - before
+        finally:
+            for patch in patches:
+                patch.stop()
+
+        # one mail per reservation to each manager
+        self.assertEqual(len(mails), count * len(managers))
+        self.assertEqual(
+            sorted(set(recipient for sender, recipient, message in mails)),
+            sorted(managers)
+        )
+
+        return computed, duration, rendering
+
+    def test_shared_mail_parameters_per_reservation(self):
+        self.login_manager()
+
+        computed, duration, rendering = self.confirm_reservations(4)
+
+        # each parameter is computed once per reservation, for the mails
+        # of all managers
+        self.assertEqual(len(computed), len(set(computed)))
+        self.assertEqual(len(set(token for name, token in computed)), 4)
+        self.assertEqual(
+            len([c for c in computed if c[0] == 'parameter_data']), 4
+        )
+
+    @benchmark
+    def test_bulk_confirmation_benchmark(self):
+        self.login_manager()
+
+        computed, duration, rendering = self.confirm_reservations(200)
+
+        self.assertEqual(len(computed), len(set(computed)))
+        self.assertEqual(
+            len([c for c in computed if c[0] == 'parameter_data']), 200
+        )
+
+        print(
+            'bulk confirmation: 200 reservations, {:.0f}ms in the request, '
+            '{:.0f}ms rendering in the worker'.format(
+                duration * 1000, rendering * 1000
+            )
+        )
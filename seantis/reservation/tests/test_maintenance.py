@@ -1,7 +1,18 @@
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+import sedate
+
+from libres.db.models import Reservation
+from sqlalchemy import text
+from zope.component import getUtility
 from zope.component.hooks import getSite
 
+from seantis.reservation.session import ILibresUtility
 from seantis.reservation.tests import IntegrationTestCase
+from seantis.reservation import expiry
 from seantis.reservation import maintenance
+from seantis.reservation import pool
 
 
 class TestMaintenance(IntegrationTestCase):
@@ -14,3 +25,129 @@ class TestMaintenance(IntegrationTestCase):
         self.assertFalse(once('/test2', getSite(), 1))
 
         self.assertEqual(1, len(maintenance._clockservers))
+
+    @property
+    def engine(self):
+        dsn = getUtility(ILibresUtility).get_dsn(self.portal)
+        return pool.get_engine(dsn)
+
+    def add_session(self, reservations, age):
+        """ Adds committed reservations to a new session, as the runner
+        doesn't see the uncommitted ones of the test's transaction.
+
+        """
+        session_id = uuid4()
+        created = sedate.utcnow() - timedelta(minutes=age)
+        table = Reservation.__table__
+
+        with self.engine.begin() as connection:
+            for ix in range(reservations):
+                start = datetime(2014, 1, 1, 8) + timedelta(days=ix)
+
+                connection.execute(table.insert().values(
+                    token=uuid4(),
+                    target=uuid4(),
+                    target_type=u'allocation',
+                    resource=uuid4(),
+                    start=start,
+                    end=start + timedelta(hours=1),
+                    timezone='UTC',
+                    status=u'pending',
+                    email=u'test@example.com',
+                    session_id=session_id,
+                    quota=1,
+                    created=created
+                ))
+
+        return str(session_id)
+
+    def session_ids(self):
+        table = Reservation.__table__
+
+        with self.engine.begin() as connection:
+            return set(str(row[0]) for row in connection.execute(
+                table.select().with_only_columns([table.c.session_id])
+            ))
+
+    def test_remove_expired_sessions(self):
+        expired = [self.add_session(3, age=20) for i in range(5)]
+        active = self.add_session(2, age=5)
+
+        original = expiry.batch_size
+        expiry.batch_size = 2
+
+        try:
+            result = expiry.remove_expired_sessions(self.engine)
+        finally:
+            expiry.batch_size = original
+
+        self.assertFalse(result.skipped)
+        self.assertEqual(result.sessions, 5)
+        self.assertEqual(result.reservations, 15)
+        self.assertEqual(result.batches, 3)
+        self.assertEqual(self.session_ids(), set((active, )))
+
+        # running it again is harmless
+        result = expiry.remove_expired_sessions(self.engine)
+        self.assertEqual((result.sessions, result.batches), (0, 1))
+        self.assertNotIn(expired[0], self.session_ids())
+
+    def test_remove_expired_sessions_once(self):
+        self.add_session(1, age=20)
+
+        # another runner holds the lock
+        with self.engine.connect() as connection:
+            connection.execute(
+                text('SELECT pg_advisory_lock(:key)'), key=expiry.lock_key
+            )
+
+            try:
+                result = expiry.remove_expired_sessions(self.engine)
+            finally:
+                connection.execute(
+                    text('SELECT pg_advisory_unlock(:key)'),
+                    key=expiry.lock_key
+                )
+
+        self.assertTrue(result.skipped)
+        self.assertEqual(result.sessions, 0)
+        self.assertEqual(len(self.session_ids()), 1)
+
+        result = expiry.remove_expired_sessions(self.engine)
+        self.assertFalse(result.skipped)
+        self.assertEqual(result.sessions, 1)
+        self.assertEqual(self.session_ids(), set())
+
+    def test_remove_expired_sessions_as_a_whole(self):
+        if not expiry.supports_skip_locked(self.engine):
+            self.skipTest('SKIP LOCKED is not supported before postgres 9.5')
+
+        locked = self.add_session(3, age=20)
+        expired = self.add_session(2, age=20)
+
+        # another transaction locks one of the reservations of the session
+        with self.engine.connect() as connection:
+            with connection.begin():
+                connection.execute(text(
+                    'SELECT id FROM reservations '
+                    'WHERE session_id = :session_id LIMIT 1 FOR UPDATE'
+                ), session_id=locked)
+
+                result = expiry.remove_expired_sessions(self.engine)
+
+        # the other reservations of the session are left alone
+        self.assertEqual(result.sessions, 1)
+        self.assertEqual(result.reservations, 2)
+        self.assertEqual(self.session_ids(), set((locked, )))
+
+        with self.engine.begin() as connection:
+            self.assertEqual(connection.execute(text(
+                'SELECT count(*) FROM reservations '
+                'WHERE session_id = :session_id'
+            ), session_id=locked).scalar(), 3)
+
+        self.assertNotIn(expired, self.session_ids())
+
+        result = expiry.remove_expired_sessions(self.engine)
+        self.assertEqual(result.sessions, 1)
+        self.assertEqual(self.session_ids(), set())
@@ -0,0 +1,119 @@
+from zope.event import notify
+from zope.lifecycleevent import ObjectModifiedEvent
+
+from plone import api
+
+from seantis.reservation import metadata
+from seantis.reservation.tests import IntegrationTestCase
+
+
+class TestMetadata(IntegrationTestCase):
+
+    def test_resource_metadata(self):
+        self.login_manager()
+
+        folder = api.content.create(
+            type='Folder', container=self.portal, id='rooms', title=u'Rooms'
+        )
+        resource = api.content.create(
+            type='seantis.reservation.resource', container=folder,
+            id='hall', title=u'Hall'
+        )
+
+        self.assertEqual(metadata.resource_title(resource), u'Rooms - Hall')
+        self.assertEqual(
+            metadata.resource_title(resource, '2x '), u'Rooms - 2x Hall'
+        )
+        self.assertEqual(metadata.parent_title(resource), u'Rooms')
+        self.assertEqual(
+            metadata.resource_url(resource), resource.absolute_url()
+        )
+
+        # the cache is used until the parent is modified
+        folder.title = u'Halls'
+        self.assertEqual(metadata.resource_title(resource), u'Rooms - Hall')
+
+        notify(ObjectModifiedEvent(folder))
+        self.assertEqual(metadata.resource_title(resource), u'Halls - Hall')
+
+        resource.title = u'Main'
+        notify(ObjectModifiedEvent(resource))
+        self.assertEqual(metadata.resource_title(resource), u'Halls - Main')
+
+        # moving the folder changes the url
+        api.content.rename(obj=folder, new_id='halls')
+        resource = self.portal['halls']['hall']
+
+        self.assertEqual(
+            metadata.resource_url(resource), resource.absolute_url()
+        )
+
+    def test_resource_metadata_paths(self):
+        self.login_manager()
+
+        rooms = api.content.create(
+            type='Folder', container=self.portal, id='rooms', title=u'Rooms'
+        )
+        other = api.content.create(
+            type='Folder', container=self.portal, id='other', title=u'Other'
+        )
+        resources = [
+            api.content.create(
+                type='seantis.reservation.resource', container=rooms,
+                id='room{}'.format(ix), title=u'Room'
+            ) for ix in range(2)
+        ]
+
+        for resource in resources:
+            metadata.get_metadata(resource)
+
+        self.assertEqual(
+            metadata._paths[rooms.getPhysicalPath()],
+            set(r.uuid() for r in resources)
+        )
+
+        # other objects don't touch the cache
+        notify(ObjectModifiedEvent(other))
+        self.assertEqual(len(metadata._cache), 2)
+
+        # a resource only removes itself
+        notify(ObjectModifiedEvent(resources[0]))
+        self.assertEqual(metadata._cache.keys(), [resources[1].uuid()])
+        self.assertEqual(
+            metadata._paths[rooms.getPhysicalPath()],
+            set((resources[1].uuid(), ))
+        )
+
+        # the parent removes all resources below it, together with the
+        # paths of the index
+        notify(ObjectModifiedEvent(rooms))
+        self.assertEqual(len(metadata._cache), 0)
+        self.assertEqual(metadata._paths, {})
+
+    def test_resource_metadata_bounds(self):
+        self.login_manager()
+
+        resources = [self.create_resource() for i in range(3)]
+
+        original_size = metadata.max_size
+        metadata.max_size = 2
+
+        try:
+            for resource in resources:
+                metadata.get_metadata(resource)
+
+            self.assertEqual(len(metadata._cache), 2)
+            self.assertEqual(
+                metadata._cache.keys(), [r.uuid() for r in resources[1:]]
+            )
+
+            # the least recently used resource is dropped first
+            metadata.get_metadata(resources[1])
+            metadata.get_metadata(resources[0])
+
+            self.assertEqual(
+                metadata._cache.keys(),
+                [resources[1].uuid(), resources[0].uuid()]
+            )
+        finally:
+            metadata.max_size = original_size
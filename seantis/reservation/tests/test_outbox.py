@@ -0,0 +1,272 @@
+import mock
+
+from datetime import datetime, timedelta
+
+import sedate
+
+from zope.component import getUtility
+
+from seantis.reservation import maintenance
+from seantis.reservation import outbox
+from seantis.reservation import pool
+from seantis.reservation import Session
+from seantis.reservation import utils
+from seantis.reservation.mail import mail_renderer
+from seantis.reservation.session import ILibresUtility
+from seantis.reservation.testing import LocalSMTPServer
+from seantis.reservation.tests import IntegrationTestCase
+
+reservation_email = u'test@example.com'
+
+
+class OutboxTestCase(IntegrationTestCase):
+
+    def setUp(self):
+        super(OutboxTestCase, self).setUp()
+
+        self.server = LocalSMTPServer()
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+        super(OutboxTestCase, self).tearDown()
+
+    @property
+    def engine(self):
+        dsn = getUtility(ILibresUtility).get_dsn(self.portal)
+        return pool.get_engine(dsn)
+
+    def transport(self):
+        return outbox.SMTPTransport(self.server.host, self.server.port)
+
+    def add_mails(self, *recipients):
+        """ Adds committed mails to the outbox, as the worker doesn't see
+        the uncommitted ones of the test's transaction.
+
+        """
+        table = outbox.OutboxMail.__table__
+
+        with self.engine.begin() as connection:
+            for recipient in recipients:
+                connection.execute(table.insert().values(
+                    site=outbox.site_path(self.portal),
+                    sender='noreply@example.com',
+                    recipient=recipient,
+                    message='Subject: Test\r\n\r\nTo {}'.format(recipient),
+                    created=sedate.utcnow(),
+                    attempts=0,
+                    next_attempt=sedate.utcnow()
+                ))
+
+    def mails(self):
+        table = outbox.OutboxMail.__table__
+
+        with self.engine.begin() as connection:
+            return connection.execute(
+                table.select().order_by(table.c.id)
+            ).fetchall()
+
+    def test_queue_mails(self):
+        self.login_manager()
+
+        resource = self.create_resource()
+        scheduler = resource.scheduler()
+
+        dates = (datetime(2014, 1, 1, 8), datetime(2014, 1, 1, 9))
+        scheduler.allocate(dates, approve_manually=True)
+
+        # the reservee is informed about the approval
+        scheduler.approve_reservations(
+            scheduler.reserve(reservation_email, dates)
+        )
+
+        # the mails are part of the transaction, so they are only seen by
+        # the session of the request until it is committed
+        jobs = Session().query(outbox.OutboxMail).all()
+        self.assertTrue(jobs)
+        self.assertEqual(self.mails(), [])
+
+        # the request only queues the data of the mails
+        for job in jobs:
+            self.assertEqual(job.site, outbox.site_path(self.portal))
+            self.assertEqual(job.attempts, 0)
+            self.assertIsNone(job.message)
+
+        payloads = [utils.json_loads(job.payload) for job in jobs]
+        approved = [
+            payload for payload in payloads
+            if payload.get('email_type') == 'reservation_approved'
+        ]
+        self.assertEqual(len(approved), 1)
+        self.assertEqual(
+            approved[0]['reservation']['email'], reservation_email
+        )
+
+        # which are rendered by the worker
+        mails = mail_renderer()(approved[0])
+        self.assertEqual(len(mails), 1)
+
+        sender, recipient, message = mails[0]
+        self.assertEqual(recipient, reservation_email)
+        self.assertIn('Subject:', message)
+
+    def add_jobs(self, *payloads):
+        table = outbox.OutboxMail.__table__
+
+        with self.engine.begin() as connection:
+            for payload in payloads:
+                connection.execute(table.insert().values(
+                    site=outbox.site_path(self.portal),
+                    payload=utils.json_dumps(payload),
+                    created=sedate.utcnow(),
+                    attempts=0,
+                    next_attempt=sedate.utcnow()
+                ))
+
+    def test_process_outbox_render(self):
+        def render(payload):
+            if payload.get('broken'):
+                raise ValueError('broken')
+
+            return [
+                ('Sender <noreply@example.com>', recipient, 'Subject: Test')
+                for recipient in payload['recipients']
+            ]
+
+        self.add_jobs(
+            dict(recipients=['first@example.com', 'second@example.com']),
+            dict(recipients=[]),
+            dict(broken=True)
+        )
+
+        sent, failed = outbox.process_outbox(
+            self.portal, self.transport(), render
+        )
+
+        # each job is replaced by the mails it renders
+        self.assertEqual((sent, failed), (2, 1))
+        self.assertEqual(
+            [m[1] for m in self.server.messages],
+            [['first@example.com'], ['second@example.com']]
+        )
+
+        # the job which could not be rendered is tried again later
+        mails = self.mails()
+        self.assertEqual(len(mails), 1)
+        self.assertEqual(mails[0].attempts, 1)
+        self.assertIn('broken', mails[0].last_error)
+        self.assertIsNone(mails[0].message)
+
+    def test_process_outbox(self):
+        self.add_mails(*('{}@example.com'.format(i) for i in range(5)))
+
+        sent, failed = outbox.process_outbox(self.portal, self.transport())
+
+        self.assertEqual((sent, failed), (5, 0))
+        self.assertEqual(self.mails(), [])
+
+        # all mails are sent over one connection
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(
+            [m[1] for m in self.server.messages],
+            [['{}@example.com'.format(i)] for i in range(5)]
+        )
+
+        # without due mails the mail server isn't contacted
+        self.assertEqual(
+            outbox.process_outbox(self.portal, self.transport()), (0, 0)
+        )
+        self.assertEqual(self.server.connections, 1)
+
+    def test_process_outbox_batches(self):
+        self.add_mails(*('{}@example.com'.format(i) for i in range(5)))
+
+        original = outbox.batch_size
+        outbox.batch_size = 2
+
+        try:
+            sent, failed = outbox.process_outbox(
+                self.portal, self.transport()
+            )
+        finally:
+            outbox.batch_size = original
+
+        self.assertEqual((sent, failed), (5, 0))
+        self.assertEqual(self.server.connections, 1)
+
+    def test_process_outbox_retry(self):
+        self.add_mails('first@example.com', 'second@example.com')
+
+        # the mail server is not available at first
+        self.server.unavailable = 1
+
+        before = sedate.utcnow()
+        sent, failed = outbox.process_outbox(self.portal, self.transport())
+
+        self.assertEqual((sent, failed), (0, 2))
+
+        for mail in self.mails():
+            self.assertEqual(mail.attempts, 1)
+            self.assertIn('421', mail.last_error)
+            self.assertIs(mail.claimed_until, None)
+            self.assertTrue(
+                mail.next_attempt >= before + timedelta(
+                    seconds=outbox.backoff
+                )
+            )
+
+        # the mails are not due yet
+        self.assertEqual(
+            outbox.process_outbox(self.portal, self.transport()), (0, 0)
+        )
+
+        table = outbox.OutboxMail.__table__
+
+        with self.engine.begin() as connection:
+            connection.execute(table.update().values(
+                next_attempt=sedate.utcnow()
+            ))
+
+        self.assertEqual(
+            outbox.process_outbox(self.portal, self.transport()), (2, 0)
+        )
+        self.assertEqual(self.mails(), [])
+
+    def test_process_outbox_give_up(self):
+        self.server.refused.add('refused@example.com')
+        self.add_mails('refused@example.com', 'accepted@example.com')
+
+        sent, failed = outbox.process_outbox(self.portal, self.transport())
+        self.assertEqual((sent, failed), (1, 1))
+
+        # the rejected mail stays in the outbox, but it is not sent again
+        mails = self.mails()
+        self.assertEqual(len(mails), 1)
+        self.assertEqual(mails[0].recipient, 'refused@example.com')
+        self.assertEqual(mails[0].attempts, 1)
+        self.assertIs(mails[0].next_attempt, None)
+        self.assertIn('550', mails[0].last_error)
+
+    def test_register_worker(self):
+        path = outbox.site_path(self.portal) + '/process-mail-outbox'
+
+        # instances running the console script don't use the clockserver
+        with mock.patch.object(
+            maintenance, 'runs_externally', return_value=True
+        ):
+            outbox.register_worker(self.portal)
+
+        self.assertNotIn(path, maintenance._clockservers)
+
+        with mock.patch.object(
+            maintenance, 'runs_externally', return_value=False
+        ):
+            outbox.register_worker(self.portal)
+
+        self.assertIn(path, maintenance._clockservers)
+
+    def test_backoff_delay(self):
+        self.assertEqual(outbox.backoff_delay(1), outbox.backoff)
+        self.assertEqual(outbox.backoff_delay(2), outbox.backoff * 2)
+        self.assertEqual(outbox.backoff_delay(3), outbox.backoff * 4)
+        self.assertEqual(outbox.backoff_delay(100), outbox.max_backoff)
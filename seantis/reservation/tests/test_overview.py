@@ -1,5 +1,6 @@
-from datetime import datetime
+from datetime import date, datetime
 from pytz import timezone
+from seantis.reservation import availability
 from seantis.reservation.tests import IntegrationTestCase
 from seantis.reservation.overview import Overview
 
@@ -50,3 +51,96 @@ class TestOverview(IntegrationTestCase):
 
         self.assertEqual(len(events), 1)
         self.assertEqual(events[0]['className'], 'event-partly-available')
+
+    def test_overview_cache(self):
+        self.login_manager()
+
+        resource = self.create_resource()
+        scheduler = resource.scheduler()
+
+        scheduler.allocate(
+            (datetime(2015, 1, 23, 12, 0), datetime(2015, 1, 23, 15, 0)),
+            approve_manually=False
+        )
+
+        overview = Overview(resource, self.request())
+        daterange = (
+            datetime(2015, 1, 1, tzinfo=timezone('UTC')),
+            datetime(2015, 1, 31, tzinfo=timezone('UTC'))
+        )
+
+        events = overview.events(daterange=daterange, uuids=[resource.uuid()])
+        self.assertEqual(len(events), 1)
+
+        # the second call is served from the cache
+        with self.count_queries() as queries:
+            cached = overview.events(
+                daterange=daterange, uuids=[resource.uuid()]
+            )
+
+        self.assertEqual(events, cached)
+        self.assertEqual(len(queries), 0)
+
+        # new allocations invalidate the affected day
+        dates = (datetime(2015, 1, 24, 12, 0), datetime(2015, 1, 24, 15, 0))
+        scheduler.allocate(dates, approve_manually=False)
+
+        events = overview.events(daterange=daterange, uuids=[resource.uuid()])
+        self.assertEqual(len(events), 2)
+        self.assertEqual(
+            [e['className'] for e in events], ['event-available'] * 2
+        )
+
+        # as do reservations
+        scheduler.approve_reservations(
+            scheduler.reserve(u'test@example.org', dates)
+        )
+
+        events = overview.events(daterange=daterange, uuids=[resource.uuid()])
+        self.assertEqual(len(events), 2)
+        self.assertEqual(
+            sorted(e['className'] for e in events),
+            ['event-available', 'event-unavailable']
+        )
+
+    def test_overview_cache_exposure(self):
+        self.login_manager()
+
+        resource = self.create_resource()
+        scheduler = resource.scheduler()
+
+        for day in (23, 24):
+            scheduler.allocate(
+                (datetime(2015, 1, day, 12, 0), datetime(2015, 1, day, 15, 0)),
+                approve_manually=False
+            )
+
+        daterange = (
+            datetime(2015, 1, 1, tzinfo=timezone('UTC')),
+            datetime(2015, 1, 31, tzinfo=timezone('UTC'))
+        )
+
+        hidden = set()
+        seen = []
+
+        def is_exposed(allocation):
+            seen.append(allocation.start.date())
+            return allocation.start.date() not in hidden
+
+        days = availability.availability_by_day(
+            self.context, daterange[0], daterange[1], [resource.uuid()],
+            is_exposed
+        )
+        self.assertEqual(sorted(days), [date(2015, 1, 23), date(2015, 1, 24)])
+
+        # the exposure is checked with the start date of the allocations,
+        # also when the days come from the cache
+        self.assertEqual(sorted(seen), [date(2015, 1, 23), date(2015, 1, 24)])
+
+        hidden.add(date(2015, 1, 24))
+
+        days = availability.availability_by_day(
+            self.context, daterange[0], daterange[1], [resource.uuid()],
+            is_exposed
+        )
+        self.assertEqual(sorted(days), [date(2015, 1, 23)])
@@ -5,9 +5,13 @@ from datetime import datetime, timedelta
 
 from zope import i18n
 
-from seantis.reservation.tests import IntegrationTestCase
+from seantis.reservation import utils
+from seantis.reservation.tests import IntegrationTestCase, benchmark
 from seantis.reservation.reports import GeneralReportParametersMixin
-from seantis.reservation.reports.monthly_report import monthly_report
+from seantis.reservation.reports.monthly_report import (
+    monthly_report,
+    report_rows
+)
 from seantis.reservation.reports.latest_reservations import (
     human_date,
     latest_reservations
@@ -95,6 +99,113 @@ class TestReports(IntegrationTestCase):
         # on reservation on the second day
         self.assertEqual(len(report[30][resource.uuid()]['approved']), 1)
 
+    def test_monthly_report_group_reservations(self):
+        self.login_admin()
+
+        resource = self.create_resource()
+        sc = resource.scheduler()
+
+        dates = [
+            (datetime(2013, 9, 29, 8), datetime(2013, 9, 29, 10)),
+            (datetime(2013, 9, 30, 8), datetime(2013, 9, 30, 10)),
+            (datetime(2013, 10, 1, 8), datetime(2013, 10, 1, 10)),
+        ]
+
+        group = sc.allocate(dates, grouped=True)[0].group
+        sc.reserve(reservation_email, group=group)
+
+        report = monthly_report(2013, 9, {resource.uuid(): resource})
+
+        # the allocations of the group outside the month are not shown
+        self.assertEqual(report.keys(), [29, 30])
+
+        start = utils.localize_date(datetime(2013, 9, 29, 8), time_only=True)
+        end = utils.localize_date(datetime(2013, 9, 29, 10), time_only=True)
+
+        for day in (29, 30):
+            entries = report[day][resource.uuid()]['pending']
+            self.assertEqual(len(entries), 1)
+            self.assertEqual(entries[0]['start'], start)
+            self.assertEqual(entries[0]['end'], end)
+
+    def test_report_rows(self):
+        self.login_admin()
+
+        resource = self.create_resource()
+        sc = resource.scheduler()
+
+        outside_dates = (datetime(2013, 8, 31, 8), datetime(2013, 8, 31, 10))
+        single_dates = (datetime(2013, 9, 5, 8), datetime(2013, 9, 5, 10))
+
+        sc.allocate(outside_dates)
+        single = sc.allocate(single_dates)[0]
+        group = sc.allocate([
+            (datetime(2013, 9, 29, 8), datetime(2013, 9, 29, 10)),
+            (datetime(2013, 9, 30, 8), datetime(2013, 9, 30, 10)),
+            (datetime(2013, 10, 1, 8), datetime(2013, 10, 1, 10)),
+        ], grouped=True)
+
+        sc.approve_reservations(sc.reserve(reservation_email, outside_dates))
+        single_token = sc.reserve(reservation_email, single_dates)
+        sc.approve_reservations(single_token)
+        group_token = sc.reserve(reservation_email, group=group[0].group)
+
+        # the boundaries of the period are part of it
+        rows = report_rows(
+            single.start, group[1].start, {resource.uuid(): resource}
+        )
+
+        self.assertEqual(
+            [(r.token, r.status, r.start) for r in rows], [
+                (single_token, u'approved', single.start),
+                (group_token, u'pending', group[0].start),
+                (group_token, u'pending', group[1].start),
+            ]
+        )
+
+        # the rows of the group reservation use the times of its allocations
+        self.assertEqual(
+            [(r.start, r.end) for r in rows[1:]],
+            [(a.start, a.end) for a in group[:2]]
+        )
+
+        # only the given reservations are included
+        rows = report_rows(
+            single.start, group[1].start, {resource.uuid(): resource},
+            reservations=[group_token]
+        )
+        self.assertEqual([r.token for r in rows], [group_token] * 2)
+
+        self.assertEqual(report_rows(single.start, group[1].start, {}), [])
+
+    @benchmark
+    def test_monthly_report_benchmark(self):
+        self.login_admin()
+
+        resources = dict()
+
+        for ix in range(100):
+            resource = self.create_resource()
+            resource.title = u'Resource {:03d}'.format(ix)
+            sc = resource.scheduler()
+
+            for day in range(1, 31, 3):
+                dates = (
+                    datetime(2013, 9, day, 8), datetime(2013, 9, day, 10)
+                )
+                sc.allocate(dates, quota=2)
+                sc.approve_reservations(sc.reserve(reservation_email, dates))
+
+            resources[resource.uuid()] = resource
+
+        with self.count_queries() as queries:
+            with self.timed('monthly report: 100 resources'):
+                report = monthly_report(2013, 9, resources)
+
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(len(report), 10)
+        self.assertEqual(len(report[1]), 100)
+
     @mock.patch('seantis.reservation.utils.utcnow')
     def test_latest_reservations_human_date(self, utcnow):
         translate = lambda text: i18n.translate(
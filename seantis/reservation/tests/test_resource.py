@@ -0,0 +1,357 @@
+import mock
+
+from datetime import datetime, timedelta
+
+from seantis.reservation import exposure
+from seantis.reservation import utils
+from seantis.reservation.resource import Slots, SlotsDelta
+from seantis.reservation.resource import scheduler_constructions
+from seantis.reservation.tests import IntegrationTestCase, benchmark
+from seantis.reservation.tests import allocation_menu, expand_menu
+
+reservation_email = u'test@example.com'
+
+
+class TestSlots(IntegrationTestCase):
+
+    def slots_view(self, resource, start, end):
+        view = Slots(resource, self.request())
+        view.request['start'] = str(utils.utctimestamp(start))
+        view.request['end'] = str(utils.utctimestamp(end))
+
+        return view
+
+    def allocate_month(self, resource, count):
+        """ Allocates count separate allocations in january 2014. """
+        scheduler = resource.scheduler()
+
+        start = datetime(2014, 1, 1, 6, 0)
+        step = timedelta(days=31) / count
+
+        for ix in range(count):
+            scheduler.allocate(
+                (start + step * ix, start + step * ix + timedelta(minutes=30)),
+                quota=2, approve_manually=(ix % 2 == 0)
+            )
+
+        return scheduler
+
+    def test_scheduler_reuse(self):
+        self.login_manager()
+
+        first, second = self.create_resource(), self.create_resource()
+        request = self.request()
+
+        constructions = scheduler_constructions(request)
+
+        scheduler = first.scheduler()
+        self.assertIs(first.scheduler(), scheduler)
+        self.assertIsNot(second.scheduler(), scheduler)
+        self.assertEqual(scheduler_constructions(request), constructions + 2)
+
+        # the exposure differs between users
+        self.logout()
+        self.assertIsNot(first.scheduler(), scheduler)
+        self.assertEqual(scheduler_constructions(request), constructions + 3)
+
+        self.login_manager()
+        self.assertIs(first.scheduler(), scheduler)
+
+    def test_allocation_statistics(self):
+        self.login_manager()
+
+        resource = self.create_resource()
+        scheduler = resource.scheduler()
+
+        dates = (datetime(2014, 1, 1, 8), datetime(2014, 1, 1, 10))
+        scheduler.allocate(dates, quota=4, approve_manually=True)
+
+        scheduler.approve_reservations(
+            scheduler.reserve(reservation_email, dates)
+        )
+        scheduler.reserve(reservation_email, dates)
+
+        partly = (datetime(2014, 1, 2, 8), datetime(2014, 1, 2, 10))
+        scheduler.allocate(partly, partly_available=True, raster=15)
+
+        scheduler.approve_reservations(scheduler.reserve(
+            reservation_email,
+            (datetime(2014, 1, 2, 8), datetime(2014, 1, 2, 9))
+        ))
+
+        allocations = scheduler.allocations_in_range(
+            datetime(2014, 1, 1), datetime(2014, 1, 3)
+        ).all()
+
+        statistics = scheduler.allocation_statistics(allocations)
+        self.assertEqual(len(statistics), 2)
+
+        for allocation in allocations:
+            stats = statistics[allocation.id]
+
+            self.assertEqual(
+                stats.availability,
+                scheduler.availability(allocation.start, allocation.end)
+            )
+            self.assertEqual(
+                stats.waitinglist_length, allocation.waitinglist_length
+            )
+            self.assertEqual(stats.group_size, 1)
+
+            if allocation.partly_available:
+                self.assertEqual(stats.reserved_slots, 4)
+                self.assertEqual(stats.waitinglist_length, 0)
+            else:
+                self.assertEqual(stats.reserved_slots, 1)
+                self.assertEqual(stats.waitinglist_length, 1)
+
+    def test_slots_url_cache(self):
+        self.login_manager()
+
+        start, end = datetime(2014, 1, 1), datetime(2014, 2, 1)
+
+        resource = self.create_resource()
+        self.allocate_month(resource, 10)
+
+        view = self.slots_view(resource, start, end)
+
+        with mock.patch.object(
+            exposure, 'for_views', wraps=exposure.for_views
+        ) as for_views:
+            events = view.events()
+            templates = view.menu_templates()
+
+        # the permissions are checked once for all menus, not per event
+        self.assertEqual(len(events), 10)
+        self.assertEqual(len(templates), 3)
+        self.assertEqual(for_views.call_count, 1)
+
+        # the urls are the same as those built by urlparam
+        allocation = resource.scheduler().allocations_in_range(
+            start, end
+        ).first()
+
+        urls = allocation_menu(view, allocation, in_group=False)
+        base = resource.absolute_url_path()
+
+        self.assertEqual(
+            urls.move,
+            utils.urlparam(base, 'edit-allocation', dict(id=allocation.id))
+        )
+
+        reserve = urls.menu[urls.order[0]][0]
+        self.assertEqual(reserve['url'], urls.default)
+        self.assertTrue(reserve['url'].startswith(base + '/reserve?'))
+
+    def test_slots_menu_templates(self):
+        self.login_manager()
+
+        start, end = datetime(2014, 1, 1), datetime(2014, 2, 1)
+
+        resource = self.create_resource()
+        scheduler = resource.scheduler()
+
+        scheduler.allocate((datetime(2014, 1, 1, 8), datetime(2014, 1, 1, 9)))
+        scheduler.allocate([
+            (datetime(2014, 1, 2, 8), datetime(2014, 1, 2, 9)),
+            (datetime(2014, 1, 3, 8), datetime(2014, 1, 3, 9))
+        ], grouped=True)
+        scheduler.allocate([
+            (datetime(2014, 1, 4, 8), datetime(2014, 1, 4, 9)),
+            (datetime(2014, 1, 5, 8), datetime(2014, 1, 5, 9))
+        ], grouped=True, partly_available=True)
+
+        view = self.slots_view(resource, start, end)
+        templates = view.menu_templates()
+        events = dict((e['allocation'], e) for e in view.events())
+
+        self.assertEqual(len(events), 5)
+        self.assertEqual(
+            set(e['menukey'] for e in events.values()),
+            set(('allocation', 'allocation-in-group', 'group'))
+        )
+
+        # the events no longer carry the menus themselves
+        for event in events.values():
+            self.assertNotIn('menu', event)
+            self.assertNotIn('url', event)
+
+        # the expanded templates are the same as the menus of the allocations
+        for allocation in scheduler.allocations_in_range(start, end):
+            event = events[allocation.id]
+
+            params = dict(event['params'])
+            params.update(id=event['allocation'], group=event['group'])
+
+            expanded = expand_menu(templates[event['menukey']], params)
+            self.assertEqual(
+                expanded, allocation_menu(view, allocation).as_template()
+            )
+
+    def test_slots_query_count(self):
+        self.login_manager()
+
+        start, end = datetime(2014, 1, 1), datetime(2014, 2, 1)
+
+        small = self.create_resource()
+        self.allocate_month(small, 2)
+
+        large = self.create_resource()
+        self.allocate_month(large, 20)
+
+        with self.count_queries() as small_queries:
+            small_events = self.slots_view(small, start, end).events()
+
+        with self.count_queries() as large_queries:
+            large_events = self.slots_view(large, start, end).events()
+
+        self.assertEqual(len(small_events), 2)
+        self.assertEqual(len(large_events), 20)
+
+        # the number of queries does not depend on the number of allocations
+        self.assertEqual(len(small_queries), len(large_queries))
+
+    @benchmark
+    def test_slots_benchmark(self):
+        self.login_manager()
+
+        start, end = datetime(2014, 1, 1), datetime(2014, 2, 1)
+
+        resource = self.create_resource()
+        self.allocate_month(resource, 500)
+
+        with self.count_queries() as queries:
+            with self.timed('slots: 500 allocations'):
+                events = self.slots_view(resource, start, end).events()
+
+        self.assertEqual(len(events), 500)
+        print('slots: 500 allocations, {} queries'.format(len(queries)))
+
+    def test_slots_etag(self):
+        self.login_manager()
+
+        start, end = datetime(2014, 1, 1), datetime(2014, 2, 1)
+
+        resource = self.create_resource()
+        scheduler = self.allocate_month(resource, 10)
+
+        view = self.slots_view(resource, start, end)
+        self.assertNotEqual(view.render(), '')
+
+        response = view.request.response
+        etag = response.getHeader('ETag')
+        self.assertTrue(etag)
+
+        # an up to date client gets a 304 after a single query
+        view.request.environ['HTTP_IF_NONE_MATCH'] = etag
+
+        with self.count_queries() as queries:
+            self.assertEqual(view.render(), '')
+
+        self.assertEqual(response.getStatus(), 304)
+        self.assertEqual(len(queries), 1)
+
+        # allocations outside the range do not change the etag
+        scheduler.allocate((datetime(2014, 3, 1, 8), datetime(2014, 3, 1, 9)))
+        self.assertEqual(view.etag(), etag)
+
+        # reservations inside the range do
+        scheduler.reserve(
+            reservation_email,
+            (start + timedelta(hours=6), start + timedelta(hours=6, minutes=30))
+        )
+
+        self.assertNotEqual(view.etag(), etag)
+
+    def test_slots_version(self):
+        self.login_manager()
+
+        start, end = datetime(2014, 1, 1), datetime(2014, 2, 1)
+        resource = self.create_resource()
+
+        # an empty range has no last change
+        view = self.slots_view(resource, start, end)
+        view.render()
+
+        version = view.request.response.getHeader('X-Seantis-Version')
+        self.assertEqual(version.split('|')[-2:], ['', '0'])
+
+        # a range with allocations only has the change of the allocations
+        self.allocate_month(resource, 2)
+
+        view = self.slots_view(resource, start, end)
+        view.render()
+
+        version = view.request.response.getHeader('X-Seantis-Version')
+        self.assertNotEqual(version.split('|')[-2], '')
+        self.assertEqual(version.split('|')[-1], '0')
+
+    def test_slots_delta(self):
+        self.login_manager()
+
+        start, end = datetime(2014, 1, 1), datetime(2014, 2, 1)
+
+        resource = self.create_resource()
+        scheduler = self.allocate_month(resource, 10)
+
+        view = self.slots_view(resource, start, end)
+        view.render()
+
+        version = view.request.response.getHeader('X-Seantis-Version')
+        self.assertTrue(version)
+
+        def delta(version):
+            delta = SlotsDelta(resource, self.request())
+            delta.request['start'] = view.request['start']
+            delta.request['end'] = view.request['end']
+            delta.request['version'] = version
+
+            # the changes of the whole test happen within the overlap
+            delta.overlap = timedelta(0)
+
+            return delta.delta()
+
+        self.assertTrue(delta(None)['full'])
+        self.assertTrue(delta('invalid')['full'])
+
+        # nothing changed
+        result = delta(version)
+        self.assertFalse(result['full'])
+        self.assertEqual(len(result['ids']), 10)
+
+        # an added allocation
+        added = scheduler.allocate(
+            (datetime(2014, 1, 20, 20), datetime(2014, 1, 20, 21))
+        )[0]
+
+        result = delta(result['version'])
+        self.assertFalse(result['full'])
+        self.assertEqual(len(result['ids']), 11)
+        self.assertEqual(
+            [e['allocation'] for e in result['events']], [added.id]
+        )
+
+        # a reservation changes its allocation
+        token = scheduler.reserve(
+            reservation_email,
+            (datetime(2014, 1, 20, 20), datetime(2014, 1, 20, 21))
+        )
+
+        result = delta(result['version'])
+        self.assertFalse(result['full'])
+        self.assertEqual(
+            [e['allocation'] for e in result['events']], [added.id]
+        )
+
+        # a removed reservation can only be detected by a full fetch
+        scheduler.remove_reservation(token)
+        self.assertTrue(delta(result['version'])['full'])
+
+        # a removed allocation is missing from the ids
+        version = SlotsDelta(resource, view.request).version()
+        scheduler.remove_allocation(added.id)
+
+        result = delta(version)
+        self.assertFalse(result['full'])
+        self.assertEqual(len(result['ids']), 10)
+        self.assertNotIn(added.id, result['ids'])
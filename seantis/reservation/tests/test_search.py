@@ -0,0 +1,161 @@
+import json
+
+from datetime import datetime, timedelta
+from urlparse import parse_qsl
+
+from seantis.reservation.search import AllocationSearch, SearchResults
+from seantis.reservation.search import SearchForm
+from seantis.reservation.search import results_url
+from seantis.reservation.tests import IntegrationTestCase
+
+reservation_email = u'test@example.com'
+
+
+class TestSearch(IntegrationTestCase):
+
+    def allocate(self, resource):
+        scheduler = resource.scheduler()
+
+        # an allocation on each day of january 2014
+        for day in range(31):
+            start = datetime(2014, 1, 1, 8) + timedelta(days=day)
+            scheduler.allocate((start, start + timedelta(hours=1)))
+
+        # a group reaching into february
+        scheduler.allocate([
+            (datetime(2014, 1, 31, 12), datetime(2014, 1, 31, 13)),
+            (datetime(2014, 2, 1, 12), datetime(2014, 2, 1, 13))
+        ], grouped=True)
+
+        # some of the allocations are not available anymore
+        for day in (2, 3, 10):
+            start = datetime(2014, 1, day, 8)
+            token = scheduler.reserve(
+                reservation_email, (start, start + timedelta(hours=1))
+            )
+            scheduler.approve_reservations(token)
+
+        return scheduler
+
+    def test_allocation_search_pages(self):
+        self.login_manager()
+
+        resource = self.create_resource()
+        scheduler = self.allocate(resource)
+
+        options = dict(
+            start=datetime(2014, 1, 1, 6, 0),
+            end=datetime(2014, 1, 31, 20, 0),
+            days=(0, 1, 2, 3, 4, 5),
+            available_only=True
+        )
+
+        expected = scheduler.search_allocations(**options)
+        search = AllocationSearch(scheduler, **options)
+
+        is_extra = lambda a: getattr(a, 'is_extra_result', False)
+        results, cursor, pages = [], None, 0
+
+        while True:
+            page, cursor = search.page(cursor, limit=4)
+            results.extend(page)
+            pages += 1
+
+            self.assertTrue(len([a for a in page if not is_extra(a)]) <= 4)
+
+            if cursor is None:
+                break
+
+        # 24 allocations in the morning and one of the group
+        self.assertEqual(pages, 7)
+
+        found = [a.id for a in results if not is_extra(a)]
+        self.assertEqual(len(found), 25)
+        self.assertEqual(found, [a.id for a in expected if not is_extra(a)])
+
+        extra = [a for a in results if is_extra(a)]
+        self.assertEqual(len(extra), 1)
+        self.assertEqual(extra[0].start.date(), datetime(2014, 2, 1).date())
+
+    def test_search_results_view(self):
+        self.login_manager()
+
+        resource = self.create_resource()
+        self.allocate(resource)
+
+        options = dict(
+            start=datetime(2014, 1, 1, 8, 0),
+            end=datetime(2014, 1, 31, 9, 0),
+            days=(),
+            minspots=0,
+            available_only=False,
+            whole_day='any'
+        )
+
+        def page(url):
+            request = self.request()
+
+            for key, value in parse_qsl(url.split('?', 1)[1]):
+                request[key] = value
+
+            return json.loads(SearchResults(resource, request).render())
+
+        data = page(results_url(resource, options))
+
+        # the group starting at noon is not within the searched range
+        self.assertEqual(len(data['rows']), 31)
+        self.assertEqual(data['next'], None)
+
+        self.assertEqual(data['rows'][0]['class'], 'event-available')
+        self.assertEqual(data['rows'][1]['class'], 'event-unavailable')
+
+        # the next page continues after the last allocation of the first one
+        search = AllocationSearch(resource.scheduler(), **options)
+        allocations, cursor = search.page(limit=10)
+
+        data = page(results_url(resource, options, cursor))
+
+        self.assertEqual(len(data['rows']), 21)
+        self.assertEqual(data['rows'][0]['id'], allocations[-1].id + 1)
+
+        # invalid options lead to an empty result
+        request = self.request()
+        request['start'] = 'yesterday'
+
+        data = json.loads(SearchResults(resource, request).render())
+        self.assertEqual(data, dict(rows=[], next=None))
+
+    def test_search_form_first_page(self):
+        self.login_manager()
+
+        resource = self.create_resource()
+        self.allocate(resource)
+
+        options = dict(
+            start=datetime(2014, 1, 1, 8, 0),
+            end=datetime(2014, 1, 31, 9, 0),
+            days=(),
+            minspots=0,
+            available_only=False,
+            whole_day='any'
+        )
+
+        def search(request):
+            form = SearchForm(resource, request)
+            form.options = options
+            form.handle_search()
+
+            return form
+
+        # without javascript the first page is rendered with the form
+        form = search(self.request())
+        self.assertEqual(len(form.results), 31)
+        self.assertEqual(form.next_url, None)
+
+        # search.js loads it from the search-results view instead
+        request = self.request()
+        request['ajax_search'] = '1'
+
+        form = search(request)
+        self.assertEqual(form.results, ())
+        self.assertEqual(form.next_url, results_url(resource, options))
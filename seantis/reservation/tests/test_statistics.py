@@ -0,0 +1,29 @@
+import json
+
+from zope.component.hooks import getSite
+
+from seantis.reservation import statistics
+from seantis.reservation import utils
+from seantis.reservation.tests import IntegrationTestCase
+
+
+class TestStatistics(IntegrationTestCase):
+
+    def test_memoize_statistics_view(self):
+
+        @utils.memoize(maxsize=10)
+        def large(value):
+            return value
+
+        for value in range(10):
+            large(value)
+
+        request = self.request()
+        request['limit'] = '1'
+
+        view = statistics.MemoizeStatisticsView(getSite(), request)
+        caches = json.loads(view.render())
+
+        self.assertEqual(len(caches), 1)
+        self.assertEqual(caches[0]['size'], 10)
+        self.assertEqual(caches[0]['misses'], 10)
@@ -0,0 +1,108 @@
+from datetime import date, datetime
+
+from plone import api
+from plone.dexterity.utils import createContentInContainer
+
+from seantis.reservation import exposure
+from seantis.reservation.tests import IntegrationTestCase
+from seantis.reservation.timeframe import (
+    TimeframeIndex, timeframe_index
+)
+
+
+class MockAllocation(object):
+
+    def __init__(self, resource, start):
+        self.mirror_of = resource
+        self.start = start
+
+
+class TestTimeframe(IntegrationTestCase):
+
+    def test_timeframe_index(self):
+        index = TimeframeIndex(('', 'site'), [
+            ('/site/folder', date(2014, 1, 1), date(2014, 1, 31), True),
+            ('/site/folder', date(2014, 3, 1), date(2014, 3, 31), False),
+            ('/site/folder', date(2014, 2, 1), date(2014, 2, 28), True),
+            ('/site', date(2013, 1, 1), date(2013, 12, 31), True),
+        ])
+
+        frames = index.for_context(('', 'site', 'folder', 'resource'))
+        self.assertIs(frames, index.for_context(('', 'site', 'folder')))
+
+        self.assertFalse(frames.is_visible(date(2013, 12, 31)))
+        self.assertTrue(frames.is_visible(date(2014, 1, 1)))
+        self.assertTrue(frames.is_visible(date(2014, 1, 31)))
+        self.assertTrue(frames.is_visible(date(2014, 2, 15)))
+        self.assertFalse(frames.is_visible(date(2014, 3, 1)))
+        self.assertFalse(frames.is_visible(date(2014, 4, 1)))
+
+        frames = index.for_context(('', 'site', 'other', 'resource'))
+        self.assertTrue(frames.is_visible(date(2013, 6, 1)))
+        self.assertFalse(frames.is_visible(date(2014, 1, 1)))
+
+        index = TimeframeIndex(('', 'site'), [])
+        self.assertIs(index.for_context(('', 'site', 'resource')), None)
+
+    def test_timeframe_index_version(self):
+        frames = [
+            ('/site/folder', date(2014, 1, 1), date(2014, 1, 31), True),
+            ('/site', date(2013, 1, 1), date(2013, 12, 31), True),
+        ]
+
+        version = TimeframeIndex(('', 'site'), frames).version
+
+        # the version depends on the timeframes only, not on the instance
+        # or the time the index was built
+        self.assertEqual(
+            TimeframeIndex(('', 'site'), reversed(frames)).version, version
+        )
+
+        frames[0] = frames[0][:3] + (False, )
+        self.assertNotEqual(
+            TimeframeIndex(('', 'site'), frames).version, version
+        )
+
+    def test_timeframe_exposure(self):
+        self.login_manager()
+
+        resource = self.create_resource()
+        uuid = resource.uuid()
+
+        # the timeframes are always exposed to managers and owners
+        self.logout()
+
+        allocation = MockAllocation(uuid, datetime(2014, 1, 15, 10))
+        self.assertTrue(exposure.for_allocations([uuid])(allocation))
+
+        self.login_manager()
+        frame = createContentInContainer(
+            self.portal, 'seantis.reservation.timeframe',
+            title=u'January', start=date(2014, 1, 1), end=date(2014, 1, 31)
+        )
+        self.logout()
+
+        # a new timeframe is picked up at once
+        self.assertTrue(exposure.for_allocations([uuid])(allocation))
+
+        allocation = MockAllocation(uuid, datetime(2014, 2, 1, 10))
+        self.assertFalse(exposure.for_allocations([uuid])(allocation))
+
+        # as is a hidden one
+        index = timeframe_index()
+
+        self.login_manager()
+        api.content.transition(obj=frame, transition='hide')
+        self.logout()
+
+        self.assertIsNot(index, timeframe_index())
+
+        allocation = MockAllocation(uuid, datetime(2014, 1, 15, 10))
+        self.assertFalse(exposure.for_allocations([uuid])(allocation))
+
+        # and a removed one
+        self.login_manager()
+        api.content.delete(obj=frame)
+        self.logout()
+
+        self.assertTrue(exposure.for_allocations([uuid])(allocation))
@@ -1,3 +1,6 @@
+import gc
+import mock
+
 from datetime import datetime, timedelta, date
 
 from seantis.reservation import utils
@@ -322,3 +325,96 @@ class UtilsTestCase(IntegrationTestCase):
                 (datetime(2012, 1, 10), datetime(2012, 1, 12)),
             ]
         )
+
+    def test_get_resources_by_uuids(self):
+        self.login_manager()
+
+        first, second = self.create_resource(), self.create_resource()
+        missing = utils.string_uuid(utils.new_uuid_mirror(
+            utils.real_uuid(first), 'missing'
+        ))
+
+        hyphenated = str(utils.real_uuid(second))
+        brains = utils.get_resources_by_uuids([
+            first.uuid(), hyphenated, utils.real_uuid(first), missing
+        ])
+
+        self.assertEqual(len(brains), 4)
+        self.assertEqual(brains[first.uuid()].getObject(), first)
+        self.assertEqual(brains[utils.real_uuid(first)].getObject(), first)
+        self.assertEqual(brains[hyphenated].getObject(), second)
+        self.assertIs(brains[missing], None)
+
+        self.assertEqual(utils.get_resources_by_uuids([]), {})
+
+    def test_memoize(self):
+        calls = []
+
+        @utils.memoize(maxsize=2)
+        def double(value):
+            calls.append(value)
+            return value * 2
+
+        self.assertEqual(double(1), 2)
+        self.assertEqual(double(1), 2)
+        self.assertEqual(double(2), 4)
+        self.assertEqual(calls, [1, 2])
+
+        # the least recently used value is removed first
+        double(3)
+        double(2)
+        double(1)
+        self.assertEqual(calls, [1, 2, 3, 1])
+        self.assertEqual(len(double.cache), 2)
+
+        info = double.cache.info()
+        self.assertEqual((info['hits'], info['misses']), (2, 4))
+
+        # uncachable arguments are passed on
+        self.assertEqual(double([1]), [1, 1])
+
+    def test_memoize_ttl(self):
+        calls = []
+
+        @utils.memoize(ttl=60)
+        def value():
+            calls.append(1)
+            return len(calls)
+
+        with mock.patch('time.time', return_value=1000):
+            self.assertEqual(value(), 1)
+
+        with mock.patch('time.time', return_value=1059):
+            self.assertEqual(value(), 1)
+
+        with mock.patch('time.time', return_value=1060):
+            self.assertEqual(value(), 2)
+
+    def test_memoize_instances(self):
+
+        class Counter(object):
+            def __init__(self):
+                self.count = 0
+
+            @utils.memoize
+            def next(self):
+                self.count += 1
+                return self.count
+
+        first, second = Counter(), Counter()
+
+        self.assertEqual(first.next(), 1)
+        self.assertEqual(first.next(), 1)
+        self.assertEqual(second.next(), 1)
+
+        # the values are kept on the instances, not on the function
+        self.assertEqual(len(Counter.next.cache), 0)
+
+        names = [i['name'] for i in utils.memoize_statistics()]
+        self.assertEqual(names.count(Counter.next.name), 3)
+
+        del first, second
+        gc.collect()
+
+        names = [i['name'] for i in utils.memoize_statistics()]
+        self.assertEqual(names.count(Counter.next.name), 1)
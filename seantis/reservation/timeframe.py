@@ -1,3 +1,9 @@
+import hashlib
+import threading
+import time
+import transaction
+
+from bisect import bisect_right
 from datetime import datetime
 
 from five import grok
@@ -6,7 +12,11 @@ from plone.dexterity.content import Item
 from plone.memoize import view
 from Products.CMFCore.utils import getToolByName
 from Products.CMFCore.interfaces import IFolderish
+from Products.CMFCore.interfaces import IActionSucceededEvent
 from z3c.form import button
+from zope.component.hooks import getSite
+from zope.lifecycleevent.interfaces import IObjectModifiedEvent
+from zope.lifecycleevent.interfaces import IObjectMovedEvent
 
 from seantis.reservation import _
 from seantis.reservation.base import BaseViewlet
@@ -15,7 +25,13 @@ from seantis.reservation.interfaces import (
 )
 from seantis.reservation import utils
 
-# TODO cache all timeframe stuff for an hour or so.. no frequent updates needed
+# the number of seconds after which the timeframe index of a site is rebuilt,
+# for changes made through other zope instances
+max_age = 5 * 60
+
+# site path -> (timestamp, TimeframeIndex)
+_indexes = {}
+_indexes_lock = threading.Lock()
 
 
 class Timeframe(Item):
@@ -82,6 +98,154 @@ def overlapping_timeframe(context, start, end):
     return None
 
 
+class FolderTimeframes(object):
+    """ The timeframes of a single folder, sorted by start. As timeframes
+    of the same folder may not overlap, the frame of a day is found by
+    bisecting the start dates.
+
+    """
+
+    def __init__(self, frames):
+        frames = sorted(frames)
+
+        self.starts = [f[0] for f in frames]
+        self.ends = [f[1] for f in frames]
+        self.visible = [f[2] for f in frames]
+
+    def is_visible(self, day):
+        """ Returns true if the given day lies in a visible timeframe. """
+        ix = bisect_right(self.starts, day) - 1
+
+        if ix < 0 or self.ends[ix] < day:
+            return False
+
+        return self.visible[ix]
+
+
+class TimeframeIndex(object):
+    """ Holds the timeframes of a site by folder path. """
+
+    def __init__(self, site_path, frames):
+        """ Takes the path of the site and an iterable of
+        (folder path, start, end, visible) tuples.
+
+        """
+
+        self.site_path = site_path
+
+        frames = sorted(frames)
+
+        # the same timeframes lead to the same version on every instance
+        self.version = hashlib.md5(repr(frames)).hexdigest()
+
+        by_folder = {}
+        for folder, start, end, visible in frames:
+            by_folder.setdefault(folder, []).append((start, end, visible))
+
+        self.folders = dict(
+            (folder, FolderTimeframes(f)) for folder, f in by_folder.items()
+        )
+
+    def for_context(self, context):
+        """ Returns the timeframes for the given context (see
+        :func:`timeframes_by_context`) or None if there are none.
+
+        """
+        path = utils.context_path(context)
+        site_depth = len(self.site_path)
+
+        for depth in range(len(path), site_depth - 1, -1):
+            folder = '/'.join(path[:depth])
+
+            if folder in self.folders:
+                return self.folders[folder]
+
+        return None
+
+
+def build_timeframe_index(site):
+    """ Builds the timeframe index of the given site with a single catalog
+    query, using the catalog metadata of the timeframes.
+
+    """
+
+    catalog = getToolByName(site, 'portal_catalog')
+    brains = catalog.unrestrictedSearchResults(
+        portal_type='seantis.reservation.timeframe'
+    )
+
+    return TimeframeIndex(site.getPhysicalPath(), (
+        (
+            b.getPath().rsplit('/', 1)[0], b.start, b.end,
+            b.review_state == 'visible'
+        ) for b in brains
+    ))
+
+
+def timeframe_index(site=None):
+    """ Returns the timeframe index of the given or current site. """
+
+    site = site or getSite()
+    key = '/'.join(site.getPhysicalPath())
+    now = time.time()
+
+    with _indexes_lock:
+        timestamp, index = _indexes.get(key, (0, None))
+
+    if index is None or now - timestamp >= max_age:
+        index = build_timeframe_index(site)
+
+        with _indexes_lock:
+            _indexes[key] = (now, index)
+
+    return index
+
+
+def invalidate_timeframe_index(site=None):
+    """ Drops the timeframe index of the given or current site. The index is
+    dropped again after the current transaction has been committed, as
+    other threads might have built the index from the old state in the
+    meantime.
+
+    """
+
+    site = site or getSite()
+
+    if site is None:
+        return
+
+    key = '/'.join(site.getPhysicalPath())
+
+    def remove(*args):
+        with _indexes_lock:
+            _indexes.pop(key, None)
+
+    remove()
+    transaction.get().addAfterCommitHook(remove)
+
+
+def clear_timeframe_indexes():
+    """ Clears the timeframe indexes of all sites, for testing. """
+    with _indexes_lock:
+        _indexes.clear()
+
+
+@grok.subscribe(ITimeframe, IObjectMovedEvent)
+def on_timeframe_moved(timeframe, event):
+    # includes added and removed timeframes
+    invalidate_timeframe_index()
+
+
+@grok.subscribe(ITimeframe, IObjectModifiedEvent)
+def on_timeframe_modified(timeframe, event):
+    invalidate_timeframe_index()
+
+
+@grok.subscribe(ITimeframe, IActionSucceededEvent)
+def on_timeframe_transition(timeframe, event):
+    invalidate_timeframe_index()
+
+
 class TimeframeAddForm(dexterity.AddForm):
 
     permission = 'cmf.AddPortalContent'
@@ -357,3 +357,12 @@ def upgrade_1032_to_1033(operations, metadata):
     operations.alter_column(
         'allocations', 'reservation_quota_limit',
         new_column_name='quota_limit')
+
+
+@db_upgrade
+def upgrade_1033_to_1034(operations, metadata):
+    from seantis.reservation import outbox
+
+    # the outbox table is only created if it doesn't exist yet, as sites
+    # may share databases
+    outbox.setup_database(operations.get_bind())
@@ -8,7 +8,9 @@ import json
 import re
 import six
 import sys
+import threading
 import time
+import weakref
 
 from copy import deepcopy
 from datetime import datetime, timedelta, date, time as datetime_time
@@ -299,34 +301,175 @@ def request_id_as_int(string):
     return int(''.join(re.findall(_requestid_expr, string)))
 
 
+# all caches of memoized functions and methods still in use
+_memoize_caches = weakref.WeakSet()
+_memoize_caches_lock = threading.Lock()
+
+# marks values missing from the cache, as None is a valid value
+_missing = object()
+
+
+class LRUCache(object):
+    """A cache holding at most maxsize values, each for at most ttl seconds
+    (or forever if ttl is None). Once full, the least recently used value is
+    removed. Counts the hits and misses for :func:`memoize_statistics`.
+
+    """
+
+    def __init__(self, name, maxsize=128, ttl=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        # key -> (timestamp, value), least recently used first
+        self.values = OrderedDict()
+        self.lock = threading.Lock()
+
+        with _memoize_caches_lock:
+            _memoize_caches.add(self)
+
+    def __len__(self):
+        return len(self.values)
+
+    def get(self, key, default=None):
+        with self.lock:
+            timestamp, value = self.values.pop(key, (None, default))
+
+            if timestamp is None or self.is_expired(timestamp):
+                self.misses += 1
+                return default
+
+            self.values[key] = (timestamp, value)
+            self.hits += 1
+
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.values.pop(key, None)
+            self.values[key] = (time.time(), value)
+
+            while len(self.values) > self.maxsize:
+                self.values.popitem(last=False)
+
+    def is_expired(self, timestamp):
+        return self.ttl is not None and time.time() - timestamp >= self.ttl
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+    def info(self):
+        with self.lock:
+            return dict(
+                name=self.name,
+                size=len(self.values),
+                maxsize=self.maxsize,
+                ttl=self.ttl,
+                hits=self.hits,
+                misses=self.misses
+            )
+
+
 class memoize(object):
     """Decorator that caches a function's return value each time it is called.
     If called later with the same arguments, the cached value is returned, and
     not re-evaluated.
+
+    At most maxsize values are kept, each for at most ttl seconds (forever
+    by default), in a :class:`LRUCache`. The values of methods are cached
+    on the instance, so they are gone with the instance::
+
+        @memoize
+        def function(): ...
+
+        @memoize(maxsize=1000, ttl=60)
+        def function(): ...
+
     """
-    def __init__(self, func):
+
+    def __init__(self, func=None, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.func = None
+
+        if func is not None:
+            self.wrap(func)
+
+    def wrap(self, func):
         self.func = func
-        self.cache = {}
+        self.name = '{}.{}'.format(func.__module__, func.__name__)
+        self.cache = LRUCache(self.name, self.maxsize, self.ttl)
+
+        # volatile, so the cache is never stored on persistent objects
+        self.attribute = '_v_memoize_{}_{}'.format(func.__name__, id(self))
+
+        functools.update_wrapper(self, func)
 
     def __call__(self, *args):
+        # used with arguments, the function is passed afterwards
+        if self.func is None:
+            self.wrap(args[0])
+            return self
+
+        return self.lookup(self.cache, args, args)
+
+    def lookup(self, cache, key, args):
         try:
-            return self.cache[args]
-        except KeyError:
-            value = self.func(*args)
-            self.cache[args] = value
-            return value
+            value = cache.get(key, _missing)
         except TypeError:
             # uncachable -- for instance, passing a list as an argument.
             # Better to not cache than to blow up entirely.
             return self.func(*args)
 
+        if value is _missing:
+            value = self.func(*args)
+            cache.set(key, value)
+
+        return value
+
+    def instance_cache(self, obj):
+        cache = obj.__dict__.get(self.attribute)
+
+        if cache is None:
+            cache = LRUCache(self.name, self.maxsize, self.ttl)
+            obj.__dict__[self.attribute] = cache
+
+        return cache
+
     def __repr__(self):
         """Return the function's docstring."""
         return self.func.__doc__
 
     def __get__(self, obj, objtype):
-        """Support instance methods."""
-        return functools.partial(self.__call__, obj)
+        """Support instance methods, caching their values on the instance."""
+        if obj is None:
+            return self
+
+        cache = self.instance_cache(obj)
+
+        def method(*args):
+            return self.lookup(cache, args, (obj, ) + args)
+
+        return method
+
+
+def memoize_statistics(limit=None):
+    """Returns the information of the caches of :class:`memoize` still in
+    use, the largest ones first.
+
+    """
+    with _memoize_caches_lock:
+        caches = list(_memoize_caches)
+
+    infos = sorted(
+        (cache.info() for cache in caches),
+        key=lambda info: (-info['size'], info['name'])
+    )
+
+    return infos[:limit] if limit else infos
 
 
 @memoize
@@ -599,6 +742,47 @@ def get_resource_by_uuid(
     return len(results) == 1 and results[0] or None
 
 
+def get_resources_by_uuids(
+    uuids, ensure_portal_type='seantis.reservation.resource',
+    unrestricted=False
+):
+    """Returns a dictionary with the brains of the given uuids, using a
+    single catalog query. The dictionary is keyed by the uuids as they were
+    passed, uuids without a (unique) brain are mapped to None.
+
+    With unrestricted, the brains are found regardless of the permissions
+    of the current user.
+
+    """
+    uuids = list(uuids)
+
+    if not uuids:
+        return {}
+
+    query = set()
+    for uuid in uuids:
+        query.update(uuid_query(uuid))
+
+    catalog = getToolByName(getSite(), 'portal_catalog')
+    search = unrestricted and catalog.unrestrictedSearchResults or catalog
+
+    if ensure_portal_type:
+        results = search(UID=list(query), portal_type=ensure_portal_type)
+    else:
+        results = search(UID=list(query))
+
+    brains = collections.defaultdict(list)
+    for brain in results:
+        brains[string_uuid(brain.UID)].append(brain)
+
+    resources = {}
+    for uuid in uuids:
+        found = brains.get(string_uuid(uuid), ())
+        resources[uuid] = len(found) == 1 and found[0] or None
+
+    return resources
+
+
 def get_resource_title(resource, title_prefix=''):
     if hasattr(resource, '__parent__'):
         parent = resource.__parent__.title
@@ -774,11 +958,16 @@ def allocation_class(allocation):
 
 
 def event_availability(
-    context, request, scheduler, allocation, start=None, end=None
+    context, request, scheduler, allocation, start=None, end=None,
+    availability=None, waitinglist_length=None
 ):
     """ Returns the availability, the text with the availability and the class
     for the availability to display on the calendar view.
 
+    The availability and the waitinglist length may be passed if they are
+    already known (see CustomScheduler.allocation_statistics), in which
+    case the database is not queried for them.
+
     If start and end are given and the allocation is partly_available
     the availability is set to 100% if the scheduler's find_spot method
     returns True. That is if the timespan between start and end
@@ -798,7 +987,7 @@ def event_availability(
 
     if start and end and allocation.partly_available:
         availability = allocation.find_spot(start, end) and 100 or 0
-    else:
+    elif availability is None:
         availability = scheduler.availability(allocation.start, allocation.end)
 
     spots = int(round(allocation.quota * availability / 100))
@@ -818,7 +1007,11 @@ def event_availability(
 
     # with approval the number of people in the waitinglist have to be shown
     if allocation.approve_manually:
-        length = allocation.waitinglist_length
+        if waitinglist_length is None:
+            length = allocation.waitinglist_length
+        else:
+            length = waitinglist_length
+
         if length == 0:
             text += '\n' + translate(_(u'Waitinglist is Free'))
         elif length == 1:
@@ -969,54 +1162,89 @@ def urlparam(base, url, params):
     if not base.endswith('/'):
         base += '/'
 
-    urlquote = lambda fragment: quote(six.text_type(fragment).encode('utf-8'))
+    query = '?' + urlquery(params)
+    return ''.join(functools.reduce(urljoin, (base, url, query)))
+
+
+def urlquote(fragment):
+    """Returns the given value quoted for the use in a query string."""
+    return quote(six.text_type(fragment).encode('utf-8'))
+
+
+def urlquery(params):
+    """Returns the query string of the given parameters (without '?')."""
     querypair = lambda pair: pair[0] + '=' + urlquote(pair[1])
 
-    query = '?' + '&'.join(map(querypair, params.items()))
-    return ''.join(functools.reduce(urljoin, (base, url, query)))
+    return '&'.join(map(querypair, params.items()))
 
 
-class EventUrls(object):
+class EventUrlCache(object):
+    """Keeps the permission checks, the view urls and the translations used
+    by :class:`EventUrls` for a resource and a request, so they may be
+    shared by all events of a calendar.
+
+    """
+
     def __init__(self, resource, request, exposure):
-        self.resource = resource
         self.base = resource.absolute_url_path()
-        self.request = request
-        self.translate = translator(resource, request)
-        self.menu = {}
-        self.order = []
-        self.exposure = exposure
-        self.default = ""
-        self.move = ""
+        self.is_exposed = exposure.for_views(resource, request)
+        self.translator = translator(resource, request)
 
-    @memoize
-    def restricted_url(self, view):
-        """Returns a function which can be used to build an url with optional
-        parameters. The function only builds the url if the current user has
-        the right to do so.
+        if not self.base.endswith('/'):
+            self.base += '/'
 
-        """
-        base = self.resource.absolute_url_path()
-        is_exposed = self.exposure.for_views(self.resource, self.request)
+        self.views = {}
+        self.translations = {}
+
+    def view_url(self, view):
+        """Returns the url of the given view or None if the current user
+        has no right to use it.
 
-        def build(params):
-            if is_exposed(view):
-                return urlparam(base, view, params)
+        """
+        if view not in self.views:
+            if self.is_exposed(view):
+                self.views[view] = urljoin(self.base, view)
             else:
-                return None
+                self.views[view] = None
+
+        return self.views[view]
+
+    def url(self, view, params):
+        """Same as :func:`urlparam` with the resource as base, if the current
+        user has the right to use the view, None otherwise.
 
-        # return closure
-        return build
+        """
+        url = self.view_url(view)
 
-    @memoize
-    def get_restricted(self, view, params):
-        urlfactory = self.restricted_url(view)
-        if not urlfactory:
+        if url is None:
             return None
 
-        return urlfactory(params)
+        return url + '?' + urlquery(params)
+
+    def translate(self, text):
+        if text not in self.translations:
+            self.translations[text] = self.translator(text)
+
+        return self.translations[text]
+
+
+class EventUrls(object):
+    """Builds the menu and the urls of a calendar event. The urls and the
+    permission checks come from the given :class:`EventUrlCache`, which
+    should be shared by the EventUrls of all events of a resource.
+
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.translate = cache.translate
+        self.menu = {}
+        self.order = []
+        self.default = ""
+        self.move = ""
 
     def menu_add(self, group, name, view, params, target):
-        url = self.get_restricted(view, params)
+        url = self.cache.url(view, params)
         if not url:
             return
 
@@ -1030,19 +1258,36 @@ class EventUrls(object):
         self.menu[group].append(dict(name=name, url=url, target=target))
 
     def default_url(self, view, params):
-        url = self.get_restricted(view, params)
+        url = self.cache.url(view, params)
         if not url:
             return
 
         self.default = url
 
     def move_url(self, view, params):
-        url = self.get_restricted(view, params)
+        url = self.cache.url(view, params)
         if not url:
             return
 
         self.move = url
 
+    def as_template(self):
+        """Returns the menu and the urls in the form expected by
+        context.js.
+
+        """
+        return dict(
+            url=self.default, move=self.move, menu=self.menu, order=self.order
+        )
+
+
+def menu_placeholder(name):
+    """Returns the placeholder of the given parameter in a menu template.
+    The placeholder is not changed by :func:`urlquery`.
+
+    """
+    return '__{}__'.format(name)
+
 
 def get_date_range(day, start_time, end_time):
     """Returns the date-range of a date a start and an end time."""
@@ -89,5 +89,9 @@ setup(name=name, version=version, description=description,
 
       [z3c.autoinclude.plugin]
       target = plone
+
+      [console_scripts]
+      remove-expired-sessions = seantis.reservation.expiry:main
+      process-mail-outbox = seantis.reservation.outbox:main
       """
       )